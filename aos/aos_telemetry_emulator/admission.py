@@ -0,0 +1,305 @@
+"""
+Admission control of the control API servers.
+
+The accepting thread only hands new connections to the classifier thread, which waits for their request lines with
+a selector and puts every connection into one of three bounded queues: control commands go to the priority lane
+which has its own worker, long-polling and debug routes go to the long lane with a few workers of its own, and
+everything else (stats polling, history, metrics) goes to the read lane served by a pool of workers. So commands never
+wait behind reads or slow clients, however many of them arrive. A non-control request is rejected with 503 and
+Retry-After when its client exceeds its rate limit (off by default) or the queue of the lane is full, a connection which does not send
+its request line in time gets 408. Rejections are written by the classifier thread without touching the handlers.
+"""
+import math
+import queue
+import selectors
+import socket
+import time
+from threading import Thread
+
+from telemetry_emulator.config import (
+    ADMISSION_QUEUE_SIZE, ADMISSION_WORKERS, CONTROL_QUEUE_SIZE, CLIENT_RATE_LIMIT, CLIENT_RATE_BURST,
+    GEOFENCE_EVENT_WAITERS
+)
+from telemetry_emulator.metrics import REGISTRY
+
+CONTROL = 'control'
+READ = 'read'
+LONG = 'long'
+# connections which have not sent their request line yet, is a label of rejections only
+PENDING = 'pending'
+
+# routes which change the state of vehicles, both of control_api and emulator_rest
+CONTROL_PATHS = ('/start', '/stop', '/tire_break', '/madness', '/rectangle', '/del-rectangle', '/rectangle-in',
+                 '/rectangle-out', '/test-rectangle', '/attributes', '/scenario')
+# routes which may hold a worker for a long time: long polling of events and debug captures
+LONG_PATHS = ('/geofences/events', '/debug')
+
+# time to wait for the request line of a new connection
+REQUEST_LINE_TIMEOUT = 10
+MAX_REQUEST_LINE = 2048
+# connections waiting for their request lines, new ones are rejected above it
+MAX_PENDING = 256
+# buckets of clients which did not send requests for this time are dropped
+IDLE_BUCKET_TIMEOUT = 60
+
+REJECTED = REGISTRY.counter('emulator_http_rejected_total', 'Connections rejected by admission control',
+                            labels=('lane', 'reason'))
+QUEUED = REGISTRY.gauge('emulator_http_queued_connections', 'Connections waiting for a worker', labels=('lane',))
+# queues of all servers by lane, the gauge is their total length
+_QUEUES = {CONTROL: [], READ: [], LONG: []}
+for _lane in _QUEUES:
+    QUEUED.labels(lane=_lane).function = lambda lane=_lane: sum(q.qsize() for q in _QUEUES[lane])
+
+
+def _matches(path, prefixes):
+    return any(path == prefix or path.startswith(prefix + '/') for prefix in prefixes)
+
+
+def request_lane(request_line):
+    """Lane of the request by its request line (bytes), READ for anything which can't be parsed"""
+    parts = request_line.split(b' ', 2)
+    if len(parts) < 2:
+        return READ
+    path = parts[1].split(b'?', 1)[0].decode('latin-1').rstrip('/')
+    if _matches(path, CONTROL_PATHS):
+        return CONTROL
+    if _matches(path, LONG_PATHS):
+        return LONG
+    return READ
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average and bursts of up to `burst` requests"""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        """Takes a token. Returns 0 if there was one, otherwise seconds till the next token"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionControlMixIn:
+    """
+    Mix-in for socketserver servers which replaces handling of requests in the serving thread by the three lanes.
+    Must be before the server class in bases. Settings are class attributes, rate limit of 0 disables it.
+    """
+    queue_size = ADMISSION_QUEUE_SIZE
+    workers = ADMISSION_WORKERS
+    control_queue_size = CONTROL_QUEUE_SIZE
+    long_queue_size = 16
+    # every long-polling client holds a worker, one more is left for debug routes
+    long_workers = GEOFENCE_EVENT_WAITERS + 1
+    rate_limit = CLIENT_RATE_LIMIT
+    rate_burst = CLIENT_RATE_BURST
+    request_line_timeout = REQUEST_LINE_TIMEOUT
+    # listen backlog, connections dropped by a full backlog are retried by clients only after a second
+    request_queue_size = 128
+
+    def server_activate(self):
+        super().server_activate()
+        self._lanes = {
+            CONTROL: queue.Queue(self.control_queue_size),
+            READ: queue.Queue(self.queue_size),
+            LONG: queue.Queue(self.long_queue_size),
+        }
+        self._buckets = {}  # client -> TokenBucket, is used by the classifier thread only
+        self._buckets_cleaned = time.monotonic()
+        # new connections are passed from the serving thread to the classifier thread, None stops it
+        self._accepted = queue.SimpleQueue()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._classifier = Thread(target=self._classify, name='request-classifier', daemon=True)
+        self._classifier.start()
+
+        self._workers = [(CONTROL, Thread(target=self._work, args=(self._lanes[CONTROL],), name='control-worker',
+                                          daemon=True))]
+        for lane, count in ((READ, self.workers), (LONG, self.long_workers)):
+            self._workers.extend((lane, Thread(target=self._work, args=(self._lanes[lane],),
+                                               name='{}-worker-{}'.format(lane, i), daemon=True))
+                                 for i in range(count))
+        for _, worker in self._workers:
+            worker.start()
+        for lane, lane_queue in self._lanes.items():
+            _QUEUES[lane].append(lane_queue)
+
+    def client_key(self, client_address):
+        """
+        Rate limits are per client IP: clients on the same host, e.g. all local ones, share one limit, as do all unix
+        socket clients
+        """
+        return client_address[0] if isinstance(client_address, tuple) else 'unix'
+
+    def process_request(self, request, client_address):
+        # the serving thread never waits for clients, it only accepts connections
+        self._accepted.put((request, client_address))
+        self._wake_classifier()
+
+    def _wake_classifier(self):
+        try:
+            self._wakeup_writer.send(b'\0')
+        except (BlockingIOError, OSError):
+            # the classifier has not read previous wakeups yet, it will see the connection anyway
+            pass
+
+    def _classify(self):
+        """Waits for request lines of pending connections and admits them into lanes"""
+        selector = selectors.DefaultSelector()
+        selector.register(self._wakeup_reader, selectors.EVENT_READ)
+        pending = {}  # request -> (client address, deadline)
+        try:
+            while True:
+                timeout = None
+                if pending:
+                    timeout = max(0.0, min(deadline for _, deadline in pending.values()) - time.monotonic())
+                for key, _ in selector.select(timeout):
+                    if key.fileobj is self._wakeup_reader:
+                        if not self._register_accepted(selector, pending):
+                            return
+                        continue
+                    request = key.fileobj
+                    request_line = self._peek_request_line(request)
+                    if request_line is not None:
+                        selector.unregister(request)
+                        client_address, _ = pending.pop(request)
+                        self._admit(request, client_address, request_line)
+
+                now = time.monotonic()
+                for request, (client_address, deadline) in list(pending.items()):
+                    if deadline <= now:
+                        selector.unregister(request)
+                        del pending[request]
+                        self._reject(request, PENDING, 'timeout', '408 Request Timeout')
+        finally:
+            for request in pending:
+                self.shutdown_request(request)
+            selector.close()
+
+    def _register_accepted(self, selector, pending):
+        """Moves accepted connections to the selector. Returns False when the classifier must stop"""
+        try:
+            while self._wakeup_reader.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        deadline = time.monotonic() + self.request_line_timeout
+        while True:
+            try:
+                item = self._accepted.get_nowait()
+            except queue.Empty:
+                return True
+            if item is None:
+                return False
+            request, client_address = item
+            if len(pending) >= MAX_PENDING:
+                self._reject(request, PENDING, 'pending_full')
+                continue
+            request.setblocking(False)
+            selector.register(request, selectors.EVENT_READ)
+            pending[request] = (client_address, deadline)
+
+    def _peek_request_line(self, request):
+        """Request line if it is received, b'' for a connection which can't be classified, None to wait more"""
+        try:
+            data = request.recv(MAX_REQUEST_LINE, socket.MSG_PEEK)
+        except BlockingIOError:
+            return None
+        except OSError:
+            return b''
+        if b'\n' in data:
+            return data.split(b'\r\n', 1)[0]
+        # closed connection or too long line, the handler answers it
+        if not data or len(data) >= MAX_REQUEST_LINE:
+            return b''
+        return None
+
+    def _admit(self, request, client_address, request_line):
+        request.setblocking(True)
+        lane = request_lane(request_line)
+        if lane != CONTROL and self.rate_limit > 0:
+            wait = self._take_token(self.client_key(client_address))
+            if wait:
+                self._reject(request, lane, 'rate_limited', retry_after=wait)
+                return
+        try:
+            self._lanes[lane].put_nowait((request, client_address))
+        except queue.Full:
+            self._reject(request, lane, 'queue_full', retry_after=1)
+
+    def _take_token(self, client):
+        now = time.monotonic()
+        if now - self._buckets_cleaned > IDLE_BUCKET_TIMEOUT:
+            self._buckets = {key: bucket for key, bucket in self._buckets.items()
+                             if now - bucket.updated < IDLE_BUCKET_TIMEOUT}
+            self._buckets_cleaned = now
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.rate_limit, self.rate_burst, now)
+        return bucket.take(now)
+
+    def _reject(self, request, lane, reason, status='503 Service Unavailable', retry_after=1):
+        REJECTED.labels(lane=lane, reason=reason).inc()
+        if status.startswith('503'):
+            body = b'Server is overloaded, retry later'
+            headers = 'Retry-After: {}\r\n'.format(max(1, math.ceil(retry_after)))
+        else:
+            body = status.encode('ascii')
+            headers = ''
+        response = 'HTTP/1.0 {}\r\n{}Content-Length: {}\r\nConnection: close\r\n\r\n'.format(status, headers, len(body))
+        try:
+            # the classifier thread must not wait for the client: the response is small enough for a socket buffer
+            request.setblocking(False)
+            # read what is already received, closing a socket with unread data resets the connection
+            try:
+                request.recv(65536)
+            except OSError:
+                pass
+            request.send(response.encode('ascii') + body)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def _work(self, lane_queue):
+        while True:
+            item = lane_queue.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        if hasattr(self, '_accepted'):
+            self._accepted.put(None)
+            self._wake_classifier()
+            self._classifier.join()
+            self._wakeup_reader.close()
+            self._wakeup_writer.close()
+        for lane_queue in getattr(self, '_lanes', {}).values():
+            # pending connections are dropped, every worker exits on its own None
+            while True:
+                try:
+                    request, _ = lane_queue.get_nowait()
+                except queue.Empty:
+                    break
+                self.shutdown_request(request)
+        for lane, _ in getattr(self, '_workers', ()):
+            try:
+                self._lanes[lane].put_nowait(None)
+            except queue.Full:
+                pass
@@ -0,0 +1,298 @@
+"""
+Benchmarks of emulator, routing and control API hot paths with stored baselines.
+
+Every benchmark runs offline on synthetic grid maps (see mapgen.py) and reports one value where lower is better:
+seconds per operation (the best of several repeats, which is the least disturbed by other processes) or bytes.
+Results can be saved as a baseline and later runs compared with it, a benchmark which is slower than the baseline
+by more than the threshold is a regression and the exit code is 1.
+
+Usage:
+    python3 benchmarks.py --save-baseline baseline.json
+    python3 benchmarks.py --baseline baseline.json --threshold 0.2
+    python3 benchmarks.py --filter update --quick
+"""
+import argparse
+from collections import OrderedDict
+import gc
+import http.client
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telemetry_emulator.emulator import Emulator, VertexPool
+from telemetry_emulator.fleet import Fleet
+from telemetry_emulator.mapgen import grid, write_map
+
+GRID_STEP = 150  # meters between crossroads
+# side of square grid maps, in vertices
+SMALL_MAP = 30
+LARGE_MAP = 300
+PLAN_LENGTHS = (3, 10, 30, 100)
+UPDATE_VEHICLES = 20
+DEFAULT_THRESHOLD = 0.2
+
+
+def measure(function, min_time, repeat=5):
+    """Seconds per call of function: calls are batched so that a batch takes at least min_time / repeat"""
+    batch = 1
+    batch_time = min_time / repeat
+    while True:
+        start = time.perf_counter()
+        for _ in range(batch):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= batch_time:
+            break
+        batch = max(batch * 2, int(batch * batch_time / elapsed) if elapsed > 0 else batch * 10)
+    timings = [elapsed]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(batch):
+            function()
+        timings.append(time.perf_counter() - start)
+    return min(timings) / batch
+
+
+class Context:
+    """Maps written to a temporary directory, shared by benchmarks"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._paths = {}
+        self._pools = {}
+
+    def map_path(self, side):
+        path = self._paths.get(side)
+        if path is None:
+            path = self._paths[side] = os.path.join(self.directory, 'grid{}.json'.format(side))
+            with open(path, 'w') as file:
+                write_map(grid(side, side, GRID_STEP), file)
+        return path
+
+    def vertex_pool(self, side):
+        pool = self._pools.get(side)
+        if pool is None:
+            pool = self._pools[side] = VertexPool(self.map_path(side))
+        return pool
+
+
+def bench_update(context, min_time, plan_length):
+    emulator_class = type('Emulator', (Emulator,), {'PLAN_LENGTH': plan_length})
+    # several vehicles, so that the time does not depend on what one of them happens to do
+    emulators = [emulator_class(context.vertex_pool(SMALL_MAP), seed=seed) for seed in range(UPDATE_VEHICLES)]
+
+    def function():
+        for emulator in emulators:
+            emulator.update(0.1)
+
+    for _ in range(100):
+        function()
+    return measure(function, min_time) / len(emulators)
+
+
+def bench_get_data(context, min_time, encode):
+    emulator = Emulator(context.vertex_pool(SMALL_MAP), seed=1)
+    emulator.update(0.1)
+
+    def function():
+        # cached properties are computed again as on a new tick of the simulation loop
+        emulator._invalidate_tick_cache()
+        data = emulator.get_data()
+        if encode:
+            json.dumps(data)
+
+    return measure(function, min_time)
+
+
+def bench_rectangle_plan(context, min_time, side):
+    vertex_pool = context.vertex_pool(side)
+    emulator = Emulator(vertex_pool, seed=1)
+    # the opposite corner of the map from the vehicle, so that the search crosses most of it
+    far_x = 0 if emulator.x > side * GRID_STEP / 2 else (side - 1) * GRID_STEP
+    far_y = 0 if emulator.y > side * GRID_STEP / 2 else (side - 1) * GRID_STEP
+    size = GRID_STEP * 2
+    x0, y0 = max(0, far_x - size), max(0, far_y - size)
+    emulator.set_rectangle(vertex_pool.x_to_lon(x0), vertex_pool.y_to_lat(y0),
+                           vertex_pool.x_to_lon(x0 + size), vertex_pool.y_to_lat(y0 + size))
+    emulator.set_rectangle_direction(True)
+    return measure(emulator._create_rectangle_movement_plan, min_time)
+
+
+def bench_vertex_pool_load(context, min_time, side):
+    path = context.map_path(side)
+    return measure(lambda: VertexPool(path), min_time, repeat=3)
+
+
+def bench_vertex_pool_memory(context, min_time, side):
+    path = context.map_path(side)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        vertex_pool = VertexPool(path)
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del vertex_pool
+    return current
+
+
+def bench_http_stats(context, min_time):
+    from telemetry_emulator.emulator_rest import RestEmulatorAPIServer, RestEmulatorCommandsRequestHandler
+
+    class QuietRequestHandler(RestEmulatorCommandsRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    vertex_pool = context.vertex_pool(SMALL_MAP)
+    fleet = Fleet(OrderedDict((vin, Emulator(vertex_pool, seed=i)) for i, vin in enumerate(['V0', 'V1', 'V2'])))
+    server = RestEmulatorAPIServer(('127.0.0.1', 0), fleet.primary, fleet)
+    server.RequestHandlerClass = QuietRequestHandler
+    # a single client polls as fast as it can
+    server.rate_limit = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+
+    def function():
+        # the server speaks HTTP/1.0 and closes connection after each response
+        connection = http.client.HTTPConnection(host, port, timeout=5)
+        connection.request('GET', '/stats')
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        if response.status != 200:
+            raise RuntimeError("/stats returned {}".format(response.status))
+
+    try:
+        return measure(function, min_time)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+# name -> (unit, function(context, min_time))
+BENCHMARKS = OrderedDict()
+for _plan_length in PLAN_LENGTHS:
+    BENCHMARKS['update/plan_length={}'.format(_plan_length)] = (
+        's', lambda context, min_time, plan_length=_plan_length: bench_update(context, min_time, plan_length))
+BENCHMARKS['get_data'] = ('s', lambda context, min_time: bench_get_data(context, min_time, encode=False))
+BENCHMARKS['get_data+json'] = ('s', lambda context, min_time: bench_get_data(context, min_time, encode=True))
+for _name, _side in (('small', SMALL_MAP), ('large', LARGE_MAP)):
+    BENCHMARKS['rectangle_plan/{}'.format(_name)] = (
+        's', lambda context, min_time, side=_side: bench_rectangle_plan(context, min_time, side))
+    BENCHMARKS['vertex_pool_load/{}'.format(_name)] = (
+        's', lambda context, min_time, side=_side: bench_vertex_pool_load(context, min_time, side))
+    BENCHMARKS['vertex_pool_memory/{}'.format(_name)] = (
+        'bytes', lambda context, min_time, side=_side: bench_vertex_pool_memory(context, min_time, side))
+BENCHMARKS['http_stats'] = ('s', bench_http_stats)
+
+
+def run(names, min_time):
+    results = OrderedDict()
+    with tempfile.TemporaryDirectory(prefix='emulator-benchmarks-') as directory:
+        context = Context(directory)
+        for name in names:
+            unit, function = BENCHMARKS[name]
+            # random choices of benchmarked code are the same in every run
+            random.seed(0)
+            results[name] = {"value": function(context, min_time), "unit": unit}
+    return results
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def format_value(value, unit):
+    if unit == 'bytes':
+        return "{:.1f} MB".format(value / 1024 / 1024) if value >= 1024 * 1024 else "{:.1f} kB".format(value / 1024)
+    for scale, suffix in ((1, 's'), (1e-3, 'ms'), (1e-6, 'us')):
+        if value >= scale:
+            return "{:.2f} {}".format(value / scale, suffix)
+    return "{:.1f} ns".format(value * 1e9)
+
+
+def find_regressions(results, baseline, threshold):
+    """Returns {name: relative change} of benchmarks which are slower than baseline by more than threshold"""
+    regressions = OrderedDict()
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is not None and base["value"] > 0:
+            change = result["value"] / base["value"] - 1
+            if change > threshold:
+                regressions[name] = change
+    return regressions
+
+
+def print_results(results, baseline, regressions):
+    for name, result in results.items():
+        line = "{:<30} {:>12}".format(name, format_value(result["value"], result["unit"]))
+        base = baseline.get(name)
+        if base is not None and base["value"] > 0:
+            line += "  {:>12} {:+7.1f}%".format(format_value(base["value"], base["unit"]),
+                                               (result["value"] / base["value"] - 1) * 100)
+            if name in regressions:
+                line += "  REGRESSION"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run emulator benchmarks and compare them with a baseline")
+    parser.add_argument('--filter', default='', help="run benchmarks which names contain this string")
+    parser.add_argument('--list', action='store_true', help="print names of benchmarks")
+    parser.add_argument('--min-time', type=float, default=1.0, help="seconds of measurement of one benchmark")
+    parser.add_argument('--quick', action='store_true', help="shorter measurements, for smoke runs")
+    parser.add_argument('--baseline', help="baseline JSON file to compare with")
+    parser.add_argument('--save-baseline', help="write results to this baseline JSON file")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="relative slowdown against baseline which is reported as regression")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if args.filter in name]
+    if args.list:
+        print('\n'.join(names))
+        return
+    if not names:
+        parser.error("no benchmark matches {}".format(args.filter))
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            document = json.load(file)
+        if document.get("environment") != environment():
+            print("warning: baseline was recorded in another environment: {}".format(document.get("environment")))
+        baseline = document["results"]
+
+    results = run(names, 0.1 if args.quick else args.min_time)
+    document = {"created": time.time(), "environment": environment(), "results": results}
+    regressions = find_regressions(results, baseline, args.threshold)
+    if args.json:
+        document["regressions"] = regressions
+        print(json.dumps(document, indent=2))
+    else:
+        print_results(results, baseline, regressions)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump(document, file, indent=2)
+    if regressions:
+        print("{} regressions: {}".format(len(regressions), ', '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Versioned checkpoints of the dynamic fleet state for warm restarts.
+
+Checkpoint is a compact JSON document with the map fingerprint and Emulator.get_state() of every vehicle.
+The map itself is never stored: vertices are referred by id and the checkpoint is ignored for another map.
+Files are replaced atomically, so a crash during writing leaves the previous checkpoint intact.
+"""
+import json
+import logging
+import os
+import queue
+import struct
+import tempfile
+import threading
+import time
+
+CHECKPOINT_VERSION = 2
+# errors of Emulator.set_state() for a state of wrong structure or with unknown vertex ids
+MALFORMED_STATE_ERRORS = (KeyError, TypeError, ValueError, IndexError, AttributeError, struct.error)
+
+logger = logging.getLogger(__name__)
+
+
+def fleet_state(fleet):
+    return {
+        "version": CHECKPOINT_VERSION,
+        "created": time.time(),
+        "map": fleet.vertex_pool.fingerprint(),
+        "vehicles": {vin: emulator.get_state() for vin, emulator in fleet.vehicles.items()},
+    }
+
+
+def write_checkpoint(path, state):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.checkpoint-', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as file:
+            json.dump(state, file, separators=(',', ':'))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def save_checkpoint(path, fleet):
+    write_checkpoint(path, fleet_state(fleet))
+
+
+def restore_checkpoint(path, fleet):
+    """
+    Restores vehicles of the fleet from checkpoint file. Returns list of restored VINs.
+    Missing, outdated, malformed or foreign-map checkpoint restores nothing.
+    """
+    try:
+        with open(path, 'r') as file:
+            state = json.load(file)
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as ex:
+        logger.warning("Can't read checkpoint {}: {}".format(path, ex))
+        return []
+
+    if not isinstance(state, dict):
+        logger.warning("Checkpoint {} is not a JSON object".format(path))
+        return []
+    if state.get("version") != CHECKPOINT_VERSION:
+        logger.warning("Checkpoint {} has version {}, expected {}".format(path, state.get("version"),
+                                                                           CHECKPOINT_VERSION))
+        return []
+    if state.get("map") != fleet.vertex_pool.fingerprint():
+        logger.warning("Checkpoint {} was made for another map".format(path))
+        return []
+
+    # vehicles restored before a malformed entry is found are rolled back, so the fleet starts fresh
+    fresh = {}
+    try:
+        for vin, vehicle_state in state["vehicles"].items():
+            if vin in fleet:
+                fresh[vin] = fleet[vin].get_state()
+                fleet[vin].set_state(vehicle_state)
+    except MALFORMED_STATE_ERRORS as ex:
+        logger.warning("Checkpoint {} is malformed, starting fresh: {!r}".format(path, ex))
+        for vin, vehicle_state in fresh.items():
+            fleet[vin].set_state(vehicle_state)
+        fleet.reindex()
+        return []
+    fleet.reindex()
+    return list(fresh)
+
+class Checkpointer:
+    """
+    Makes checkpoint every `interval` seconds. State is captured in the simulation loop thread by tick(),
+    encoding and writing are done in background thread. If the writer is still busy, the newest state wins.
+    """
+
+    def __init__(self, path, fleet, interval):
+        self.path = path
+        self.fleet = fleet
+        self.interval = interval
+        self._last_checkpoint = time.monotonic()
+        self._write_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=1)
+        self._thread = threading.Thread(target=self._write_loop, name='checkpointer', daemon=True)
+        self._thread.start()
+
+    def tick(self):
+        now = time.monotonic()
+        if now - self._last_checkpoint < self.interval:
+            return
+        self._last_checkpoint = now
+        state = fleet_state(self.fleet)
+        try:
+            self._queue.put_nowait(state)
+        except queue.Full:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._queue.put_nowait(state)
+
+    def save_now(self):
+        """Synchronous checkpoint, e.g. on shutdown. Pending older state is dropped"""
+        try:
+            self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        state = fleet_state(self.fleet)
+        with self._write_lock:
+            write_checkpoint(self.path, state)
+
+    def _write_loop(self):
+        while True:
+            state = self._queue.get()
+            try:
+                with self._write_lock:
+                    write_checkpoint(self.path, state)
+            except Exception as ex:
+                logger.exception("Can't write checkpoint", exc_info=ex)
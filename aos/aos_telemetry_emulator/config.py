@@ -5,9 +5,67 @@ import os
 # emulator data update time
 EMULATOR_UPDATE_TIME = 1
 
-# Listen address
-CONTROL_API_ADDRESS = ("0.0.0.0", 8088)
+# Listen address. Set CONTROL_API_TCP=0 to listen on the unix socket only
+CONTROL_API_ADDRESS = ("0.0.0.0", 8088) if os.environ.get("CONTROL_API_TCP", "1") != "0" else None
+
+# Unix domain socket for local consumers. Empty value disables it
+CONTROL_API_UNIX_SOCKET = os.environ.get("CONTROL_API_UNIX_SOCKET", "")
+# Permissions of the unix socket file (octal)
+CONTROL_API_UNIX_SOCKET_MODE = int(os.environ.get("CONTROL_API_UNIX_SOCKET_MODE", "660"), 8)
+
+# Admission control of the control API (see admission.py): connections waiting for a worker before 503 is returned,
+# number of workers serving reads (control commands have their own worker, long-polling and debug routes have
+# GEOFENCE_EVENT_WAITERS + 1 workers) and queue of control commands
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", 64))
+ADMISSION_WORKERS = int(os.environ.get("ADMISSION_WORKERS", 4))
+CONTROL_QUEUE_SIZE = int(os.environ.get("CONTROL_QUEUE_SIZE", 32))
+# Requests per second of one client to non-control routes, 0 (default) disables the limit. Clients are told apart
+# by IP only: all clients on localhost share one limit, as do all unix socket clients
+CLIENT_RATE_LIMIT = float(os.environ.get("CLIENT_RATE_LIMIT", 0))
+# Requests a client can send at once above the rate
+CLIENT_RATE_BURST = int(os.environ.get("CLIENT_RATE_BURST", 100))
+
+# Clients which may long-poll /geofences/events at once, others get 503. Every waiting client holds a worker
+# of the long lane of admission control
+GEOFENCE_EVENT_WAITERS = int(os.environ.get("GEOFENCE_EVENT_WAITERS", 2))
+
+# Shared memory file where every tick's telemetry is published for local readers (see shm_channel.py).
+# Empty value disables publishing
+SHM_TELEMETRY_PATH = os.environ.get("SHM_TELEMETRY_PATH", "/dev/shm/telemetry_emulator")
 
 # Vehicle VIN and driver UUID
 DRIVER_UUID = os.environ.get("DRIVER_UUID", "NoDriverUUID")
 VEHICLE_VIN = os.environ.get("VEHICLE_VIN", "NoVIN")
+
+# Tiled map built by tiles.py. Empty value means map.json which is loaded into memory entirely
+MAP_TILES_FILE = os.environ.get("MAP_TILES_FILE", "")
+# Memory budget of loaded tiles, megabytes
+MAP_TILES_MEMORY_BUDGET = int(os.environ.get("MAP_TILES_MEMORY_BUDGET", 64)) * 1024 * 1024
+
+# Number of simulated vehicles. The first one uses VEHICLE_VIN, others get VEHICLE_VIN with numeric suffix
+FLEET_SIZE = int(os.environ.get("FLEET_SIZE", 1))
+# Default number of vehicles in one page of /fleet/stats
+FLEET_PAGE_SIZE = 100
+
+# Fleet vehicles follow vehicles ahead on the road instead of passing through them
+TRAFFIC_INTERACTION = os.environ.get("TRAFFIC_INTERACTION", "1") == "1"
+
+# Skip updates of vehicles standing still on command till their next event (see Emulator.defer)
+ADAPTIVE_TICKING = os.environ.get("ADAPTIVE_TICKING", "0") == "1"
+
+# Samples of telemetry history kept for every vehicle (one per tick), 0 disables /history
+HISTORY_CAPACITY = int(os.environ.get("HISTORY_CAPACITY", 600))
+
+# Trip aggregates (distance, fuel, harsh braking, ...) of every vehicle are served by /trip
+TRIP_ANALYTICS = os.environ.get("TRIP_ANALYTICS", "1") == "1"
+
+# Dynamic state of the fleet is saved here periodically and restored on start. Empty value disables checkpoints
+CHECKPOINT_PATH = os.environ.get("CHECKPOINT_PATH", "/var/lib/telemetry_emulator/checkpoint.json")
+# seconds between checkpoints
+CHECKPOINT_INTERVAL = float(os.environ.get("CHECKPOINT_INTERVAL", 10))
+
+# Scenario (timeline of commands, see scenario.py) loaded on start. Empty value means no scenario
+SCENARIO_FILE = os.environ.get("SCENARIO_FILE", "")
+
+# Time phases of emulator update from the start. Can be switched with /debug/timings/enable and /disable
+PROFILING_ENABLED = os.environ.get("EMULATOR_PROFILING", "0") == "1"
@@ -1,6 +1,7 @@
 import logging
 import re
 from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlsplit, parse_qs
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +31,7 @@ class ControlApiSever(HTTPServer):
 class EmulatorCommandsRequestHandler(BaseHTTPRequestHandler):
     def setup(self):
         super().setup()
+        self.route = None
         self._urls = [
             (r'^/start/?$', self._start),
             (r'^/stop/?$', self._stop),
@@ -49,8 +51,16 @@ class EmulatorCommandsRequestHandler(BaseHTTPRequestHandler):
     def emulator(self):
         return self.server.emulator
 
+    def address_string(self):
+        # Clients of unix domain socket have no address
+        if not isinstance(self.client_address, tuple):
+            return 'unix:{}'.format(self.server.server_address)
+        return super().address_string()
+
     def do_GET(self):
-        request_path = self.path
+        url = urlsplit(self.path)
+        request_path = url.path
+        self.query = parse_qs(url.query)
         try:
             self._handle(request_path)
         except HttpResponseException as ex:
@@ -63,10 +73,20 @@ class EmulatorCommandsRequestHandler(BaseHTTPRequestHandler):
         for url_pattern, handle_function in self._urls:
             m = re.match(url_pattern, request_path)
             if m:
+                self.route = handle_function.__name__.strip('_')
                 handle_function(**m.groupdict())
                 return
         raise NotFoundException()
 
+    def query_param(self, name, default=None, convert=str):
+        values = self.query.get(name)
+        if not values:
+            return default
+        try:
+            return convert(values[-1])
+        except ValueError:
+            raise BadRequestException(message='Invalid value of {} parameter'.format(name))
+
     def response(self, status, body=None):
         self.send_response(status)
         self.end_headers()
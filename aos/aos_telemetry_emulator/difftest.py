@@ -0,0 +1,368 @@
+"""
+Differential test of emulator engines: a candidate engine must produce the same telemetry as the reference Emulator.
+
+Both engines drive fleets of vehicles with the same seeds through the same command script (scenario events, either
+random or loaded from a scenario file), telemetry of every vehicle is compared within declared tolerances. To cover
+many ticks quickly, telemetry is compared every --check-every ticks only. When a divergence is found, the case is
+replayed from the start up to every tick since the last good check, reading telemetry at the same ticks as the run
+(reads catch up skipped vehicles of the adaptive candidate), so the report has the first diverging tick, the fields
+which differ, the events executed so far and get_state() dumps of the vehicle in both engines before and after it.
+
+Candidates:
+    adaptive      fleet which skips updates of steady vehicles (Fleet adaptive=True)
+    checkpoint    vehicles are saved with get_state(), passed through JSON and restored into new Emulator objects
+                  every --checkpoint-interval ticks
+    module:Class  class with the Emulator interface, is created as Class(vertex_pool, seed=seed)
+
+Usage:
+    python3 difftest.py adaptive --map map.json --cases 20 --vehicles 50 --ticks 2000 --jobs 4
+    python3 difftest.py checkpoint --map map.json --scenario scenario.json --report divergence.json
+"""
+import argparse
+from collections import OrderedDict
+import importlib
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telemetry_emulator.checkpoint import fleet_state
+from telemetry_emulator.emulator import Emulator, VertexPool
+from telemetry_emulator.fleet import Fleet
+from telemetry_emulator.scenario import event_from_dict, load_scenario
+
+# kinematics which get_data() rounds or does not report, divergences are found before they become visible
+RAW_FIELDS = ('x', 'y', 'speed', 'acceleration', 'tire_pressure', 'tick', 'time')
+# absolute tolerances of float fields, other fields must be equal
+DEFAULT_TOLERANCES = {
+    'x': 1e-6,
+    'y': 1e-6,
+    'lat': 1e-11,
+    'lon': 1e-11,
+    'speed': 1e-9,
+    'acceleration': 1e-9,
+    'tire_pressure': 1e-9,
+    'time': 1e-9,
+    'veh_speed': 1e-6,
+    'vehspddisp': 1e-6,
+}
+DEFAULT_CHECKPOINT_INTERVAL = 100
+
+# (command, weight) of random scripts
+RANDOM_COMMANDS = (
+    ('stop', 4),
+    ('go', 4),
+    ('tire_break', 1),
+    ('madness', 2),
+    ('rectangle', 2),
+    ('rectangle_in', 2),
+    ('rectangle_out', 1),
+    ('del_rectangle', 1),
+)
+
+
+def telemetry(emulator):
+    data = emulator.get_data()
+    for field in RAW_FIELDS:
+        data[field] = getattr(emulator, field)
+    return data
+
+
+def compare(reference, candidate, tolerances):
+    """Returns list of (field, reference value, candidate value) which differ"""
+    differences = []
+    for field in sorted(set(reference) | set(candidate)):
+        expected, actual = reference.get(field), candidate.get(field)
+        if expected == actual:
+            continue
+        tolerance = tolerances.get(field)
+        if tolerance is not None and _is_number(expected) and _is_number(actual) \
+                and abs(expected - actual) <= tolerance:
+            continue
+        differences.append((field, expected, actual))
+    return differences
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class CheckpointFleet(Fleet):
+    """Fleet which replaces its vehicles by new ones restored from their serialized state"""
+
+    def __init__(self, vehicles, interval=DEFAULT_CHECKPOINT_INTERVAL, **kwargs):
+        super().__init__(vehicles, **kwargs)
+        self.interval = interval
+
+    def update(self, time_delta=1.0):
+        super().update(time_delta)
+        if self.tick % self.interval == 0:
+            self.round_trip()
+
+    def round_trip(self):
+        state = json.loads(json.dumps(fleet_state(self)))
+        for vin, vehicle_state in state["vehicles"].items():
+            # a seed which is never used by the harness, the random state must come from the checkpoint
+            emulator = Emulator(self.vertex_pool, seed=-1)
+            emulator.set_state(vehicle_state)
+            emulator.traffic = self.traffic
+            self.vehicles[vin] = emulator
+            if self.traffic is not None:
+                self.traffic.remove(vin)
+        self.reindex()
+
+
+def engine_factory(name, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
+    """Returns function (vertex_pool, seeds, traffic) -> Fleet of the engine"""
+    def vehicles(emulator_class, vertex_pool, seeds):
+        return OrderedDict(('V{:05d}'.format(i), emulator_class(vertex_pool, seed=seed))
+                           for i, seed in enumerate(seeds))
+
+    if name == 'reference':
+        return lambda vertex_pool, seeds, traffic: Fleet(vehicles(Emulator, vertex_pool, seeds), traffic=traffic)
+    if name == 'adaptive':
+        return lambda vertex_pool, seeds, traffic: Fleet(vehicles(Emulator, vertex_pool, seeds), traffic=traffic,
+                                                         adaptive=True)
+    if name == 'checkpoint':
+        return lambda vertex_pool, seeds, traffic: CheckpointFleet(vehicles(Emulator, vertex_pool, seeds),
+                                                                   checkpoint_interval, traffic=traffic)
+    module_name, _, class_name = name.partition(':')
+    if not class_name:
+        raise ValueError("Unknown engine {}, expected adaptive, checkpoint or module:Class".format(name))
+    emulator_class = getattr(importlib.import_module(module_name), class_name)
+    return lambda vertex_pool, seeds, traffic: Fleet(vehicles(emulator_class, vertex_pool, seeds), traffic=traffic)
+
+
+def map_bounds(vertex_pool):
+    """(long0, lat0, long1, lat1) of the map"""
+    xs = [vertex.x for vertex in vertex_pool.vertices]
+    ys = [vertex.y for vertex in vertex_pool.vertices]
+    return (vertex_pool.x_to_lon(min(xs)), vertex_pool.y_to_lat(min(ys)),
+            vertex_pool.x_to_lon(max(xs)), vertex_pool.y_to_lat(max(ys)))
+
+
+def random_script(rng, ticks, vins, bounds, rate):
+    """Scenario event dicts with `rate` events per tick on average, every event is for one vehicle or for all"""
+    commands = [command for command, _ in RANDOM_COMMANDS]
+    weights = [weight for _, weight in RANDOM_COMMANDS]
+    long0, lat0, long1, lat1 = bounds
+    events = []
+    for tick in range(ticks):
+        count = int(rate) + (rng.random() < rate - int(rate))
+        for _ in range(count):
+            event = {"tick": tick, "command": rng.choices(commands, weights)[0]}
+            if event["command"] == 'madness':
+                event["args"] = [rng.choice((0, round(rng.uniform(0.05, 1), 2)))]
+            elif event["command"] == 'rectangle':
+                width, height = (long1 - long0) * rng.uniform(0.05, 0.3), (lat1 - lat0) * rng.uniform(0.05, 0.3)
+                x, y = rng.uniform(long0, long1 - width), rng.uniform(lat0, lat1 - height)
+                event["args"] = [x, y, x + width, y + height]
+            if rng.random() < 0.9:
+                event["vehicle"] = rng.choice(vins)
+            events.append(event)
+    return events
+
+
+class Case:
+    """One run of both engines: seeds of vehicles, number of ticks and the command script"""
+
+    def __init__(self, number, seeds, ticks, time_delta, events, traffic):
+        self.number = number
+        self.seeds = seeds
+        self.ticks = ticks
+        self.time_delta = time_delta
+        self.events = events
+        self.traffic = traffic
+
+    def to_dict(self):
+        return {
+            "case": self.number,
+            "seeds": self.seeds,
+            "ticks": self.ticks,
+            "time_delta": self.time_delta,
+            "traffic": self.traffic,
+        }
+
+
+class Harness:
+    def __init__(self, vertex_pool, reference, candidate, tolerances, check_every):
+        self.vertex_pool = vertex_pool
+        self.reference = reference
+        self.candidate = candidate
+        self.tolerances = tolerances
+        self.check_every = check_every
+
+    def _fleets(self, case):
+        fleets = []
+        for factory in (self.reference, self.candidate):
+            fleet = factory(self.vertex_pool, case.seeds, case.traffic)
+            fleet.load_scenario([event_from_dict(event) for event in case.events])
+            fleets.append(fleet)
+        return fleets
+
+    def run(self, case):
+        """Returns divergence report dict or None if engines agree"""
+        reference, candidate = self._fleets(case)
+        last_good = 0
+        for tick in range(1, case.ticks + 1):
+            reference.update(case.time_delta)
+            candidate.update(case.time_delta)
+            if tick % self.check_every == 0 or tick == case.ticks:
+                if self._first_difference(reference, candidate) is not None:
+                    return self._locate(case, last_good, tick)
+                last_good = tick
+        return None
+
+    def _first_difference(self, reference, candidate):
+        for vin in reference:
+            differences = compare(telemetry(reference[vin]), telemetry(candidate[vin]), self.tolerances)
+            if differences:
+                return vin, differences
+        return None
+
+    def _replay(self, case, last_good, ticks):
+        """
+        Fleets of the case after `ticks` ticks. Up to last_good telemetry is read at the same ticks as by run():
+        reading catches up vehicles skipped by the adaptive candidate, so other reads could hide the divergence
+        """
+        reference, candidate = self._fleets(case)
+        for tick in range(1, ticks + 1):
+            reference.update(case.time_delta)
+            candidate.update(case.time_delta)
+            if tick <= last_good and tick % self.check_every == 0:
+                self._first_difference(reference, candidate)
+        return reference, candidate
+
+    def _locate(self, case, last_good, diverged):
+        """
+        Finds the first diverging tick after last_good, the divergence is at or before `diverged`. Every tick is
+        checked by its own replay which reads telemetry only at this tick after last_good, so the engines are
+        observed as by run() and the replay of `diverged` reproduces it
+        """
+        for tick in range(last_good + 1, diverged + 1):
+            reference, candidate = self._replay(case, last_good, tick)
+            difference = self._first_difference(reference, candidate)
+            if difference is None:
+                continue
+            vin, differences = difference
+            reference_before, candidate_before = self._replay(case, last_good, tick - 1)
+            return {
+                **case.to_dict(),
+                "tick": tick,
+                "vehicle": vin,
+                "differences": [{"field": field, "reference": expected, "candidate": actual}
+                                for field, expected, actual in differences],
+                "events": [event for event in case.events if event["tick"] < tick],
+                "state_before": {"reference": reference_before[vin].get_state(),
+                                 "candidate": _state(candidate_before[vin])},
+                "state_after": {"reference": reference[vin].get_state(), "candidate": _state(candidate[vin])},
+            }
+        raise AssertionError("Divergence at tick {} of case {} is not reproduced".format(diverged, case.number))
+
+def _state(emulator):
+    return emulator.get_state() if hasattr(emulator, 'get_state') else None
+
+
+def make_cases(args, vertex_pool, script):
+    bounds = map_bounds(vertex_pool) if script is None else None
+    cases = []
+    for number in range(args.cases):
+        rng = random.Random(args.seed + number)
+        seeds = [rng.getrandbits(32) for _ in range(args.vehicles)]
+        vins = ['V{:05d}'.format(i) for i in range(args.vehicles)]
+        events = script if script is not None else random_script(rng, args.ticks, vins, bounds, args.event_rate)
+        cases.append(Case(number, seeds, args.ticks, args.time_delta, events, args.traffic))
+    return cases
+
+
+_harness = None
+
+
+def _init_worker(args):
+    global _harness
+    _harness = create_harness(args)
+
+
+def _run_case(case):
+    return _harness.run(case)
+
+
+def create_harness(args):
+    tolerances = dict(DEFAULT_TOLERANCES)
+    tolerances.update(args.tolerance)
+    return Harness(VertexPool(args.map), engine_factory('reference'),
+                   engine_factory(args.candidate, args.checkpoint_interval), tolerances, args.check_every)
+
+
+def parse_tolerance(value):
+    field, _, tolerance = value.partition('=')
+    try:
+        return field, float(tolerance)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected field=tolerance, got {}".format(value))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare telemetry of a candidate engine with the reference Emulator")
+    parser.add_argument('candidate', help="adaptive, checkpoint or module:Class")
+    parser.add_argument('--map', default=os.path.join(os.path.dirname(__file__), 'map.json'),
+                        help="map in VertexPool JSON format")
+    parser.add_argument('--cases', type=int, default=10, help="number of cases, every case has its own seeds")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first case")
+    parser.add_argument('--vehicles', type=int, default=20, help="vehicles in every case")
+    parser.add_argument('--ticks', type=int, default=1000, help="ticks of every case")
+    parser.add_argument('--time-delta', type=float, default=1.0, help="simulated seconds of a tick")
+    parser.add_argument('--traffic', action='store_true', help="vehicles follow vehicles ahead")
+    parser.add_argument('--scenario', help="scenario file used by every case instead of random commands, "
+                                           "vehicles are named V00000, V00001, ...")
+    parser.add_argument('--event-rate', type=float, default=0.05, help="random commands per tick")
+    parser.add_argument('--check-every', type=int, default=10, help="ticks between telemetry comparisons")
+    parser.add_argument('--checkpoint-interval', type=int, default=DEFAULT_CHECKPOINT_INTERVAL,
+                        help="ticks between state round trips of the checkpoint candidate")
+    parser.add_argument('--tolerance', type=parse_tolerance, action='append', default=[],
+                        help="field=absolute tolerance, overrides the default one")
+    parser.add_argument('--jobs', type=int, default=1, help="cases run in parallel")
+    parser.add_argument('--report', help="write divergence report JSON to this file instead of stdout")
+    args = parser.parse_args()
+
+    script = None
+    if args.scenario:
+        script = [event.to_dict() for event in load_scenario(args.scenario)]
+        if any("at" in event for event in script):
+            parser.error("scenario events must use 'tick', 'at' depends on the tick duration")
+    harness = create_harness(args)
+    cases = make_cases(args, harness.vertex_pool, script)
+
+    started = time.perf_counter()
+    if args.jobs > 1:
+        with multiprocessing.Pool(args.jobs, _init_worker, (args,)) as pool:
+            results = pool.imap(_run_case, cases)
+            divergence = next((result for result in results if result is not None), None)
+            pool.terminate()
+    else:
+        divergence = next((result for result in map(harness.run, cases) if result is not None), None)
+    elapsed = time.perf_counter() - started
+
+    if divergence is None:
+        vehicle_ticks = args.cases * args.vehicles * args.ticks
+        print("{} cases, {} vehicle ticks: no divergence ({:.1f}s, {:.0f} vehicle ticks/s)".format(
+            args.cases, vehicle_ticks, elapsed, vehicle_ticks / elapsed))
+        return
+    print("case {case} diverged at tick {tick}, vehicle {vehicle}".format(**divergence))
+    for difference in divergence["differences"]:
+        print("    {field}: reference {reference!r}, candidate {candidate!r}".format(**difference))
+    if args.report:
+        with open(args.report, 'w') as file:
+            json.dump(divergence, file, indent=2)
+        print("report is written to {}".format(args.report))
+    else:
+        print(json.dumps(divergence, indent=2))
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
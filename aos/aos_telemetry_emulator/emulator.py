@@ -1,15 +1,31 @@
 from collections import namedtuple, deque
+import base64
+import heapq
+import itertools
 import random
 import math
 import json
+import struct
 import sys
+import threading
+import time
 import os
+import zlib
 
 Vertex = namedtuple('Vertex', ['id', 'x', 'y', 'neighbors'])
 # neighbors - list of id
 Point = namedtuple('Point', ['longitude', 'latitude'])
 
 
+def vertex_checksum(vertices, checksum=0):
+    """CRC32 of ids, coordinates and neighbours of the vertices, maps of the same size differ by it"""
+    for vertex in vertices:
+        neighbors = vertex.neighbors
+        checksum = zlib.crc32(struct.pack('<qdd{}q'.format(len(neighbors)), vertex.id, vertex.x, vertex.y,
+                                          *neighbors), checksum)
+    return checksum
+
+
 class VertexPool:
     RAD = 0.000008998719243599958
 
@@ -34,6 +50,17 @@ class VertexPool:
         self.min_lon = data['min_longitude']
 
         self.vertices = [Vertex(v['id'], v['x'], v['y'], v['neighbours']) for v in data['vertices']]
+        self.checksum = vertex_checksum(self.vertices)
+
+    def fingerprint(self):
+        """Identifies the map in checkpoints which refer to vertices by id"""
+        return {
+            "format": "json",
+            "vertices": len(self),
+            "min_latitude": self.min_lat,
+            "min_longitude": self.min_lon,
+            "checksum": self.checksum,
+        }
 
     def __len__(self):
         return len(self.vertices)
@@ -74,52 +101,229 @@ def calc_turn_angle(x, sigma):
     return gauss_distribution_density(x * 2, 0, sigma) / gauss_distribution_density(0, 0, sigma)
 
 
+class Timeline:
+    """
+    Keyed timers over simulated time.
+
+    Every timer has a string key, scheduling a key again re-arms it. Cancelled and re-armed timers stay in the heap
+    and are skipped when they come out, so both operations are O(log n). State is JSON-friendly for checkpoints.
+    """
+    # timers due within this margin fire at the current step, it absorbs float errors of accumulated time
+    TIME_EPSILON = 1e-9
+
+    def __init__(self, time=0.0):
+        self.time = time
+        self._heap = []  # (due time, seq, key)
+        self._timers = {}  # key -> (due time, seq) of the active timer
+        self._seq = itertools.count()
+
+    def schedule(self, key, delay):
+        """Fires `key` after `delay` simulated seconds, replacing previously scheduled timer of the key"""
+        self._schedule_at(key, self.time + delay)
+
+    def _schedule_at(self, key, due):
+        seq = next(self._seq)
+        self._timers[key] = (due, seq)
+        heapq.heappush(self._heap, (due, seq, key))
+
+    def cancel(self, key):
+        return self._timers.pop(key, None) is not None
+
+    def is_scheduled(self, key):
+        return key in self._timers
+
+    def remaining(self, key):
+        """Simulated seconds till the timer fires or None if it is not scheduled"""
+        timer = self._timers.get(key)
+        return timer[0] - self.time if timer is not None else None
+
+    def next_due(self, exclude=None):
+        """Time of the nearest active timer or None. Timer of the `exclude` key is not considered"""
+        if exclude is not None:
+            # few timers are active at once, scanning them keeps the heap untouched
+            return min((due for key, (due, _) in self._timers.items() if key != exclude), default=None)
+        heap, timers = self._heap, self._timers
+        while heap:
+            due, seq, key = heap[0]
+            if timers.get(key) == (due, seq):
+                return due
+            heapq.heappop(heap)
+        return None
+
+    def advance(self, time_delta):
+        """Moves time forward and returns keys of fired timers in order of their due time"""
+        self.time += time_delta
+        heap = self._heap
+        if not heap or heap[0][0] > self.time + self.TIME_EPSILON:
+            return ()
+        fired = []
+        timers = self._timers
+        limit = self.time + self.TIME_EPSILON
+        while heap and heap[0][0] <= limit:
+            due, seq, key = heapq.heappop(heap)
+            if timers.get(key) == (due, seq):
+                del timers[key]
+                fired.append(key)
+        return fired
+
+    def __len__(self):
+        return len(self._timers)
+
+    def get_state(self):
+        return {
+            "time": self.time,
+            "timers": [[key, due] for key, (due, seq) in sorted(self._timers.items(), key=lambda item: item[1])],
+        }
+
+    def set_state(self, state):
+        self.time = state["time"]
+        self._heap = []
+        self._timers = {}
+        for key, due in state["timers"]:
+            self._schedule_at(key, due)
+
+
+class GaussianBlock:
+    """Standard normal random values which are generated from the given random.Random in blocks"""
+    BLOCK_SIZE = 64
+
+    def __init__(self, rng: random.Random):
+        self._rng = rng
+        self._values = []
+
+    def __call__(self):
+        if not self._values:
+            gauss = self._rng.gauss
+            self._values = [gauss(0, 1) for _ in range(self.BLOCK_SIZE)]
+        return self._values.pop()
+
+    def get_state(self):
+        return list(self._values)
+
+    def set_state(self, state):
+        self._values = list(state)
+
+
+def get_random_state(rng: random.Random):
+    """Compact JSON-friendly state of random.Random: Mersenne Twister words are packed to base64"""
+    version, internal_state, gauss_next = rng.getstate()
+    packed = struct.pack('<{}I'.format(len(internal_state)), *internal_state)
+    return [version, base64.b64encode(packed).decode('ascii'), gauss_next]
+
+
+def set_random_state(rng: random.Random, state):
+    version, packed, gauss_next = state
+    packed = base64.b64decode(packed)
+    rng.setstate((version, struct.unpack('<{}I'.format(len(packed) // 4), packed), gauss_next))
+
+
+class NoiseState:
+    """Per vehicle state of one RandomShift"""
+    __slots__ = ('shift', 'desired_shift', 'last_file_data')
+
+    def __init__(self, desired_shift):
+        self.shift = 0
+        self.desired_shift = desired_shift
+        self.last_file_data = None
+
+    def get_state(self):
+        return [self.shift, self.desired_shift, self.last_file_data]
+
+    def set_state(self, state):
+        self.shift, self.desired_shift, self.last_file_data = state
+
+
 class RandomShift:
+    """
+    Adds slowly changing random shift to the wrapped property value.
+    Shift of each instance is stored in instance._noise and is advanced once per tick by advance()
+    """
+    FILE_CHECK_PERIOD = 1  # seconds, parameter files are shared by all vehicles and are read at most once a period
+
     def __init__(self, min_shift, max_shift, speed=None, is_updating_from_file=False):
         self.min_shift = min_shift
         self.max_shift = max_shift
-        self.shift = 0
         self._gauss_factor = ((max_shift - min_shift) / 2) / 3  # half size dived by 3 sigma
         self.wrapped_function = None
+        self.name = None
         self.speed = speed or (max_shift - min_shift) / 2 * 0.01
-        self._update_desired_shift()
         self._is_updating_from_file = is_updating_from_file
-        self._last_file_data = None
+        self._file_data = None
+        self._file_checked_at = None
 
     def __call__(self, wrapped_function):
         self.wrapped_function = wrapped_function
+        self.name = wrapped_function.__name__
         return self
 
-    def __get__(self, instance, owner):
-        self._update()
-        new_val = self._update_from_file()
-
-        if new_val is not None:
-            self.shift = new_val
+    def __set_name__(self, owner, name):
+        owner._RANDOM_SHIFTS.append(self)
 
-        return self.wrapped_function(instance) + self.shift
-
-    def _update(self):
-        if math.isclose(self.shift, self._desired_shift):
-            self._update_desired_shift()
-        sign = math.copysign(1, self._desired_shift - self.shift)
-        self.shift += sign * min(abs(self._desired_shift - self.shift), self.speed)
-
-    def _update_desired_shift(self):
-        self._desired_shift = random.gauss(0, 1) * self._gauss_factor
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return self.wrapped_function(instance) + instance._noise[self.name].shift
+
+    def create_state(self, gauss):
+        return NoiseState(gauss() * self._gauss_factor)
+
+    def advance(self, state: NoiseState, gauss):
+        if math.isclose(state.shift, state.desired_shift):
+            state.desired_shift = gauss() * self._gauss_factor
+        delta = state.desired_shift - state.shift
+        if delta > self.speed:
+            delta = self.speed
+        elif delta < -self.speed:
+            delta = -self.speed
+        state.shift += delta
+
+        if self._is_updating_from_file:
+            new_val = self._read_file()
+            if new_val is not None and new_val != state.last_file_data:
+                state.last_file_data = new_val
+                state.shift = new_val
+
+    def _read_file(self):
+        now = time.monotonic()
+        if self._file_checked_at is None or now - self._file_checked_at >= self.FILE_CHECK_PERIOD:
+            self._file_checked_at = now
+            try:
+                with open(os.path.join(os.path.dirname(__file__), 'emulator_params', self.name), "r") as file:
+                    self._file_data = int(file.read())
+            except (FileNotFoundError, ValueError):
+                self._file_data = None
+        return self._file_data
+
+
+class TickCached:
+    """
+    Read only property which is computed at most once per tick.
+    The value is stored in the instance __dict__, so next reads don't call any python code at all.
+    Owner class must have _TICK_CACHED_NAMES list, _tick_generation counter and _tick_cache_lock,
+    cached values are dropped by Emulator._invalidate_tick_cache() after update() and on control commands.
+    A value read by another thread while update() is running may be computed from a half-updated state, it is stored
+    only if no invalidation has happened since the computation started, and it is dropped by the one at the end of
+    update(): the check and the store are done under the lock of invalidation, so they can't be split by it.
+    """
+
+    def __init__(self, wrapped_function):
+        self.wrapped_function = wrapped_function
+        self.name = wrapped_function.__name__
+        self.__doc__ = wrapped_function.__doc__
 
-    def _update_from_file(self):
-        if not self._is_updating_from_file:
-            return None
+    def __set_name__(self, owner, name):
+        owner._TICK_CACHED_NAMES.append(name)
 
-        try:
-            file = open(os.path.join(os.path.dirname(__file__), 'emulator_params', self.wrapped_function.__name__), "r")
-            new_val = int(file.read())
-            if new_val != self._last_file_data:
-                self._last_file_data = new_val
-                return self._last_file_data
-        except (FileNotFoundError, ValueError):
-            return None
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        generation = instance._tick_generation
+        value = self.wrapped_function(instance)
+        # don't cache value computed from the state which has been changed meanwhile
+        with instance._tick_cache_lock:
+            if instance._tick_generation == generation:
+                instance.__dict__[self.name] = value
+        return value
 
 
 class TurnSignal:
@@ -143,14 +347,16 @@ class Emulator:
     INITIAL_SPEED = 0
     PLAN_LENGTH = 10  # minimum 3 for previous, current and next points
 
-    MADNESS_CHANGE_TICKS = 400  # ticks till driver madness changes
+    MADNESS_CHANGE_PERIOD = 400  # seconds till driver madness changes
     ACCELERATION_TO_FUEL_CONSUMPTION_RATIO = 2.59  # acceleration * ACCELERATION_TO_FUEL_CONSUMPTION_RATIO (l/100km)
     MIN_FUEL_CONSUMPTION = 4  # liters per 100km
     LINE_WIDTH = 1.5
     LINE_CHANGE_CHANCE = 0.01
 
     STOP_SIGNAL_BREAK_THRESHOLD = 0.5
-    TURN_SIGNAL_TICKS = 8
+    SAFE_DISTANCE = 10  # meters to the vehicle ahead
+    TRAFFIC_LOOK_AHEAD = 150  # meters, vehicles on upcoming edges further than this are ignored
+    TURN_SIGNAL_DURATION = 8  # seconds
     TURN_SIGNAL_ANGLE_THRESHOLD = 0.8726646259971648  # 50 degrees
     TURN_SIGNAL_DISTANCE = 20
     TURN_STEERING_WHEEL_DISTANCE = 10
@@ -159,13 +365,42 @@ class Emulator:
 
     MIN_RPM = 800
     SPEED_TO_TURN_GEAR = 5.1
-    REPLACE_TIRE_COUNTDOWN = 236
-
-    def __init__(self, vertex_pool: VertexPool):
+    TIRE_PRESSURE = 27
+    # (seconds since tire break, tire pressure), pressure changes linearly between points
+    BROKEN_TIRE_PRESSURE = ((0, 27), (56, 14), (135, 14), (161, 27))
+    # timeline keys of the tire replacement: (seconds since tire break, key, attribute values)
+    TIRE_REPLACEMENT_SEQUENCE = (
+        (21, 'tire.stop', {'_command_to_stop': True}),
+        (46, 'tire.driver_out', {'drv_ajar': True, 'drv_seatbelt': 1}),  # hope that it stopped till this time
+        (56, 'tire.driver_door_closed', {'drv_ajar': False}),
+        (71, 'tire.trunk_unlocked', {'rr_dr_unlkd': True}),
+        (201, 'tire.trunk_locked', {'rr_dr_unlkd': False}),
+        (216, 'tire.driver_in', {'drv_ajar': True}),
+        (226, 'tire.driver_seated', {'drv_ajar': False, 'drv_seatbelt': 0}),
+        (236, 'tire.replaced', {'_command_to_stop': False, '_broken_tire': False}),
+    )
+    _TIRE_REPLACEMENT_STEPS = {key: values for _, key, values in TIRE_REPLACEMENT_SEQUENCE}
+
+    _TICK_CACHED_NAMES = []
+    _RANDOM_SHIFTS = []
+
+    def __init__(self, vertex_pool: VertexPool, seed=None):
+        self._tick_generation = 0
+        self._tick_cache_lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._gauss = GaussianBlock(self._random)
+        self._noise = {shift.name: shift.create_state(self._gauss) for shift in self._RANDOM_SHIFTS}
         self._tick = 0
+        self._timeline = Timeline()
+        # time deltas of skipped updates while the vehicle is steady, see defer()
+        self._deferred = []
+        self._deferred_time = 0
+        self._deferred_lock = threading.Lock()
         self._rectangle_to = False
         self._rectangle = None
         self._rectangle_plan = {}
+        self.rectangle_plan_hits = 0
+        self.rectangle_plan_misses = 0
         self._vertex_pool = vertex_pool
         self._acceleration = 0
         self._turn_angle = 0
@@ -175,21 +410,21 @@ class Emulator:
         self._max_acceleration = self.MAX_ACCELERATION
         self._madness = 0.5
         self._plan = deque()
-        self._turn_signal_countdown = 0
         self._turn_signal = TurnSignal.DISABLED
         self.madness = 0.7
         self.change_madness_periodically = True
-        self._ticks_till_next_madness = self.MADNESS_CHANGE_TICKS
         self._line_offset = 0  # negative means offset to left from center
         self._command_to_stop = False
+        # TrafficIndex of the fleet, vehicles ahead are followed if it is set
+        self.traffic = None
+        self._leader = None  # (distance, speed) of the vehicle ahead, is found by _want_to_break()
         self._init_plan()
         self._x = self._prev.x
         self._y = self._prev.y
         self._odometer = 232000
         self._gas_range = 423000
-        self.tire_pressure = 27
         self._broken_tire = False
-        self._replace_tire_countdown = self.REPLACE_TIRE_COUNTDOWN
+        self._tire_broken_at = None
 
         self._angle = math.atan2(self._current.y - self._prev.y, self._current.x - self._prev.x)
         self._distance_till_turn = distance(self._prev, self._current)
@@ -197,27 +432,122 @@ class Emulator:
         self.drv_seatbelt = 0
         self.rr_dr_unlkd = False
 
+    def get_state(self):
+        """
+        Returns dynamic state of the vehicle as JSON-friendly dict. Vertices are referred by id,
+        so the state can be restored only with the same map
+        """
+        self._catch_up()
+        return {
+            "tick": self._tick,
+            "timeline": self._timeline.get_state(),
+            "random": get_random_state(self._random),
+            "gauss": self._gauss.get_state(),
+            "noise": {name: state.get_state() for name, state in self._noise.items()},
+            "rectangle_to": self._rectangle_to,
+            "rectangle": [list(point) for point in self._rectangle] if self._rectangle else None,
+            "rectangle_plan": list(self._rectangle_plan.items()),
+            "plan": [[p.vertex.id, p.turn_angle, p.max_turn_speed, p.distance_from_current_point] for p in self._plan],
+            "acceleration": self._acceleration,
+            "turn_angle": self._turn_angle,
+            "speed": self._speed,
+            "madness": self._madness,
+            "max_speed": self._max_speed,
+            "max_acceleration": self._max_acceleration,
+            "max_break": self._max_break,
+            "change_madness_periodically": self.change_madness_periodically,
+            "turn_signal": self._turn_signal,
+            "line_offset": self._line_offset,
+            "command_to_stop": self._command_to_stop,
+            "x": self._x,
+            "y": self._y,
+            "angle": self._angle,
+            "distance_till_turn": self._distance_till_turn,
+            "odometer": self._odometer,
+            "gas_range": self._gas_range,
+            "broken_tire": self._broken_tire,
+            "tire_broken_at": self._tire_broken_at,
+            "drv_ajar": self.drv_ajar,
+            "drv_seatbelt": self.drv_seatbelt,
+            "rr_dr_unlkd": self.rr_dr_unlkd,
+        }
+
+    def set_state(self, state):
+        """Restores state returned by get_state()"""
+        with self._deferred_lock:
+            self._deferred = []
+            self._deferred_time = 0
+        self._tick = state["tick"]
+        self._timeline.set_state(state["timeline"])
+        set_random_state(self._random, state["random"])
+        self._gauss.set_state(state["gauss"])
+        for name, noise_state in state["noise"].items():
+            if name in self._noise:
+                self._noise[name].set_state(noise_state)
+        self._rectangle_to = state["rectangle_to"]
+        self._rectangle = tuple(Point(*point) for point in state["rectangle"]) if state["rectangle"] else None
+        self._rectangle_plan = {vertex_id: next_id for vertex_id, next_id in state["rectangle_plan"]}
+        self._plan = deque(PlanPoint(self._vertex_pool[vertex_id], turn_angle, max_turn_speed, distance_from_current)
+                           for vertex_id, turn_angle, max_turn_speed, distance_from_current in state["plan"])
+        self._acceleration = state["acceleration"]
+        self._turn_angle = state["turn_angle"]
+        self._speed = state["speed"]
+        # not through the setter: it would recalculate max turn speed of the restored plan points
+        self._madness = state["madness"]
+        self._max_speed = state["max_speed"]
+        self._max_acceleration = state["max_acceleration"]
+        self._max_break = state["max_break"]
+        self.change_madness_periodically = state["change_madness_periodically"]
+        self._turn_signal = state["turn_signal"]
+        self._line_offset = state["line_offset"]
+        self._command_to_stop = state["command_to_stop"]
+        self._x = state["x"]
+        self._y = state["y"]
+        self._angle = state["angle"]
+        self._distance_till_turn = state["distance_till_turn"]
+        self._odometer = state["odometer"]
+        self._gas_range = state["gas_range"]
+        self._broken_tire = state["broken_tire"]
+        self._tire_broken_at = state["tire_broken_at"]
+        self.drv_ajar = state["drv_ajar"]
+        self.drv_seatbelt = state["drv_seatbelt"]
+        self.rr_dr_unlkd = state["rr_dr_unlkd"]
+        self._invalidate_tick_cache()
+
     def set_rectangle_direction(self, target: bool):
+        self._catch_up()
         target = bool(target)
         if self._rectangle_to != target:
             self._rectangle_to = target
             self._rectangle_plan = {}
+            self._invalidate_tick_cache()
 
     def set_rectangle(self, long0, lat0, long1, lat1):
+        self._catch_up()
         new_rectangle = Point(long0, lat0), Point(long1, lat1)
         if new_rectangle != self._rectangle:
             self._rectangle = new_rectangle
             self._rectangle_plan = {}
+            self._invalidate_tick_cache()
 
     def del_rectangle(self):
+        self._catch_up()
         self._rectangle = None
         self._rectangle_plan = {}
+        self._invalidate_tick_cache()
+
+    def _invalidate_tick_cache(self):
+        with self._tick_cache_lock:
+            self._tick_generation += 1
+            instance_dict = self.__dict__
+            for name in self._TICK_CACHED_NAMES:
+                instance_dict.pop(name, None)
 
     def _init_plan(self):
         self._plan = deque()
 
         # prev
-        prev_vertex = random.choice(self._vertex_pool)
+        prev_vertex = self._random.choice(self._vertex_pool)
         self._plan.append(PlanPoint(prev_vertex, 0, 0, 0))
 
         # cur
@@ -288,7 +618,10 @@ class Emulator:
         next_vertex = None
         if self._rectangle and (self._in_rectangle(vertex=cur.vertex) ^ self._rectangle_to):
             if not self._rectangle_plan:
+                self.rectangle_plan_misses += 1
                 self._create_rectangle_movement_plan()
+            else:
+                self.rectangle_plan_hits += 1
             if cur.vertex.id in self._rectangle_plan:
                 next_vertex_id = self._rectangle_plan.pop(cur.vertex.id)
                 next_vertex = self._vertex_pool[next_vertex_id]
@@ -309,7 +642,7 @@ class Emulator:
         possible_next_ids = list(current.neighbors)
         if prev and len(possible_next_ids) >= 2 and prev.id in possible_next_ids:
             possible_next_ids.remove(prev.id)
-        next_id = random.choice(possible_next_ids)
+        next_id = self._random.choice(possible_next_ids)
         return self._vertex_pool[next_id]
 
     def _calc_max_turn_speed(self, turn_angle):
@@ -319,12 +652,12 @@ class Emulator:
 
     def update(self, time_delta=1.0):
         assert time_delta > 0
+        self._catch_up()
         self._tick += 1
-        self._check_turn_signal_to_disable()
-        self._update_madness_if_needed()
+        for key in self._timeline.advance(time_delta):
+            self._on_timer(key)
+        self._update_noise()
 
-        if self._broken_tire:
-            self._update_broken_tire(time_delta)
         if self._command_to_stop:
             self._enable_turn_signal(TurnSignal.EMERGENCY)
             self._break(time_delta, emergency=True)
@@ -346,54 +679,77 @@ class Emulator:
             self._move(self._speed, time_delta)
 
         self._distance_till_turn = distance(Position(self._x, self._y), self._current)
+        self._invalidate_tick_cache()
 
-    def _check_turn_signal_to_disable(self):
-        if self._turn_signal_countdown:
-            self._turn_signal_countdown -= 1
-            if self._turn_signal_countdown == 0:
-                self._turn_signal = TurnSignal.DISABLED
+    def is_steady(self):
+        """Vehicle stands still on command, so every update changes only time and noise"""
+        return self._command_to_stop and self._speed == 0 and self._acceleration == 0 \
+            and self._turn_signal == TurnSignal.EMERGENCY
 
-    def _update_broken_tire(self, time_delta):
-        self._replace_tire_countdown -= 1
-
-        if self._replace_tire_countdown >= 180:
-            self.tire_pressure -= (27 - 14) / (236 - 180)  # pressure must fall from 27 to 14 during 236 - 180 interval
-
-        if self._replace_tire_countdown == 215:
-            self._command_to_stop = True
-
-        if self._replace_tire_countdown == 190:  # hope that it stopped till this countdown
-            self.drv_ajar = True
-            self.drv_seatbelt = 1
-
-        if self._replace_tire_countdown == 180:
-            self.drv_ajar = False
-
-        if self._replace_tire_countdown == 165:
-            self.rr_dr_unlkd = True
-
-        if 74 <= self._replace_tire_countdown <= 100:
-            # pressure must increase from 14 to 27 during 100 - 74 interval
-            self.tire_pressure += min((27 - 14) / (100 - 74), 27 - self.tire_pressure)
-
-        if self._replace_tire_countdown == 35:
-            self.rr_dr_unlkd = False
-
-        if self._replace_tire_countdown == 20:
-            self.drv_ajar = True
-
-        if self._replace_tire_countdown == 10:
-            self.drv_ajar = False
-            self.drv_seatbelt = 0
+    def defer(self, time_delta=1.0):
+        """
+        Skips update of the steady vehicle till its next timeline event. Skipped updates are applied by _catch_up()
+        when the vehicle is read, commanded or updated. Returns False if the vehicle must be updated normally.
+        """
+        with self._deferred_lock:
+            if not self.is_steady():
+                return False
+            timeline = self._timeline
+            # turn signal timer is re-armed by _catch_up(), so it doesn't wake the vehicle up
+            due = timeline.next_due(exclude='turn_signal_off')
+            if due is not None and due <= timeline.time + self._deferred_time + time_delta + timeline.TIME_EPSILON:
+                return False
+            if not self._deferred:
+                # cancelled only when the update is really skipped: a normal update after a fired event which
+                # ends the stop must switch the hazard lights off in time
+                timeline.cancel('turn_signal_off')
+            self._deferred.append(time_delta)
+            self._deferred_time += time_delta
+            return True
 
-        if self._replace_tire_countdown == 0:
-            self._command_to_stop = False
-            self._replace_tire_countdown = self.REPLACE_TIRE_COUNTDOWN
-            self._broken_tire = False
-            self.tire_pressure = 27
+    def _catch_up(self):
+        if not self._deferred:
+            return
+        with self._deferred_lock:
+            deferred, self._deferred = self._deferred, []
+            self._deferred_time = 0
+            if not deferred:
+                return
+            # vehicle hasn't moved, so only time and noise are advanced. Noise is advanced step by step
+            # to keep the random sequence the same as with normal updates
+            timeline = self._timeline
+            for time_delta in deferred:
+                self._tick += 1
+                for key in timeline.advance(time_delta):
+                    self._on_timer(key)
+                self._update_noise()
+            timeline.schedule('turn_signal_off', self.TURN_SIGNAL_DURATION)
+            self._invalidate_tick_cache()
+
+    def _update_noise(self):
+        noise = self._noise
+        for shift in self._RANDOM_SHIFTS:
+            shift.advance(noise[shift.name], self._gauss)
+
+    def _on_timer(self, key):
+        if key == 'turn_signal_off':
+            self._turn_signal = TurnSignal.DISABLED
+        elif key == 'madness_change':
+            self._change_madness()
+        else:
+            for name, value in self._TIRE_REPLACEMENT_STEPS[key].items():
+                setattr(self, name, value)
 
     def _want_to_break(self, time_delta):
         speed_at_next_tick = self._speed + self._calc_acceleration_value(time_delta)
+        self._leader = self._find_leader() if self.traffic is not None else None
+        if self._leader is not None:
+            leader_distance, leader_speed = self._leader
+            time_to_stop = (speed_at_next_tick - leader_speed) / self._max_break
+            distance_to_stop = speed_at_next_tick * time_to_stop - self._max_break * time_to_stop ** 2 / 2
+            if distance_to_stop > leader_distance - self.SAFE_DISTANCE:
+                return True
+
         plan_iter = iter(self._plan)
         next(plan_iter)  # skip first
         for plan_point in plan_iter:
@@ -453,8 +809,52 @@ class Emulator:
             a = min(a, self.MAX_BREAK)
             max_a = max(max_a, a)
 
+        if self._leader is not None:
+            leader_distance, leader_speed = self._leader
+            distance_till_leader = leader_distance - self.SAFE_DISTANCE
+            v_delta = max(self._speed - leader_speed, 0)
+            if distance_till_leader > 0:
+                a = min((self._speed * v_delta - v_delta ** 2 / 2) / distance_till_leader, self.MAX_BREAK)
+            else:
+                a = self.MAX_BREAK if self._speed > 0 else 0
+            max_a = max(max_a, a)
+
         return max_a
 
+    def _find_leader(self):
+        """Returns (distance, speed) of the nearest vehicle ahead on the current and upcoming edges or None"""
+        traffic = self.traffic
+        plan = self._plan
+        distance_till_turn = self._distance_till_turn
+
+        leader = None
+        for other in traffic.on_edge((plan[0].vertex.id, plan[1].vertex.id)):
+            if other is not self and other._distance_till_turn < distance_till_turn and other._in_traffic():
+                gap = distance_till_turn - other._distance_till_turn
+                if leader is None or gap < leader[0]:
+                    leader = (gap, other._speed)
+        if leader is not None:
+            return leader
+
+        for i in range(1, len(plan) - 1):
+            entry_distance = distance_till_turn + plan[i].distance_from_current_point
+            if entry_distance > self.TRAFFIC_LOOK_AHEAD:
+                break
+            edge_length = plan[i + 1].distance_from_current_point - plan[i].distance_from_current_point
+            for other in traffic.on_edge((plan[i].vertex.id, plan[i + 1].vertex.id)):
+                if other is not self and other._in_traffic():
+                    # the vehicle nearest to the start of the edge
+                    gap = entry_distance + edge_length - other._distance_till_turn
+                    if leader is None or gap < leader[0]:
+                        leader = (gap, other._speed)
+            if leader is not None:
+                return leader
+        return None
+
+    def _in_traffic(self):
+        # vehicle parked by command at the roadside doesn't block the road
+        return not (self._command_to_stop and self._line_offset > 0)
+
     def _is_time_to_turn(self, time_delta):
         return self._speed * time_delta > self._distance_till_turn
 
@@ -491,8 +891,8 @@ class Emulator:
             if self._line_offset < 1:
                 return 1
         else:
-            if random.random() < self.LINE_CHANGE_CHANCE:
-                return random.choice([-1, 1]) if self._line_offset == 0 else -self._line_offset
+            if self._random.random() < self.LINE_CHANGE_CHANCE:
+                return self._random.choice([-1, 1]) if self._line_offset == 0 else -self._line_offset
         return 0
 
     def _show_turn_signal_if_needed(self):
@@ -501,7 +901,7 @@ class Emulator:
             self._enable_turn_signal(TurnSignal.LEFT if self._current_turn_angle < 0 else TurnSignal.RIGHT)
 
     def _enable_turn_signal(self, turn_signal):
-        self._turn_signal_countdown = self.TURN_SIGNAL_TICKS
+        self._timeline.schedule('turn_signal_off', self.TURN_SIGNAL_DURATION)
         self._turn_signal = turn_signal
 
     def _move(self, speed, time_delta):
@@ -534,13 +934,14 @@ class Emulator:
             plan_point.distance_from_current_point -= delta_distance
         self._add_point_to_plan()
 
-    def _update_madness_if_needed(self):
+    def _change_madness(self):
         if self.change_madness_periodically:
-            self._ticks_till_next_madness -= 1
-            if self._ticks_till_next_madness == 0:
-                self.madness = random.random() * 0.5 + 0.5
+            self.madness = self._random.random() * 0.5 + 0.5
+        else:
+            self._timeline.schedule('madness_change', self.MADNESS_CHANGE_PERIOD)
 
     def get_data(self):
+        self._catch_up()
         return {
             'ac_stat': 0,  # Air conditioning status
             'acc_mode': False,  # Cruise Switch: ACC or ESC mode pressed
@@ -648,28 +1049,33 @@ class Emulator:
             **self.rectangle,
         }
 
-    @property
-    def x(self):
+    @TickCached
+    def position(self):
+        """Position of the car taking into account the line it drives in"""
         if self._line_offset == 0:
-            return self._x
+            return Position(self._x, self._y)
 
         angle = self._angle + (math.pi / 2 if self._line_offset < 0 else -math.pi / 2)
-        dx = math.cos(angle) * abs(self._line_offset) * self.LINE_WIDTH
-        return self._x + dx
+        offset = abs(self._line_offset) * self.LINE_WIDTH
+        return Position(self._x + math.cos(angle) * offset, self._y + math.sin(angle) * offset)
 
     @property
-    def y(self):
-        if self._line_offset == 0:
-            return self._y
+    def x(self):
+        return self.position.x
 
-        angle = self._angle + (math.pi / 2 if self._line_offset < 0 else -math.pi / 2)
-        dy = math.sin(angle) * abs(self._line_offset) * self.LINE_WIDTH
-        return self._y + dy
+    @property
+    def y(self):
+        return self.position.y
 
     @property
     def _current_turn_angle(self):
         return self._plan[1].turn_angle
 
+    @property
+    def edge(self):
+        """Directed edge of the road graph the vehicle is on: ids of the previous and the current vertices"""
+        return self._plan[0].vertex.id, self._plan[1].vertex.id
+
     @property
     def _prev(self):
         return self._plan[0].vertex
@@ -689,27 +1095,29 @@ class Emulator:
     @madness.setter
     def madness(self, madness):
         assert 0 < madness <= 1
+        self._catch_up()
         self._madness = madness
         self._max_speed = self.MIN_SPEED + (self.MAX_SPEED - self.MIN_SPEED) * madness
         self._max_acceleration = self.MIN_ACCELERATION + (self.MAX_ACCELERATION - self.MIN_ACCELERATION) * madness
         self._max_break = self.MIN_BREAK + (self.MAX_BREAK - self.MIN_BREAK) * madness
         for cur in iter(self._plan):
             cur.max_turn_speed = self._calc_max_turn_speed(cur.turn_angle)
-        self._ticks_till_next_madness = self.MADNESS_CHANGE_TICKS
+        self._timeline.schedule('madness_change', self.MADNESS_CHANGE_PERIOD)
+        self._invalidate_tick_cache()
 
-    @property
+    @TickCached
     def lat(self):
         return self._vertex_pool.y_to_lat(self.y)
 
-    @property
+    @TickCached
     def lon(self):
         return self._vertex_pool.x_to_lon(self.x)
 
-    @property
+    @TickCached
     def fuel_consumption(self):
         return self.rpm * self.MIN_FUEL_CONSUMPTION / self.MIN_RPM
 
-    @property
+    @TickCached
     def in_rectangle(self):
         result = None
         if self._rectangle:
@@ -720,7 +1128,7 @@ class Emulator:
     def move_to_rectangle(self):
         return self._rectangle_to
 
-    @property
+    @TickCached
     def rectangle(self):
         result = {
             "rectangle_long0": None,
@@ -771,7 +1179,7 @@ class Emulator:
     def speed(self):
         return self._speed
 
-    @property
+    @TickCached
     def speed_kmph(self):
         return int(self.speed * self.MPS_TO_KMPH)
 
@@ -793,9 +1201,26 @@ class Emulator:
 
     @property
     def tick(self):
-        return self._tick
+        return self._tick + len(self._deferred)
 
     @property
+    def time(self):
+        """Simulated seconds since the emulator was created"""
+        return self._timeline.time + self._deferred_time
+
+    @property
+    def tire_pressure(self):
+        """Pressure of the rear left tire is a function of simulated time since the tire break"""
+        if not self._broken_tire:
+            return self.TIRE_PRESSURE
+        elapsed = self.time - self._tire_broken_at
+        points = self.BROKEN_TIRE_PRESSURE
+        for (t0, p0), (t1, p1) in zip(points, points[1:]):
+            if elapsed < t1:
+                return p0 + (p1 - p0) * (max(elapsed, t0) - t0) / (t1 - t0)
+        return points[-1][1]
+
+    @TickCached
     def stop_signal(self):
         return int(self.acceleration <= -self.STOP_SIGNAL_BREAK_THRESHOLD)
 
@@ -803,14 +1228,14 @@ class Emulator:
     def turn_signal(self):
         return self._turn_signal
 
-    @property
+    @TickCached
     def gear(self):
         if self.speed < self.MIN_SPEED and self._command_to_stop:
             return 0
         else:
             return min(int(self.speed // self.SPEED_TO_TURN_GEAR), 4) + 1
 
-    @property
+    @TickCached
     def rpm(self):
         if self.gear == 0:
             return self.MIN_RPM
@@ -819,15 +1244,15 @@ class Emulator:
         else:
             return int((self.speed % self.SPEED_TO_TURN_GEAR) / self.SPEED_TO_TURN_GEAR * 1000 + 2500)
 
-    @property
+    @TickCached
     def odometer(self):
         return int(self._odometer // 1000)
 
-    @property
+    @TickCached
     def gas_range(self):
         return int(self._gas_range // 1000)
 
-    @property
+    @TickCached
     def fuel_level(self):
         return int(self.FUEL_CONSUMPTION / 100 * self.gas_range)
 
@@ -850,8 +1275,13 @@ class Emulator:
     def tire_break(self):
         """Tries to brake tire. Returns True on success, False otherwise. You can't brake tire if it is already broken
         """
-        if self._replace_tire_countdown == self.REPLACE_TIRE_COUNTDOWN:
+        self._catch_up()
+        if not self._broken_tire:
             self._broken_tire = True
+            self._tire_broken_at = self._timeline.time
+            for delay, key, _ in self.TIRE_REPLACEMENT_SEQUENCE:
+                self._timeline.schedule(key, delay)
+            self._invalidate_tick_cache()
             return True
         else:
             return False
@@ -859,22 +1289,25 @@ class Emulator:
     def command_stop(self):
         """Command to emergency stop the car. Returns True on success, False otherwise.
         """
+        self._catch_up()
         self._command_to_stop = True
+        self._invalidate_tick_cache()
         return True
 
     def command_go(self):
         """Command to continue riding after command_stop(). Returns True on success, False otherwise.
         You can't exec command_go() if tire is broken.
         """
+        self._catch_up()
         if not self._broken_tire:
             self._command_to_stop = False
+            self._invalidate_tick_cache()
             return True
         else:
             return False
 
 
 def main():
-    import time
     vp = VertexPool('map.json')
     emulator = Emulator(vp)
     start = time.time()
@@ -892,8 +1325,9 @@ def main():
             import traceback
             print("Unexpected exception: {}".format(ex))
             print(''.join(traceback.format_exception(None, ex, ex.__traceback__)), file=sys.stderr, flush=True)
-            import pickle
-            pickle.dump(emulator, open('emulator_{}.dmp'.format(random.randint(0, 10000)), 'wb'))
+            # dynamic state only, the map is referred by fingerprint
+            with open('emulator_{}.state.json'.format(random.randint(0, 10000)), 'w') as file:
+                json.dump({"map": vp.fingerprint(), "state": emulator.get_state()}, file, separators=(',', ':'))
             return
 
 
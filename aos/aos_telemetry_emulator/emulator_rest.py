@@ -2,30 +2,118 @@ import json
 import logging
 import os
 import signal
+import socketserver
 import sys
 import time
-from threading import Thread
+from collections import deque
+from threading import BoundedSemaphore, Event, Thread
+from urllib.parse import unquote
 from http.server import HTTPServer
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from telemetry_emulator.admission import AdmissionControlMixIn
 from telemetry_emulator.config import (
-    EMULATOR_UPDATE_TIME, CONTROL_API_ADDRESS, DRIVER_UUID, VEHICLE_VIN
+    EMULATOR_UPDATE_TIME, CONTROL_API_ADDRESS, CONTROL_API_UNIX_SOCKET, CONTROL_API_UNIX_SOCKET_MODE, DRIVER_UUID,
+    VEHICLE_VIN, SHM_TELEMETRY_PATH, FLEET_SIZE, FLEET_PAGE_SIZE, PROFILING_ENABLED, CHECKPOINT_PATH,
+    CHECKPOINT_INTERVAL, SCENARIO_FILE, ADAPTIVE_TICKING, MAP_TILES_FILE, MAP_TILES_MEMORY_BUDGET,
+    TRAFFIC_INTERACTION, HISTORY_CAPACITY, TRIP_ANALYTICS, GEOFENCE_EVENT_WAITERS
 )
-from telemetry_emulator.control_api import EmulatorCommandsRequestHandler, BadRequestException
-from telemetry_emulator.emulator import VertexPool, Emulator
+from telemetry_emulator.checkpoint import Checkpointer, restore_checkpoint
+from telemetry_emulator.control_api import (
+    EmulatorCommandsRequestHandler, BadRequestException, HttpResponseException, NotFoundException
+)
+from telemetry_emulator.emulator import VertexPool
+from telemetry_emulator.fleet import Fleet, make_vins
+from telemetry_emulator.geofence import fence_from_dict
+from telemetry_emulator.history import FIELD_NAMES as HISTORY_FIELDS
+from telemetry_emulator.metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from telemetry_emulator.scenario import parse_scenario, load_scenario
+from telemetry_emulator.shm_channel import TelemetryWriter
+from telemetry_emulator.tiles import TiledVertexPool
 
 logger = logging.getLogger(__name__)
 
+TICK_DURATION = REGISTRY.histogram('emulator_tick_duration_seconds', 'Time of updating all vehicles of the fleet')
+TICK_LATENESS = REGISTRY.histogram('emulator_tick_lateness_seconds',
+                                   'How much later than scheduled the simulation loop woke up')
+REQUEST_DURATION = REGISTRY.histogram('emulator_http_request_duration_seconds', 'Time of handling HTTP request',
+                                      labels=('route', 'method'))
+REQUESTS = REGISTRY.counter('emulator_http_requests_total', 'Handled HTTP requests', labels=('route', 'code'))
+SNAPSHOT_SIZE = REGISTRY.histogram('emulator_stats_snapshot_size_bytes', 'Size of /stats response body',
+                                   buckets=(512, 1024, 2048, 4096, 8192, 16384, 65536))
+# deque append() and pop() are atomic, len() of it is the number of connections being handled
+IN_FLIGHT = deque()
+REGISTRY.gauge('emulator_http_in_flight_connections', 'Connections being handled', function=lambda: len(IN_FLIGHT))
+
+
+def register_fleet_metrics(fleet):
+    REGISTRY.gauge('emulator_vehicles', 'Number of simulated vehicles', function=lambda: len(fleet))
+    if isinstance(fleet.vertex_pool, TiledVertexPool):
+        vertex_pool = fleet.vertex_pool
+        REGISTRY.gauge('emulator_map_tiles_memory_bytes', 'Estimated memory of loaded map tiles',
+                       function=lambda: vertex_pool.memory_used)
+        REGISTRY.counter('emulator_map_tile_loads_total', 'Map tiles read from the tile file',
+                         function=lambda: vertex_pool.tile_loads)
+        REGISTRY.counter('emulator_map_tile_evictions_total', 'Map tiles dropped to keep the memory budget',
+                         function=lambda: vertex_pool.tile_evictions)
+    REGISTRY.gauge('emulator_deferred_vehicles', 'Steady vehicles skipped on the last tick',
+                   function=lambda: fleet.deferred)
+    REGISTRY.counter('emulator_rectangle_plan_cache_hits_total', 'Plan points taken from cached rectangle route',
+                     function=lambda: sum(e.rectangle_plan_hits for e in fleet.vehicles.values()))
+    REGISTRY.counter('emulator_rectangle_plan_cache_misses_total', 'Rectangle route searches',
+                     function=lambda: sum(e.rectangle_plan_misses for e in fleet.vehicles.values()))
+
 
 class RestEmulatorCommandsRequestHandler(EmulatorCommandsRequestHandler):
+    MAX_EVENTS_WAIT = 30  # seconds
+    # long-polling clients of /geofences/events, shared by all servers
+    event_waiters = BoundedSemaphore(GEOFENCE_EVENT_WAITERS)
+
     def setup(self):
+        IN_FLIGHT.append(None)
+        self.status = None
         super().setup()
         self._urls.extend([
             (r'^/stats/?$', self._stats),
-            (r'^/attributes/?$', self._set_attributes)
+            (r'^/attributes/?$', self._set_attributes),
+            (r'^/fleet/stats/?$', self._fleet_stats),
+            (r'^/debug/profile/?$', self._debug_profile),
+            (r'^/debug/profile/result/?$', self._debug_profile_result),
+            (r'^/debug/timings/?$', self._debug_timings),
+            (r'^/debug/timings/(?P<action>enable|disable|reset)/?$', self._debug_timings_action),
+            (r'^/metrics/?$', self._metrics),
+            (r'^/geofences/?$', self._geofences),
+            (r'^/geofences/events/?$', self._geofence_events),
+            (r'^/geofences/delete/(?P<name>[^/]+)/?$', self._delete_geofence),
+            (r'^/scenario/?$', self._scenario),
+            (r'^/history/?$', self._history),
+            (r'^/trip/?$', self._trip),
+            (r'^/trip/reset/?$', self._reset_trip),
+            (r'^/scenario/clear/?$', self._clear_scenario),
         ])
 
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            IN_FLIGHT.pop()
+
+    def do_GET(self):
+        start = time.perf_counter()
+        super().do_GET()
+        route = self.route or 'not_found'
+        REQUEST_DURATION.labels(route=route, method=self.command).observe(time.perf_counter() - start)
+        REQUESTS.labels(route=route, code=self.status).inc()
+
+    def send_response(self, code, message=None):
+        self.status = code
+        super().send_response(code, message)
+
+    @property
+    def fleet(self):
+        return self.server.fleet
+
     def response(self, status, body=None, headers: dict = None):
         self.send_response(status)
         if headers:
@@ -36,13 +124,234 @@ class RestEmulatorCommandsRequestHandler(EmulatorCommandsRequestHandler):
             self.wfile.write(body)
 
     def _stats(self):
+        telemetry = self.emulator.get_data()
+        profiler = self.fleet.profiler
+        start = time.perf_counter() if profiler.enabled else None
         data = json.dumps({
             "driver": DRIVER_UUID,
             "vin": VEHICLE_VIN,
-            "telemetry": self.emulator.get_data()
+            "telemetry": telemetry,
+            "geofences": self.fleet.geofences.inside(self.fleet.primary_vin),
         }).encode("utf-8")
+        if start is not None:
+            profiler.observe('serialization', time.perf_counter() - start)
+        SNAPSHOT_SIZE.observe(len(data))
+        self.response(200, body=data, headers={"Content-Type": "application/json"})
+
+    def _metrics(self):
+        self.response(200, body=REGISTRY.render().encode("utf-8"), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+    def _fleet_stats(self):
+        """
+        Streams telemetry of fleet vehicles.
+        Query parameters:
+            bbox - long0,lat0,long1,lat1 - return only vehicles inside the bounding box
+            page, page_size - page of vehicles sorted by VIN, page numbers start from 0
+            fields - comma separated telemetry fields to return, all fields by default
+        """
+        bbox = self.query_param('bbox', convert=lambda value: [float(v) for v in value.split(',')])
+        if bbox is not None and len(bbox) != 4:
+            raise BadRequestException(message='bbox must be long0,lat0,long1,lat1')
+        page = self.query_param('page', 0, int)
+        page_size = self.query_param('page_size', FLEET_PAGE_SIZE, int)
+        if page < 0 or page_size <= 0:
+            raise BadRequestException(message='page must be >= 0 and page_size must be > 0')
+        fields = self.query_param('fields', convert=lambda value: [f for f in value.split(',') if f])
+        if fields:
+            unknown_fields = set(fields).difference(self.emulator.get_data())
+            if unknown_fields:
+                raise BadRequestException(message='Unknown fields: {}'.format(', '.join(sorted(unknown_fields))))
+
+        fleet = self.fleet
+        vins = fleet.find(*bbox) if bbox is not None else sorted(fleet)
+        page_vins = vins[page * page_size:(page + 1) * page_size]
+
+        # Response is written vehicle by vehicle. There is no Content-Length, HTTP/1.0 connection close ends it.
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write('{{"page": {}, "page_size": {}, "total": {}, "vehicles": ['.format(
+            page, page_size, len(vins)).encode("utf-8"))
+        for i, vin in enumerate(page_vins):
+            telemetry = fleet[vin].get_data()
+            if fields:
+                telemetry = {field: telemetry[field] for field in fields}
+            self.wfile.write((", " if i else "").encode("utf-8") + json.dumps({
+                "vin": vin,
+                "telemetry": telemetry,
+                "geofences": fleet.geofences.inside(vin),
+            }).encode("utf-8"))
+        self.wfile.write(b']}')
+
+    def _geofences(self):
+        """GET lists fences, POST adds (or replaces) fence described by JSON body"""
+        geofences = self.fleet.geofences
+        if self.command == 'POST':
+            data = self._read_json()
+            try:
+                fences = [fence_from_dict(item) for item in (data if isinstance(data, list) else [data])]
+            except (ValueError, TypeError, AttributeError) as ex:
+                raise BadRequestException(message=str(ex))
+            for fence in fences:
+                geofences.add_fence(fence)
+            self.response(201)
+        else:
+            data = json.dumps([fence.to_dict() for fence in list(geofences.fences.values())]).encode("utf-8")
+            self.response(200, body=data, headers={"Content-Type": "application/json"})
+
+    def _delete_geofence(self, name):
+        if not self.fleet.geofences.remove_fence(unquote(name)):
+            raise NotFoundException()
+        self.response(200)
+
+    def _geofence_events(self):
+        """
+        Enter/exit events stream. Client passes `next` value of the previous response as `since`.
+        Query parameters: since, vin, limit, wait - seconds to wait for new events
+        """
+        limit = self.query_param('limit', 1000, int)
+        if limit < 1:
+            raise BadRequestException(message='limit must be >= 1')
+        wait = min(self.query_param('wait', 0, float), self.MAX_EVENTS_WAIT)
+        if wait > 0 and not self.event_waiters.acquire(blocking=False):
+            self.response(503, body=b'Too many clients wait for events', headers={"Retry-After": "1"})
+            return
+        try:
+            events, next_seq = self.fleet.geofences.events_since(
+                seq=self.query_param('since', 0, int),
+                vin=self.query_param('vin'),
+                limit=limit,
+                wait=wait,
+            )
+        finally:
+            if wait > 0:
+                self.event_waiters.release()
+        data = json.dumps({"events": events, "next": next_seq}).encode("utf-8")
+        self.response(200, body=data, headers={"Content-Type": "application/json"})
+
+    def _history(self):
+        """
+        Recent telemetry of a vehicle.
+        Query parameters:
+            vin - primary vehicle by default
+            from, to - unix timestamps, negative values are seconds before now
+            step - seconds, samples are downsampled to buckets with min/max/mean of every field
+            fields - comma separated history fields, all by default
+        """
+        history = self.fleet.history
+        if history is None:
+            raise NotFoundException(message='History is disabled')
+        vin = self.query_param('vin', self.fleet.primary_vin)
+        if vin not in history:
+            raise NotFoundException(message='Unknown vehicle {}'.format(vin))
+        now = time.time()
+        start, end = [value + now if value is not None and value < 0 else value
+                      for value in (self.query_param('from', convert=float), self.query_param('to', convert=float))]
+        step = self.query_param('step', convert=float)
+        if step is not None and step <= 0:
+            raise BadRequestException(message='step must be positive')
+        fields = self.query_param('fields', HISTORY_FIELDS, lambda value: [f for f in value.split(',') if f])
+        unknown = [field for field in fields if field not in HISTORY_FIELDS]
+        if unknown:
+            raise BadRequestException(message='Unknown fields: {}'.format(', '.join(unknown)))
+
+        samples = history.query(vin, start, end, step, fields)
+        data = json.dumps({"vin": vin, "step": step, "samples": samples}).encode("utf-8")
         self.response(200, body=data, headers={"Content-Type": "application/json"})
 
+    def _trip(self):
+        """Trip aggregates of the vehicle given by vin query parameter or of the whole fleet"""
+        trips = self._trips()
+        vin = self.query_param('vin')
+        if vin is None:
+            data = {"fleet": trips.total()}
+        else:
+            data = {"vin": vin, "trip": trips.vehicle(vin)}
+        self.response(200, body=json.dumps(data).encode("utf-8"), headers={"Content-Type": "application/json"})
+
+    def _reset_trip(self):
+        """Starts new trip of the vehicle given by vin query parameter or of all vehicles"""
+        self._trips().reset(self.query_param('vin'))
+        self.response(200)
+
+    def _trips(self):
+        trips = self.fleet.trips
+        if trips is None:
+            raise NotFoundException(message='Trip analytics is disabled')
+        vin = self.query_param('vin')
+        if vin is not None and vin not in trips:
+            raise NotFoundException(message='Unknown vehicle {}'.format(vin))
+        return trips
+
+    def _scenario(self):
+        """POST schedules scenario events relative to the current simulated time, GET shows scenario progress"""
+        fleet = self.fleet
+        if self.command == 'POST':
+            try:
+                events = parse_scenario(self._read_json())
+                fleet.load_scenario(events)
+            except ValueError as ex:
+                raise BadRequestException(message=str(ex))
+            data = json.dumps({"scheduled": len(events)}).encode("utf-8")
+            self.response(201, body=data, headers={"Content-Type": "application/json"})
+        else:
+            data = json.dumps({
+                "time": fleet.time,
+                "tick": fleet.tick,
+                "pending": len(fleet.scenario),
+                "executed": fleet.scenario.executed,
+                "failed": fleet.scenario.failed,
+            }).encode("utf-8")
+            self.response(200, body=data, headers={"Content-Type": "application/json"})
+
+    def _clear_scenario(self):
+        self.fleet.scenario.clear()
+        self.response(200)
+
+    def _read_json(self):
+        data_len = int(self.headers.get('Content-Length', 0))
+        try:
+            return json.loads(self.rfile.read(data_len).decode("utf-8"))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise BadRequestException(message='Invalid JSON')
+
+    def _debug_profile(self):
+        """Starts cProfile capture of the simulation loop for `seconds`, the report is at /debug/profile/result"""
+        seconds = self.query_param('seconds', 5, float)
+        try:
+            self.fleet.profile_capture.start(seconds)
+        except ValueError as ex:
+            raise BadRequestException(message=str(ex))
+        except RuntimeError as ex:
+            raise HttpResponseException(409, str(ex))
+        data = json.dumps({"seconds": seconds, "result": "/debug/profile/result"}).encode("utf-8")
+        self.response(202, body=data, headers={"Content-Type": "application/json"})
+
+    def _debug_profile_result(self):
+        """cProfile statistics of the last capture, 202 while it is being collected"""
+        sort = self.query_param('sort', 'cumulative')
+        limit = self.query_param('limit', 50, int)
+        try:
+            report = self.fleet.profile_capture.result(sort=sort, limit=limit)
+        except ValueError as ex:
+            raise BadRequestException(message=str(ex))
+        except LookupError as ex:
+            raise NotFoundException(message=str(ex))
+        except TimeoutError as ex:
+            raise HttpResponseException(409, str(ex))
+        if report is None:
+            self.response(202, body=b'Profiling is in progress', headers={"Content-Type": "text/plain"})
+        else:
+            self.response(200, body=report.encode("utf-8"), headers={"Content-Type": "text/plain"})
+
+    def _debug_timings(self):
+        data = json.dumps(self.fleet.profiler.to_dict()).encode("utf-8")
+        self.response(200, body=data, headers={"Content-Type": "application/json"})
+
+    def _debug_timings_action(self, action):
+        getattr(self.fleet.profiler, action)()
+        self.response(200)
+
     def do_POST(self):
         return self.do_GET()
 
@@ -84,25 +393,110 @@ class RestEmulatorCommandsRequestHandler(EmulatorCommandsRequestHandler):
             self.emulator.tire_break()
 
 
-class RestEmulatorAPIServer(HTTPServer):
-    def __init__(self, server_address, emulator):
+class RestEmulatorAPIServer(AdmissionControlMixIn, HTTPServer):
+    def __init__(self, server_address, emulator, fleet=None):
         super().__init__(server_address, RestEmulatorCommandsRequestHandler)
         self.emulator = emulator
+        self.fleet = fleet or Fleet({VEHICLE_VIN: emulator})
+
+
+class RestEmulatorUnixAPIServer(AdmissionControlMixIn, socketserver.UnixStreamServer):
+    def __init__(self, socket_path, emulator, fleet=None, mode=CONTROL_API_UNIX_SOCKET_MODE):
+        self.mode = mode
+        super().__init__(socket_path, RestEmulatorCommandsRequestHandler)
+        self.emulator = emulator
+        self.fleet = fleet or Fleet({VEHICLE_VIN: emulator})
+
+    def server_bind(self):
+        # remove socket left by previous run
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        # create socket file with restricted permissions from the start
+        old_umask = os.umask(0o777 & ~self.mode)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(old_umask)
+        os.chmod(self.server_address, self.mode)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def create_control_servers(fleet):
+    servers = []
+    if CONTROL_API_ADDRESS:
+        servers.append(RestEmulatorAPIServer(CONTROL_API_ADDRESS, fleet.primary, fleet))
+    if CONTROL_API_UNIX_SOCKET:
+        servers.append(RestEmulatorUnixAPIServer(CONTROL_API_UNIX_SOCKET, fleet.primary, fleet))
+    if not servers:
+        raise RuntimeError("Neither TCP address nor unix socket is configured for control API")
+    return servers
+
+
+def shutdown_control_servers():
+    for server in control_servers:
+        server.shutdown()
+        server.server_close()
+
+
+def create_checkpointer(fleet):
+    if not CHECKPOINT_PATH:
+        return None
+    start = time.perf_counter()
+    restored = restore_checkpoint(CHECKPOINT_PATH, fleet)
+    if restored:
+        logger.info("{} vehicles are restored from {} in {:.1f} ms".format(
+            len(restored), CHECKPOINT_PATH, (time.perf_counter() - start) * 1000))
+    return Checkpointer(CHECKPOINT_PATH, fleet, CHECKPOINT_INTERVAL)
+
+
+def save_checkpoint():
+    if checkpointer is not None:
+        try:
+            checkpointer.save_now()
+        except OSError as ex:
+            logger.error("Can't save checkpoint: {}".format(ex))
+
+
+# is set by signals, the simulation loop stops after the current tick, so the last checkpoint has no half-applied tick
+shutdown_requested = Event()
 
 
 def signal_handler(signum, frame):
-    if signum == 15:
-        control_server.shutdown()
+    if signum == signal.SIGTERM:
         print('got SIGTERM')
-        sys.exit(0)
+    shutdown_requested.set()
+
+
+def create_telemetry_writer():
+    if not SHM_TELEMETRY_PATH:
+        return None
+    if not os.path.isdir(os.path.dirname(SHM_TELEMETRY_PATH)):
+        logger.warning("Shared memory telemetry is disabled: no directory for {}".format(SHM_TELEMETRY_PATH))
+        return None
+    return TelemetryWriter(SHM_TELEMETRY_PATH)
 
 
-def emulator_loop(emulator):
+def emulator_loop(fleet, telemetry_writer=None, checkpointer=None):
     delta = time.time()
-    while True:
+    while not shutdown_requested.is_set():
+        scheduled = time.time() + EMULATOR_UPDATE_TIME
         time.sleep(EMULATOR_UPDATE_TIME)
-        emulator.update(time.time() - delta)
+        started = time.time()
+        TICK_LATENESS.observe(max(0.0, started - scheduled))
+        fleet.update(started - delta)
         delta = time.time()
+        TICK_DURATION.observe(delta - started)
+        if fleet.history is not None:
+            fleet.history.record(delta)
+        fleet.profile_capture.tick()
+        if checkpointer is not None:
+            checkpointer.tick()
+        if telemetry_writer is not None:
+            telemetry_writer.publish(fleet.primary.tick, fleet.primary.get_data(), timestamp=delta)
 
 
 if __name__ == '__main__':
@@ -114,17 +508,35 @@ if __name__ == '__main__':
     tl.setLevel(logging.DEBUG)
 
     base_dir = os.path.dirname(__file__)
-    vp = VertexPool(os.path.join(base_dir, 'map.json'))
-    emulator = Emulator(vp)
-    control_server = RestEmulatorAPIServer(CONTROL_API_ADDRESS, emulator)
+    if MAP_TILES_FILE:
+        vp = TiledVertexPool(MAP_TILES_FILE, MAP_TILES_MEMORY_BUDGET)
+    else:
+        vp = VertexPool(os.path.join(base_dir, 'map.json'))
+    fleet = Fleet.create(vp, make_vins(VEHICLE_VIN, FLEET_SIZE), adaptive=ADAPTIVE_TICKING,
+                         traffic=TRAFFIC_INTERACTION, history_capacity=HISTORY_CAPACITY,
+                         trips=TRIP_ANALYTICS)
+    if PROFILING_ENABLED:
+        fleet.profiler.enable()
+    register_fleet_metrics(fleet)
+    checkpointer = create_checkpointer(fleet)
+    if SCENARIO_FILE:
+        fleet.load_scenario(load_scenario(SCENARIO_FILE))
+    control_servers = create_control_servers(fleet)
 
     signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGINT, signal_handler)
 
-    server_thread = Thread(target=control_server.serve_forever, daemon=False)
-    server_thread.start()
+    server_threads = [Thread(target=server.serve_forever, daemon=False) for server in control_servers]
+    for server_thread in server_threads:
+        server_thread.start()
+    telemetry_writer = create_telemetry_writer()
     try:
-        emulator_loop(emulator)
-    except KeyboardInterrupt:
-        logger.info("received Keyboard interrupt. shutting down")
-        control_server.shutdown()
-        server_thread.join()
+        emulator_loop(fleet, telemetry_writer, checkpointer)
+        logger.info("shutting down")
+        shutdown_control_servers()
+        save_checkpoint()
+        for server_thread in server_threads:
+            server_thread.join()
+    finally:
+        if telemetry_writer is not None:
+            telemetry_writer.close()
@@ -0,0 +1,186 @@
+from collections import OrderedDict
+import math
+
+from telemetry_emulator.emulator import VertexPool, Emulator
+from telemetry_emulator.geofence import GeofenceEngine
+from telemetry_emulator.history import FleetHistory
+from telemetry_emulator.profiling import UpdateProfiler, ProfileCapture
+from telemetry_emulator.scenario import ScenarioRunner
+from telemetry_emulator.traffic import TrafficIndex
+from telemetry_emulator.trip import FleetTrips
+
+
+class GridIndex:
+    """
+    Uniform grid spatial index over metre coordinates.
+    Item is moved between cells only when it crosses a cell border, so updating position of an item is O(1).
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self._cells = {}  # (cx, cy) -> {key: (x, y)}
+        self._item_cells = {}  # key -> (cx, cy)
+
+    def _cell(self, x, y):
+        return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+    def update(self, key, x, y):
+        cell = self._cell(x, y)
+        old_cell = self._item_cells.get(key)
+        if old_cell != cell:
+            if old_cell is not None:
+                self._remove_from_cell(key, old_cell)
+            self._item_cells[key] = cell
+            self._cells.setdefault(cell, {})[key] = (x, y)
+        else:
+            self._cells[cell][key] = (x, y)
+
+    def remove(self, key):
+        cell = self._item_cells.pop(key, None)
+        if cell is not None:
+            self._remove_from_cell(key, cell)
+
+    def _remove_from_cell(self, key, cell):
+        items = self._cells[cell]
+        del items[key]
+        if not items:
+            del self._cells[cell]
+
+    def query(self, x0, y0, x1, y1):
+        """Returns keys of items inside the box (borders included)"""
+        x0, x1 = min(x0, x1), max(x0, x1)
+        y0, y1 = min(y0, y1), max(y0, y1)
+        cx0, cy0 = self._cell(x0, y0)
+        cx1, cy1 = self._cell(x1, y1)
+
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self._cells):
+            # box covers more cells than are occupied, check occupied ones
+            cells = [(cell, list(items.items())) for cell, items in list(self._cells.items())
+                     if cx0 <= cell[0] <= cx1 and cy0 <= cell[1] <= cy1]
+        else:
+            cells = []
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    items = self._cells.get((cx, cy))
+                    if items:
+                        cells.append(((cx, cy), list(items.items())))
+
+        result = []
+        for (cx, cy), items in cells:
+            if cx0 < cx < cx1 and cy0 < cy < cy1:
+                # inner cell is inside the box entirely
+                result.extend(key for key, _ in items)
+            else:
+                result.extend(key for key, (x, y) in items if x0 <= x <= x1 and y0 <= y <= y1)
+        return result
+
+    def __len__(self):
+        return len(self._item_cells)
+
+
+class Fleet:
+    """Several vehicles driving on the same map. The first vehicle is the primary one served by /stats"""
+    INDEX_CELL_SIZE = 500  # meters
+
+    def __init__(self, vehicles: OrderedDict, adaptive=False, traffic=False, history_capacity=0, trips=False):
+        assert vehicles
+        self.vehicles = OrderedDict(vehicles)
+        # steady vehicles are skipped till their next event, see Emulator.defer()
+        self.adaptive = adaptive
+        self.deferred = 0  # vehicles skipped on the last update
+        self.primary_vin = next(iter(self.vehicles))
+        self._index = GridIndex(self.INDEX_CELL_SIZE)
+        # vehicles follow each other instead of passing through
+        self.traffic = TrafficIndex() if traffic else None
+        self.geofences = GeofenceEngine()
+        self.scenario = ScenarioRunner()
+        # recent telemetry of every vehicle, is recorded by the simulation loop
+        self.history = FleetHistory(self, history_capacity) if history_capacity else None
+        # running trip aggregates of every vehicle
+        self.trips = FleetTrips(self) if trips else None
+        # simulated seconds and ticks since the fleet was created
+        self.time = 0.0
+        self.tick = 0
+        self.profiler = UpdateProfiler()
+        self.profile_capture = ProfileCapture()
+        for vin, emulator in self.vehicles.items():
+            emulator.traffic = self.traffic
+            self.profiler.attach(emulator)
+        self.reindex()
+
+    @classmethod
+    def create(cls, vertex_pool: VertexPool, vins, **kwargs):
+        return cls(OrderedDict((vin, Emulator(vertex_pool)) for vin in vins), **kwargs)
+
+    @property
+    def primary(self) -> Emulator:
+        return self.vehicles[self.primary_vin]
+
+    @property
+    def vertex_pool(self) -> VertexPool:
+        return self.primary.vertex_pool
+
+    def load_scenario(self, events):
+        """Schedules scenario events relative to the current simulated time"""
+        unknown = sorted({vin for event in events for vin in (event.vehicles or ()) if vin not in self.vehicles})
+        if unknown:
+            raise ValueError("Unknown vehicles: {}".format(', '.join(unknown)))
+        self.scenario.schedule(events, self.time, self.tick)
+
+    def reindex(self):
+        """Updates spatial and traffic indexes after positions of vehicles were changed not by update()"""
+        for vin, emulator in self.vehicles.items():
+            self._index.update(vin, emulator.x, emulator.y)
+            if self.traffic is not None:
+                self.traffic.update(vin, emulator)
+
+    def update(self, time_delta=1.0):
+        self.scenario.run_due(self)
+        index = self._index
+        traffic = self.traffic
+        geofences = self.geofences if self.geofences.fences else None
+        adaptive = self.adaptive
+        deferred = 0
+        trips = self.trips
+        for vin, emulator in self.vehicles.items():
+            if adaptive and emulator.defer(time_delta):
+                # position of the steady vehicle is the same, it is read without catching up
+                deferred += 1
+            else:
+                emulator.update(time_delta)
+                index.update(vin, emulator.x, emulator.y)
+                if traffic is not None:
+                    traffic.update(vin, emulator)
+            # deferred vehicles too, so fences added around a standing vehicle get their enter events.
+            # Nothing is checked again for an unchanged position and fences
+            if geofences is not None:
+                geofences.update(vin, emulator.lon, emulator.lat, emulator.tick)
+            if trips is not None:
+                trips.update(vin, emulator, time_delta)
+        self.deferred = deferred
+        self.time += time_delta
+        self.tick += 1
+
+    def find(self, long0, lat0, long1, lat1):
+        """Returns sorted VINs of vehicles inside the bounding box"""
+        vertex_pool = self.vertex_pool
+        return sorted(self._index.query(
+            vertex_pool.lon_to_meters(long0), vertex_pool.lat_to_meters(lat0),
+            vertex_pool.lon_to_meters(long1), vertex_pool.lat_to_meters(lat1)
+        ))
+
+    def __getitem__(self, vin) -> Emulator:
+        return self.vehicles[vin]
+
+    def __contains__(self, vin):
+        return vin in self.vehicles
+
+    def __iter__(self):
+        return iter(self.vehicles)
+
+    def __len__(self):
+        return len(self.vehicles)
+
+
+def make_vins(primary_vin, fleet_size):
+    return [primary_vin] + ["{}-{:04d}".format(primary_vin, i) for i in range(1, fleet_size)]
@@ -0,0 +1,241 @@
+"""
+Named geofences (rectangles and polygons) for fleet vehicles.
+
+Fences are indexed by a uniform grid over longitude/latitude: every cell keeps fences whose bounding box overlaps it,
+so a containment check of a vehicle tests only fences of its cell. Enter/exit events are emitted only when the set of
+fences containing a vehicle changes and are kept in a bounded log which consumers read by sequence number.
+"""
+from collections import deque
+import math
+import threading
+import time
+
+
+class Fence:
+    def __init__(self, name, vehicles=None):
+        self.name = name
+        # None means the fence is applied to every vehicle of the fleet
+        self.vehicles = frozenset(vehicles) if vehicles is not None else None
+
+    def applies_to(self, vin):
+        return self.vehicles is None or vin in self.vehicles
+
+    def bbox(self):
+        raise NotImplementedError
+
+    def contains(self, lon, lat):
+        raise NotImplementedError
+
+    def to_dict(self):
+        return {"name": self.name, "vehicles": sorted(self.vehicles) if self.vehicles is not None else None}
+
+
+class RectangleFence(Fence):
+    def __init__(self, name, long0, lat0, long1, lat1, vehicles=None):
+        super().__init__(name, vehicles)
+        self.min_lon, self.max_lon = min(long0, long1), max(long0, long1)
+        self.min_lat, self.max_lat = min(lat0, lat1), max(lat0, lat1)
+
+    def bbox(self):
+        return self.min_lon, self.min_lat, self.max_lon, self.max_lat
+
+    def contains(self, lon, lat):
+        # borders are outside as for Emulator rectangle
+        return self.min_lon < lon < self.max_lon and self.min_lat < lat < self.max_lat
+
+    def to_dict(self):
+        result = super().to_dict()
+        result.update(type="rectangle", rectangle=[self.min_lon, self.min_lat, self.max_lon, self.max_lat])
+        return result
+
+
+class PolygonFence(Fence):
+    def __init__(self, name, points, vehicles=None):
+        super().__init__(name, vehicles)
+        if len(points) < 3:
+            raise ValueError("Polygon must have at least 3 points")
+        self.points = [(float(lon), float(lat)) for lon, lat in points]
+        lons = [lon for lon, _ in self.points]
+        lats = [lat for _, lat in self.points]
+        self._bbox = min(lons), min(lats), max(lons), max(lats)
+
+    def bbox(self):
+        return self._bbox
+
+    def contains(self, lon, lat):
+        min_lon, min_lat, max_lon, max_lat = self._bbox
+        if not (min_lon <= lon <= max_lon and min_lat <= lat <= max_lat):
+            return False
+        # ray casting
+        inside = False
+        points = self.points
+        lon_j, lat_j = points[-1]
+        for lon_i, lat_i in points:
+            if (lat_i > lat) != (lat_j > lat) and lon < (lon_j - lon_i) * (lat - lat_i) / (lat_j - lat_i) + lon_i:
+                inside = not inside
+            lon_j, lat_j = lon_i, lat_i
+        return inside
+
+    def to_dict(self):
+        result = super().to_dict()
+        result.update(type="polygon", points=[list(point) for point in self.points])
+        return result
+
+
+def fence_from_dict(data):
+    """Creates fence from JSON description used by the control API"""
+    name = data.get("name")
+    if not name or not isinstance(name, str):
+        raise ValueError("Fence must have a name")
+    fence_type = data.get("type", "rectangle")
+    vehicles = data.get("vehicles")
+    if vehicles is not None and (not isinstance(vehicles, list) or not all(isinstance(vin, str) for vin in vehicles)):
+        raise ValueError("vehicles must be a list of VINs")
+    if fence_type == "rectangle":
+        rectangle = data.get("rectangle")
+        if not rectangle or len(rectangle) != 4:
+            raise ValueError("rectangle must be [long0, lat0, long1, lat1]")
+        return RectangleFence(name, *[float(v) for v in rectangle], vehicles=vehicles)
+    if fence_type == "polygon":
+        return PolygonFence(name, data.get("points") or [], vehicles=vehicles)
+    raise ValueError("Unknown fence type {}".format(fence_type))
+
+
+class GeofenceIndex:
+    """Grid index of fence bounding boxes. Fences covering too many cells are kept aside and checked always"""
+    CELL_SIZE = 0.01  # degrees, ~1 km
+    MAX_CELLS_PER_FENCE = 4096
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self._cells = {}  # (cx, cy) -> set of fence names
+        self._fence_cells = {}  # fence name -> list of cells
+        self._large = set()
+
+    def _cell(self, lon, lat):
+        return int(math.floor(lon / self.cell_size)), int(math.floor(lat / self.cell_size))
+
+    def add(self, fence: Fence):
+        min_lon, min_lat, max_lon, max_lat = fence.bbox()
+        cx0, cy0 = self._cell(min_lon, min_lat)
+        cx1, cy1 = self._cell(max_lon, max_lat)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > self.MAX_CELLS_PER_FENCE:
+            self._large.add(fence.name)
+            return
+        cells = [(cx, cy) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1)]
+        for cell in cells:
+            self._cells.setdefault(cell, set()).add(fence.name)
+        self._fence_cells[fence.name] = cells
+
+    def remove(self, name):
+        self._large.discard(name)
+        for cell in self._fence_cells.pop(name, ()):
+            names = self._cells[cell]
+            names.discard(name)
+            if not names:
+                del self._cells[cell]
+
+    def candidates(self, lon, lat):
+        names = self._cells.get(self._cell(lon, lat))
+        if not self._large:
+            return names or ()
+        return self._large.union(names) if names else self._large
+
+
+class GeofenceEngine:
+    EVENT_LOG_SIZE = 10000
+
+    def __init__(self):
+        self.fences = {}
+        self._index = GeofenceIndex()
+        self._inside = {}  # vin -> frozenset of fence names
+        self._last_check = {}  # vin -> (lon, lat, fences generation, tick) of the last containment check
+        # is incremented when a fence is added, so vehicles are checked again even if they have not moved
+        self._generation = 0
+        self._events = deque(maxlen=self.EVENT_LOG_SIZE)
+        self._next_seq = 1
+        self._lock = threading.Lock()
+        self._new_events = threading.Condition(self._lock)
+
+    def add_fence(self, fence: Fence):
+        """
+        Adds or replaces the fence.
+        Vehicles inside the replaced fence get exit events on their next update only if they are outside the new one.
+        """
+        with self._lock:
+            if fence.name in self.fences:
+                self._index.remove(fence.name)
+            self.fences[fence.name] = fence
+            self._index.add(fence)
+            self._generation += 1
+
+    def remove_fence(self, name):
+        """Removes the fence, vehicles which were inside it get exit events at their last checked position"""
+        with self._lock:
+            if name not in self.fences:
+                return False
+            del self.fences[name]
+            self._index.remove(name)
+            timestamp = time.time()
+            for vin, names in list(self._inside.items()):
+                if name in names:
+                    self._inside[vin] = names.difference((name,))
+                    lon, lat, _, tick = self._last_check[vin]
+                    self._emit(vin, name, "exit", lon, lat, tick, timestamp)
+            self._new_events.notify_all()
+            return True
+
+    def update(self, vin, lon, lat, tick=None):
+        """Checks containment of the vehicle. Nothing is done if neither the vehicle nor fences have changed"""
+        last_check = self._last_check.get(vin)
+        if last_check is not None and last_check[0] == lon and last_check[1] == lat \
+                and last_check[2] == self._generation:
+            return
+
+        with self._lock:
+            self._last_check[vin] = (lon, lat, self._generation, tick)
+            fences = self.fences
+            inside = frozenset(name for name in self._index.candidates(lon, lat)
+                               if fences[name].applies_to(vin) and fences[name].contains(lon, lat))
+            previous = self._inside.get(vin, frozenset())
+            if inside == previous:
+                return
+            self._inside[vin] = inside
+
+            timestamp = time.time()
+            for name in sorted(previous - inside):
+                self._emit(vin, name, "exit", lon, lat, tick, timestamp)
+            for name in sorted(inside - previous):
+                self._emit(vin, name, "enter", lon, lat, tick, timestamp)
+            self._new_events.notify_all()
+
+    def _emit(self, vin, name, event, lon, lat, tick, timestamp):
+        self._events.append({
+            "seq": self._next_seq,
+            "vin": vin,
+            "fence": name,
+            "event": event,
+            "lat": lat,
+            "lon": lon,
+            "tick": tick,
+            "timestamp": timestamp,
+        })
+        self._next_seq += 1
+
+    def inside(self, vin):
+        return sorted(self._inside.get(vin, ()))
+
+    def events_since(self, seq=0, vin=None, limit=1000, wait=0):
+        """
+        Returns (events with sequence number greater than seq, next seq to ask).
+        If there are no events, waits for new ones up to `wait` seconds.
+        """
+        if limit < 1:
+            raise ValueError("limit must be >= 1")
+        with self._lock:
+            if wait > 0 and self._next_seq - 1 <= seq:
+                self._new_events.wait_for(lambda: self._next_seq - 1 > seq, timeout=wait)
+            events = [event for event in self._events
+                      if event["seq"] > seq and (vin is None or event["vin"] == vin)][:limit]
+            next_seq = events[-1]["seq"] if len(events) == limit else self._next_seq - 1
+        return events, max(next_seq, seq)
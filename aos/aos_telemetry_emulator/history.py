@@ -0,0 +1,123 @@
+"""
+Recent telemetry history of fleet vehicles.
+
+Every vehicle has a ring buffer of fixed capacity, each field is kept in its own typed array, so memory is allocated
+once on start: about 50 bytes per sample. Samples are appended by the simulation loop after every tick and are
+queried by time range, either raw or downsampled to buckets with min/max/mean of every field.
+"""
+from array import array
+import threading
+
+# (name, Emulator attribute, array type code)
+FIELDS = (
+    ('lat', 'lat', 'd'),
+    ('lon', 'lon', 'd'),
+    ('speed', 'speed_kmph', 'f'),
+    ('rpm', 'rpm', 'i'),
+    ('gear', 'gear', 'b'),
+    ('fuel_level', 'fuel_level', 'i'),
+    ('tire_pressure', 'tire_pressure', 'f'),
+    ('stop_signal', 'stop_signal', 'b'),
+    ('turn_signal', 'turn_signal', 'b'),
+)
+FIELD_NAMES = tuple(name for name, _, _ in FIELDS)
+
+
+class VehicleHistory:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.values = [array(code, bytes(array(code).itemsize * capacity)) for _, _, code in FIELDS]
+        self._next = 0  # position of the next sample
+        self.count = 0
+
+    def append(self, timestamp, emulator):
+        position = self._next
+        self.timestamps[position] = timestamp
+        for values, (_, attribute, _) in zip(self.values, FIELDS):
+            values[position] = getattr(emulator, attribute)
+        self._next = (position + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def _position(self, index):
+        """Position in arrays of the index-th sample from the oldest one"""
+        return (self._next - self.count + index) % self.capacity
+
+    def _bisect(self, timestamp, right=False):
+        """Index of the first sample with timestamp >= the given one (> if right is True)"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            value = self.timestamps[self._position(middle)]
+            if value < timestamp or (right and value == timestamp):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def range(self, start=None, end=None, fields=FIELD_NAMES):
+        """Returns (timestamps, {field: values}) of samples with start <= timestamp <= end"""
+        first = self._bisect(start) if start is not None else 0
+        last = self._bisect(end, right=True) if end is not None else self.count
+        positions = [self._position(index) for index in range(first, last)]
+        timestamps = [self.timestamps[position] for position in positions]
+        result = {}
+        for name, values in zip(FIELD_NAMES, self.values):
+            if name in fields:
+                result[name] = [values[position] for position in positions]
+        return timestamps, result
+
+
+def downsample(timestamps, values, start, step):
+    """Groups samples to buckets of `step` seconds from `start`, returns list of bucket dicts"""
+    bounds = []  # (bucket start, index of the first sample)
+    for index, timestamp in enumerate(timestamps):
+        bucket_start = start + (timestamp - start) // step * step
+        if not bounds or bounds[-1][0] != bucket_start:
+            bounds.append((bucket_start, index))
+
+    buckets = []
+    for number, (bucket_start, begin) in enumerate(bounds):
+        end = bounds[number + 1][1] if number + 1 < len(bounds) else len(timestamps)
+        bucket = {"timestamp": bucket_start, "count": end - begin}
+        for name, field_values in values.items():
+            chunk = field_values[begin:end]
+            bucket[name] = {"min": min(chunk), "max": max(chunk), "mean": sum(chunk) / len(chunk)}
+        buckets.append(bucket)
+    return buckets
+
+
+class FleetHistory:
+    def __init__(self, fleet, capacity):
+        self.fleet = fleet
+        self.capacity = capacity
+        self._vehicles = {vin: VehicleHistory(capacity) for vin in fleet}
+        self._lock = threading.Lock()
+
+    def record(self, timestamp):
+        with self._lock:
+            for vin, emulator in self.fleet.vehicles.items():
+                self._vehicles[vin].append(timestamp, emulator)
+
+    def query(self, vin, start=None, end=None, step=None, fields=FIELD_NAMES):
+        """
+        Samples of the vehicle between start and end timestamps (both inclusive). If step is given, samples are
+        downsampled to buckets of `step` seconds aligned to start (or to the first sample).
+        """
+        with self._lock:
+            timestamps, values = self._vehicles[vin].range(start, end, fields)
+        if step is None:
+            samples = []
+            for index, timestamp in enumerate(timestamps):
+                sample = {"timestamp": timestamp}
+                for name, field_values in values.items():
+                    sample[name] = field_values[index]
+                samples.append(sample)
+            return samples
+        if not timestamps:
+            return []
+        return downsample(timestamps, values, start if start is not None else timestamps[0], step)
+
+    def __contains__(self, vin):
+        return vin in self._vehicles
@@ -0,0 +1,222 @@
+"""
+Load generator for the control API of a local emulator instance.
+
+Simulates VIS-adapter-like clients: every client polls /stats at the given rate and also posts /attributes and
+sends control commands at their own rates. Requests are scheduled at fixed intervals, latency is measured from the
+moment the request was due, so a slow server is not hidden by clients which wait for it.
+Connections are reused when the server keeps them alive, otherwise every request opens a new one.
+
+Usage:
+    python3 loadgen.py --tcp 127.0.0.1:8088 --clients 50 --rate 10 --duration 30
+    python3 loadgen.py --unix /run/telemetry-emulator.sock --clients 10 --attributes-rate 0.1 --command-rate 0.05
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telemetry_emulator.stats_latency import percentile
+
+DEFAULT_COMMANDS = ('/test-rectangle', '/rectangle-in', '/rectangle-out', '/del-rectangle')
+DEFAULT_ATTRIBUTES = '{"to_rectangle": false}'
+
+
+class HttpError(Exception):
+    pass
+
+
+class Connection:
+    """Minimal HTTP/1.1 client connection which can be kept open between requests"""
+
+    def __init__(self, address, timeout):
+        self.address = address
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self.connects = 0
+
+    async def _connect(self):
+        if isinstance(self.address, str):
+            self._reader, self._writer = await asyncio.open_unix_connection(self.address)
+        else:
+            self._reader, self._writer = await asyncio.open_connection(*self.address)
+        self.connects += 1
+
+    async def request(self, method, path, body=b''):
+        """Returns (status, body)"""
+        return await asyncio.wait_for(self._request(method, path, body), self.timeout)
+
+    async def _request(self, method, path, body):
+        if self._writer is None:
+            await self._connect()
+        headers = 'Host: localhost\r\nConnection: keep-alive\r\n'
+        if body:
+            headers += 'Content-Type: application/json\r\nContent-Length: {}\r\n'.format(len(body))
+        self._writer.write('{} {} HTTP/1.1\r\n{}\r\n'.format(method, path, headers).encode('ascii') + body)
+        try:
+            status_line = await self._reader.readline()
+            if not status_line:
+                raise HttpError('connection closed')
+            version, status = status_line.split(b' ', 2)[:2]
+            response_headers = {}
+            while True:
+                line = await self._reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                response_headers[name.strip().lower()] = value.strip().lower()
+
+            length = response_headers.get('content-length')
+            keep_alive = length is not None and (
+                response_headers.get('connection') == 'keep-alive'
+                or (version == b'HTTP/1.1' and response_headers.get('connection') != 'close'))
+            if length is not None:
+                data = await self._reader.readexactly(int(length))
+            else:
+                data = await self._reader.read()
+        except BaseException:
+            self.close()
+            raise
+        if not keep_alive:
+            self.close()
+        return int(status), data
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._reader = None
+
+
+class Results:
+    def __init__(self):
+        self.latencies = defaultdict(list)  # kind -> seconds
+        self.errors = defaultdict(int)  # (kind, error) -> count
+        self.late = 0  # requests sent later than scheduled because the client was busy
+
+    def report(self, duration):
+        kinds = {}
+        for kind in sorted(set(self.latencies) | {kind for kind, _ in self.errors}):
+            latencies = sorted(self.latencies[kind])
+            errors = {error: count for (error_kind, error), count in self.errors.items() if error_kind == kind}
+            kinds[kind] = {
+                "requests": len(latencies) + sum(errors.values()),
+                "throughput": len(latencies) / duration,
+                "p50_ms": percentile(latencies, 0.5) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+                "p999_ms": percentile(latencies, 0.999) * 1000,
+                "max_ms": latencies[-1] * 1000 if latencies else 0,
+                "errors": errors,
+            }
+        return {"duration": duration, "late_requests": self.late, "kinds": kinds}
+
+
+async def run_client(address, args, results, deadline, commands, attributes):
+    connection = Connection(address, args.timeout)
+    rates = [('stats', args.rate), ('attributes', args.attributes_rate), ('command', args.command_rate)]
+    rates = [(kind, rate) for kind, rate in rates if rate > 0]
+    total_rate = sum(rate for _, rate in rates)
+    interval = 1 / total_rate
+    loop = asyncio.get_running_loop()
+    # clients start spread over the first interval, as independent adapters do
+    due = loop.time() + random.random() * interval
+    try:
+        while due < deadline:
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                results.late += 1
+            kind = random.choices([kind for kind, _ in rates], [rate for _, rate in rates])[0]
+            if kind == 'stats':
+                method, path, body = 'GET', '/stats', b''
+            elif kind == 'attributes':
+                method, path, body = 'POST', '/attributes', attributes
+            else:
+                method, path, body = 'GET', random.choice(commands), b''
+            try:
+                status, _ = await connection.request(method, path, body)
+                if status >= 400:
+                    results.errors[(kind, 'http {}'.format(status))] += 1
+                else:
+                    results.latencies[kind].append(loop.time() - due)
+            except asyncio.TimeoutError:
+                results.errors[(kind, 'timeout')] += 1
+            except (OSError, HttpError, asyncio.IncompleteReadError, ValueError) as ex:
+                results.errors[(kind, type(ex).__name__)] += 1
+            due += interval
+    finally:
+        connection.close()
+    return connection.connects
+
+
+async def run(args):
+    if args.unix:
+        address = args.unix
+    else:
+        host, port = args.tcp.rsplit(':', 1)
+        address = (host, int(port))
+    commands = [command for command in args.commands.split(',') if command]
+    attributes = json.dumps(json.loads(args.attributes)).encode('utf-8')
+
+    results = Results()
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    deadline = start + args.duration
+    connects = await asyncio.gather(*[
+        run_client(address, args, results, deadline, commands, attributes) for _ in range(args.clients)
+    ])
+    report = results.report(loop.time() - start)
+    report["connections"] = sum(connects)
+    return report
+
+
+def print_report(report):
+    print("duration {:.1f}s, connections {}, late requests {}".format(
+        report["duration"], report["connections"], report["late_requests"]))
+    for kind, stats in report["kinds"].items():
+        print("{:<10} n={:<7} {:8.1f} req/s p50={:8.2f}ms p99={:8.2f}ms p999={:8.2f}ms max={:8.2f}ms errors={}".format(
+            kind, stats["requests"], stats["throughput"], stats["p50_ms"], stats["p99_ms"], stats["p999_ms"],
+            stats["max_ms"], sum(stats["errors"].values())))
+        for error, count in sorted(stats["errors"].items()):
+            print("    {}: {}".format(error, count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate polling load against local emulator control API")
+    parser.add_argument('--tcp', default='127.0.0.1:8088', help="host:port of TCP listener")
+    parser.add_argument('--unix', help="path to unix socket of control API, is used instead of --tcp")
+    parser.add_argument('-c', '--clients', type=int, default=10, help="number of simulated clients")
+    parser.add_argument('-r', '--rate', type=float, default=1.0, help="/stats polls per second of one client")
+    parser.add_argument('--attributes-rate', type=float, default=0.0,
+                        help="/attributes posts per second of one client")
+    parser.add_argument('--attributes', default=DEFAULT_ATTRIBUTES, help="JSON body of /attributes posts")
+    parser.add_argument('--command-rate', type=float, default=0.0,
+                        help="control commands per second of one client")
+    parser.add_argument('--commands', default=','.join(DEFAULT_COMMANDS),
+                        help="comma separated command paths, one is chosen randomly for every command")
+    parser.add_argument('-d', '--duration', type=float, default=30, help="seconds")
+    parser.add_argument('--timeout', type=float, default=5, help="request timeout, seconds")
+    parser.add_argument('--json', action='store_true', help="print report as JSON")
+    args = parser.parse_args()
+
+    if args.clients <= 0 or args.rate + args.attributes_rate + args.command_rate <= 0:
+        parser.error("at least one client with non-zero rate is required")
+    if args.command_rate > 0 and not args.commands:
+        parser.error("--commands is empty")
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
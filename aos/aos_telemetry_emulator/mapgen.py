@@ -0,0 +1,186 @@
+"""
+Synthetic road networks in VertexPool JSON format for scale testing.
+
+Topologies:
+    grid     rectangular grid of crossroads, every one is connected to its 4 neighbours
+    radial   rings around the centre connected by spokes, the centre is connected to the first ring
+    random   planar city: jittered grid where streets are randomly missing and some blocks have a diagonal street
+
+Neighbours of every vertex are computed from its position only, the random choices are hashes of the seed and the
+edge, so vertices are written one by one and memory does not depend on the size of the map. The random topology
+keeps a spanning tree (every crossroad has a street to its left or lower neighbour), so every vertex is reachable.
+Streets are two-way: when A is a neighbour of B, B is a neighbour of A.
+
+Usage:
+    python3 mapgen.py grid -n 10000 -o map.json
+    python3 mapgen.py random -n 10000000 --seed 7 -o big.json
+    python3 mapgen.py radial -n 50000 --step 120 > radial.json
+"""
+import argparse
+import math
+import sys
+
+DEFAULT_STEP = 150  # meters between crossroads
+DEFAULT_MIN_LATITUDE = 50.4
+DEFAULT_MIN_LONGITUDE = 30.5
+# random topology: share of non-tree streets which are kept, share of blocks with a diagonal street, and maximal
+# shift of crossroads in steps. Shift below a quarter of the step keeps blocks convex, so diagonals do not cross
+KEEP_STREET = 0.85
+DIAGONAL = 0.1
+JITTER = 0.2
+
+_MASK = (1 << 64) - 1
+
+
+def _random(seed, a, b, salt=0):
+    """Uniform value in [0, 1) which depends only on the arguments (splitmix64 finalizer)"""
+    value = (seed * 0x9E3779B97F4A7C15 + a * 0xC2B2AE3D27D4EB4F + b * 0x165667B19E3779F9 + salt) & _MASK
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK
+    return (value ^ (value >> 31)) / 2.0 ** 64
+
+
+def grid_size(vertices):
+    """(width, height) of the most square grid with at least the given number of vertices"""
+    width = max(2, math.ceil(math.sqrt(vertices)))
+    return width, max(2, math.ceil(vertices / width))
+
+
+def grid(width, height, step=DEFAULT_STEP):
+    """Yields (id, x, y, neighbour ids) of the grid, ids go row by row"""
+    for row in range(height):
+        for column in range(width):
+            vertex_id = row * width + column
+            neighbours = []
+            if column > 0:
+                neighbours.append(vertex_id - 1)
+            if column < width - 1:
+                neighbours.append(vertex_id + 1)
+            if row > 0:
+                neighbours.append(vertex_id - width)
+            if row < height - 1:
+                neighbours.append(vertex_id + width)
+            yield vertex_id, column * step, row * step, neighbours
+
+
+def radial_size(vertices):
+    """(rings, spokes) with about the given number of vertices, outer ring crossroads are about a step apart"""
+    rings = max(1, round(math.sqrt(vertices / (2 * math.pi))))
+    spokes = max(4, math.ceil((vertices - 1) / rings))
+    return rings, spokes
+
+
+def radial(rings, spokes, step=DEFAULT_STEP):
+    """Yields (id, x, y, neighbour ids): the centre has id 0, ring k (from 1) has ids 1 + (k - 1) * spokes + j"""
+    centre = rings * step
+
+    def vertex_id(ring, spoke):
+        return 1 + (ring - 1) * spokes + spoke % spokes
+
+    yield 0, centre, centre, [vertex_id(1, spoke) for spoke in range(spokes)]
+    for ring in range(1, rings + 1):
+        radius = ring * step
+        for spoke in range(spokes):
+            angle = 2 * math.pi * spoke / spokes
+            neighbours = [vertex_id(ring, spoke - 1), vertex_id(ring, spoke + 1)]
+            neighbours.append(vertex_id(ring - 1, spoke) if ring > 1 else 0)
+            if ring < rings:
+                neighbours.append(vertex_id(ring + 1, spoke))
+            yield vertex_id(ring, spoke), centre + radius * math.cos(angle), centre + radius * math.sin(angle), \
+                neighbours
+
+
+def random_planar(width, height, step=DEFAULT_STEP, seed=0, keep=KEEP_STREET, diagonal=DIAGONAL, jitter=JITTER):
+    """Yields (id, x, y, neighbour ids) of the random city, ids go row by row as in grid()"""
+
+    def parent(column, row):
+        """The tree street of the crossroad goes to the left or to the lower neighbour"""
+        if row == 0:
+            return (column - 1, row) if column > 0 else None
+        if column == 0:
+            return column, row - 1
+        return (column - 1, row) if _random(seed, column, row, 1) < 0.5 else (column, row - 1)
+
+    def has_street(a, b):
+        if parent(*a) == b or parent(*b) == a:
+            return True
+        low, high = min(a, b), max(a, b)
+        return _random(seed, low[1] * width + low[0], high[1] * width + high[0], 2) < keep
+
+    def block_diagonal(column, row):
+        """Diagonal of the block with the lower left corner at (column, row): 1 is /, -1 is \\, 0 is none"""
+        if not (0 <= column < width - 1 and 0 <= row < height - 1) or _random(seed, column, row, 3) >= diagonal:
+            return 0
+        return 1 if _random(seed, column, row, 4) < 0.5 else -1
+
+    for row in range(height):
+        for column in range(width):
+            neighbours = []
+            for other in ((column - 1, row), (column + 1, row), (column, row - 1), (column, row + 1)):
+                if 0 <= other[0] < width and 0 <= other[1] < height and has_street((column, row), other):
+                    neighbours.append(other[1] * width + other[0])
+            # blocks around the crossroad which have a diagonal from it
+            if block_diagonal(column, row) == 1:
+                neighbours.append((row + 1) * width + column + 1)
+            if block_diagonal(column - 1, row - 1) == 1:
+                neighbours.append((row - 1) * width + column - 1)
+            if block_diagonal(column - 1, row) == -1:
+                neighbours.append((row + 1) * width + column - 1)
+            if block_diagonal(column, row - 1) == -1:
+                neighbours.append((row - 1) * width + column + 1)
+            x = (column + (_random(seed, column, row, 5) * 2 - 1) * jitter) * step
+            y = (row + (_random(seed, column, row, 6) * 2 - 1) * jitter) * step
+            # coordinates are metres from the minimal latitude and longitude of the map
+            yield row * width + column, x + jitter * step, y + jitter * step, neighbours
+
+
+def generate(topology, vertices, step=DEFAULT_STEP, seed=0):
+    """Vertex iterator of the topology with about the given number of vertices"""
+    if topology == 'grid':
+        return grid(*grid_size(vertices), step=step)
+    if topology == 'radial':
+        return radial(*radial_size(vertices), step=step)
+    if topology == 'random':
+        return random_planar(*grid_size(vertices), step=step, seed=seed)
+    raise ValueError("Unknown topology {}".format(topology))
+
+
+def write_map(vertices, file, min_lat=DEFAULT_MIN_LATITUDE, min_lon=DEFAULT_MIN_LONGITUDE):
+    """Writes vertices (id, x, y, neighbour ids) to text file in VertexPool format. Returns number of vertices"""
+    file.write('{{"min_latitude": {!r}, "min_longitude": {!r}, "vertices": [\n'.format(min_lat, min_lon))
+    count = 0
+    for vertex_id, x, y, neighbours in vertices:
+        if count:
+            file.write(',\n')
+        file.write('{{"id": {}, "x": {!r}, "y": {!r}, "neighbours": [{}]}}'.format(
+            vertex_id, float(x), float(y), ', '.join(map(str, neighbours))))
+        count += 1
+    file.write('\n]}\n')
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic road network in VertexPool JSON format")
+    parser.add_argument('topology', choices=('grid', 'radial', 'random'))
+    parser.add_argument('-n', '--vertices', type=int, default=1000, help="approximate number of vertices")
+    parser.add_argument('--step', type=float, default=DEFAULT_STEP, help="meters between crossroads")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the random topology")
+    parser.add_argument('--min-latitude', type=float, default=DEFAULT_MIN_LATITUDE)
+    parser.add_argument('--min-longitude', type=float, default=DEFAULT_MIN_LONGITUDE)
+    parser.add_argument('-o', '--output', default='-', help="output file, - is stdout")
+    args = parser.parse_args()
+
+    if args.vertices < 4:
+        parser.error("at least 4 vertices are required")
+    vertices = generate(args.topology, args.vertices, args.step, args.seed)
+    if args.output == '-':
+        count = write_map(vertices, sys.stdout, args.min_latitude, args.min_longitude)
+    else:
+        # large buffer, the output is written by small pieces
+        with open(args.output, 'w', buffering=1024 * 1024) as file:
+            count = write_map(vertices, file, args.min_latitude, args.min_longitude)
+    print("{} vertices are written".format(count), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
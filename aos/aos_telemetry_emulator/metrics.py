@@ -0,0 +1,118 @@
+"""
+Minimal metrics registry rendering Prometheus text exposition format (version 0.0.4).
+
+Metrics are updated by request handlers and workers of all servers at once, so every metric (every labeled child)
+has its own lock. Values derived from other objects (e.g. fleet-wide sums) are computed by callbacks at scrape time.
+"""
+import threading
+
+from telemetry_emulator.profiling import Histogram
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Counter:
+    def __init__(self, function=None):
+        self.value = 0
+        self.function = function
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+
+class Gauge(Counter):
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+
+class MetricFamily:
+    def __init__(self, name, kind, help_text, label_names, factory):
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._factory = factory
+        self.children = {}
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        child = self.children.get(key)
+        if child is None:
+            # setdefault is atomic, concurrent first calls get the same child
+            child = self.children.setdefault(key, self._factory())
+        return child
+
+    def render(self, lines):
+        lines.append('# HELP {} {}'.format(self.name, self.help_text))
+        lines.append('# TYPE {} {}'.format(self.name, self.kind))
+        for key, child in sorted(self.children.items()):
+            labels = list(zip(self.label_names, key))
+            if self.kind == 'histogram':
+                self._render_histogram(lines, labels, child)
+            else:
+                lines.append('{}{} {}'.format(self.name, _format_labels(labels), _format_value(child.get())))
+
+    def _render_histogram(self, lines, labels, histogram: Histogram):
+        counts, total, _ = histogram.snapshot()
+        accumulated = 0
+        for bound, count in zip(histogram.buckets + (float('inf'),), counts):
+            accumulated += count
+            lines.append('{}_bucket{} {}'.format(
+                self.name, _format_labels(labels + [('le', _format_value(bound))]), accumulated))
+        lines.append('{}_sum{} {}'.format(self.name, _format_labels(labels), _format_value(total)))
+        lines.append('{}_count{} {}'.format(self.name, _format_labels(labels), accumulated))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, bool):
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._families = {}
+
+    def _register(self, name, kind, help_text, labels, factory):
+        if name in self._families:
+            raise ValueError("Metric {} is already registered".format(name))
+        family = MetricFamily(name, kind, help_text, labels, factory)
+        self._families[name] = family
+        # metric without labels is used directly
+        return family if labels else family.labels()
+
+    def counter(self, name, help_text, labels=(), function=None):
+        return self._register(name, 'counter', help_text, labels, lambda: Counter(function))
+
+    def gauge(self, name, help_text, labels=(), function=None):
+        return self._register(name, 'gauge', help_text, labels, lambda: Gauge(function))
+
+    def histogram(self, name, help_text, labels=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self._register(name, 'histogram', help_text, labels, lambda: Histogram(buckets))
+
+    def render(self):
+        lines = []
+        for family in self._families.values():
+            family.render(lines)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,679 @@
+"""
+Importer of road extracts (OpenStreetMap XML or PBF, GeoJSON) into the map formats of VertexPool and tiles.py.
+
+Input is read incrementally and everything the import needs is kept in a temporary sqlite database, so memory does
+not depend on the size of the extract, except for 8 bytes per output vertex to find the largest connected part
+of the network. Steps:
+
+    1. nodes and drivable ways (see DRIVABLE_HIGHWAYS) are stored in the database
+    2. junctions are found: nodes shared by ways and ends of ways
+    3. chains of nodes between junctions are simplified (Douglas-Peucker with the given tolerance in metres), so
+       degree-2 nodes are dropped where the road is straight enough, every remaining pair of nodes is a street
+    4. only the largest connected part is kept, vehicles can't get stuck in fragments cut by the extract border
+    5. coordinates are projected to metres from the minimal latitude and longitude with VertexPool.RAD, vertices
+       are numbered tile by tile and written to JSON or to a tile file
+
+Streets are two-way: one-way tags are ignored, as vehicles of the emulator can't turn back on their own.
+GeoJSON features are LineString or MultiLineString, lines which share a coordinate are connected there. Features
+with `highway` property are filtered as OSM ways, features without it are all imported. Line-delimited GeoJSON
+(.geojsonl, .geojsons, .ndjson) has a feature per line.
+
+Usage:
+    python3 osm_import.py city.osm.pbf map.json
+    python3 osm_import.py country.osm.bz2 country.tiles --tolerance 5 --work-dir /var/tmp
+    python3 osm_import.py roads.geojson map.json --highways motorway,trunk,primary,secondary
+"""
+import argparse
+from array import array
+import bz2
+import codecs
+import gzip
+from itertools import groupby
+import json
+import logging
+import lzma
+import math
+import os
+import sqlite3
+import struct
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ElementTree
+import zlib
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telemetry_emulator.emulator import VertexPool
+from telemetry_emulator.mapgen import write_map
+from telemetry_emulator.tiles import TileFileWriter, DEFAULT_TILE_SIZE
+
+logger = logging.getLogger(__name__)
+
+DRIVABLE_HIGHWAYS = frozenset((
+    'motorway', 'motorway_link', 'trunk', 'trunk_link', 'primary', 'primary_link', 'secondary', 'secondary_link',
+    'tertiary', 'tertiary_link', 'unclassified', 'residential', 'living_street', 'road',
+))
+DEFAULT_TOLERANCE = 10  # meters
+BATCH_SIZE = 10000
+# page cache of the database, negative value is kilobytes
+SQLITE_CACHE_SIZE = -64 * 1024
+
+
+class MapImportError(Exception):
+    pass
+
+
+class OsmFormatError(MapImportError):
+    pass
+
+
+# ---- readers: every one yields ('node', id, lat, lon) and ('way', id, node ids, tags) ----
+
+def open_input(path):
+    """Binary file object, .gz and .bz2 files are decompressed on the fly"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def read_osm_xml(file):
+    root = None
+    depth = 0
+    for event, element in ElementTree.iterparse(file, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = element
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
+            # nd, tag and member elements are read with their parent
+            continue
+        tag = element.tag
+        if tag == 'node':
+            yield 'node', int(element.get('id')), float(element.get('lat')), float(element.get('lon'))
+        elif tag == 'way':
+            refs = [int(nd.get('ref')) for nd in element.iter('nd')]
+            tags = {child.get('k'): child.get('v') for child in element.iter('tag')}
+            yield 'way', int(element.get('id')), refs, tags
+        # every child of the root, relations and bounds too, is dropped once it is read, so the tree does not grow
+        element.clear()
+        root.clear()
+
+
+def _varint(data, position):
+    result = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, position
+        shift += 7
+
+
+def _fields(data):
+    """Yields (field number, value) of protobuf message, value of length-delimited field is memoryview"""
+    position, end = 0, len(data)
+    while position < end:
+        key, position = _varint(data, position)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, position = _varint(data, position)
+        elif wire_type == 2:
+            length, position = _varint(data, position)
+            value = data[position:position + length]
+            position += length
+        elif wire_type == 1:
+            value = data[position:position + 8]
+            position += 8
+        elif wire_type == 5:
+            value = data[position:position + 4]
+            position += 4
+        else:
+            raise OsmFormatError("Unsupported protobuf wire type {}".format(wire_type))
+        yield number, value
+
+
+def _packed(data):
+    position, end = 0, len(data)
+    while position < end:
+        value, position = _varint(data, position)
+        yield value
+
+
+def _zigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def _delta_decoded(data):
+    value = 0
+    for delta in _packed(data):
+        value += _zigzag(delta)
+        yield value
+
+
+def _read_blob(file):
+    """Returns (type, data) of the next file block or None at the end of file"""
+    size_data = file.read(4)
+    if not size_data:
+        return None
+    if len(size_data) < 4:
+        raise OsmFormatError("Truncated PBF block header")
+    header = memoryview(file.read(struct.unpack('>I', size_data)[0]))
+    block_type, data_size = None, 0
+    for number, value in _fields(header):
+        if number == 1:
+            block_type = bytes(value).decode('utf-8')
+        elif number == 3:
+            data_size = value
+    blob = memoryview(file.read(data_size))
+    if len(blob) < data_size:
+        raise OsmFormatError("Truncated PBF blob")
+    for number, value in _fields(blob):
+        if number == 1:
+            return block_type, value
+        if number == 3:
+            return block_type, memoryview(zlib.decompress(value))
+        if number == 4:
+            return block_type, memoryview(lzma.decompress(value))
+        if number in (5, 6, 7):
+            raise OsmFormatError("Unsupported PBF compression (field {})".format(number))
+    return block_type, memoryview(b'')
+
+
+def read_osm_pbf(file):
+    while True:
+        blob = _read_blob(file)
+        if blob is None:
+            return
+        block_type, data = blob
+        if block_type == 'OSMData':
+            yield from _read_primitive_block(data)
+        elif block_type != 'OSMHeader':
+            logger.warning("Unknown PBF block {} is skipped".format(block_type))
+
+
+def _read_primitive_block(data):
+    strings = []
+    groups = []
+    granularity, lat_offset, lon_offset = 100, 0, 0
+    for number, value in _fields(data):
+        if number == 1:
+            strings = [bytes(s).decode('utf-8') for field, s in _fields(value) if field == 1]
+        elif number == 2:
+            groups.append(value)
+        elif number == 17:
+            granularity = value
+        elif number == 19:
+            lat_offset = _signed(value)
+        elif number == 20:
+            lon_offset = _signed(value)
+
+    def coordinate(value, offset):
+        # nanodegrees are exact integers, division rounds them as the decimal degrees of OSM XML
+        return (offset + granularity * value) / 1e9
+
+    for group in groups:
+        for number, value in _fields(group):
+            if number == 1:
+                yield _read_node(value, coordinate, lat_offset, lon_offset)
+            elif number == 2:
+                yield from _read_dense_nodes(value, coordinate, lat_offset, lon_offset)
+            elif number == 3:
+                yield _read_way(value, strings)
+
+
+def _signed(value):
+    """int64 field which is encoded as unsigned varint"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _read_node(data, coordinate, lat_offset, lon_offset):
+    node_id = lat = lon = 0
+    for number, value in _fields(data):
+        if number == 1:
+            node_id = _zigzag(value)
+        elif number == 8:
+            lat = _zigzag(value)
+        elif number == 9:
+            lon = _zigzag(value)
+    return 'node', node_id, coordinate(lat, lat_offset), coordinate(lon, lon_offset)
+
+
+def _read_dense_nodes(data, coordinate, lat_offset, lon_offset):
+    ids = lats = lons = ()
+    for number, value in _fields(data):
+        if number == 1:
+            ids = value
+        elif number == 8:
+            lats = value
+        elif number == 9:
+            lons = value
+    for node_id, lat, lon in zip(_delta_decoded(ids), _delta_decoded(lats), _delta_decoded(lons)):
+        yield 'node', node_id, coordinate(lat, lat_offset), coordinate(lon, lon_offset)
+
+
+def _read_way(data, strings):
+    way_id = 0
+    keys = values = refs = ()
+    for number, value in _fields(data):
+        if number == 1:
+            way_id = _signed(value)
+        elif number == 2:
+            keys = list(_packed(value))
+        elif number == 3:
+            values = list(_packed(value))
+        elif number == 8:
+            refs = list(_delta_decoded(value))
+    return 'way', way_id, refs, {strings[key]: strings[value] for key, value in zip(keys, values)}
+
+
+def _coordinate_id(lon, lat):
+    """Node id of GeoJSON coordinate: lines which share a coordinate (to 1e-7 degree) share the node"""
+    return (round(lat * 1e7) + 900000000) * 3600000001 + round(lon * 1e7) + 1800000000
+
+
+def _geojson_ways(feature, way_ids):
+    geometry = feature.get('geometry') or {}
+    properties = feature.get('properties') or {}
+    if geometry.get('type') == 'LineString':
+        lines = [geometry.get('coordinates') or []]
+    elif geometry.get('type') == 'MultiLineString':
+        lines = geometry.get('coordinates') or []
+    else:
+        return
+    # None means a road layer without OSM tags, all of its lines are imported
+    tags = {key: str(value) for key, value in properties.items() if isinstance(value, (str, int, float))} \
+        if 'highway' in properties else None
+    for line in lines:
+        refs = []
+        for position in line:
+            lon, lat = position[0], position[1]
+            node_id = _coordinate_id(lon, lat)
+            yield 'node', node_id, lat, lon
+            refs.append(node_id)
+        yield 'way', next(way_ids), refs, tags
+
+
+def _iter_features(file, chunk_size=1 << 20):
+    """Features of GeoJSON FeatureCollection which is read by chunks"""
+    decoder = json.JSONDecoder()
+    # incremental decoder, a character can be split between chunks
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    reader = (utf8.decode(chunk) for chunk in iter(lambda: file.read(chunk_size), b''))
+    buffer = ''
+    position = -1
+    # the features array, the rest of the document is not needed
+    for chunk in reader:
+        buffer += chunk
+        key = buffer.find('"features"')
+        if key >= 0:
+            position = buffer.find('[', key)
+            if position >= 0:
+                break
+        elif len(buffer) > chunk_size:
+            buffer = buffer[-16:]
+    if position < 0:
+        raise MapImportError("GeoJSON has no features")
+    buffer = buffer[position + 1:]
+    position = 0
+    while True:
+        while True:
+            # separators before the next feature
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer):
+                break
+            buffer, position = next(reader, None), 0
+            if buffer is None:
+                raise MapImportError("GeoJSON features are not closed")
+        if buffer[position] == ']':
+            return
+        while True:
+            try:
+                feature, position = decoder.raw_decode(buffer, position)
+                break
+            except ValueError:
+                chunk = next(reader, None)
+                if chunk is None:
+                    raise MapImportError("GeoJSON is truncated")
+                buffer = buffer[position:] + chunk
+                position = 0
+        yield feature
+        if position > chunk_size:
+            buffer, position = buffer[position:], 0
+
+
+def read_geojson(file, line_delimited=False):
+    way_ids = iter(range(1, 1 << 62))
+    if line_delimited:
+        features = (json.loads(line.strip(b' \t\r\n\x1e')) for line in file if line.strip(b' \t\r\n\x1e'))
+    else:
+        features = _iter_features(file)
+    for feature in features:
+        yield from _geojson_ways(feature, way_ids)
+
+
+def input_reader(path, input_format=None):
+    """Returns function(file) -> elements iterator for the format of the input file"""
+    if input_format is None:
+        name = path[:-3] if path.endswith('.gz') else path[:-4] if path.endswith('.bz2') else path
+        extension = name.rsplit('.', 1)[-1].lower()
+        input_format = {
+            'osm': 'xml', 'xml': 'xml', 'pbf': 'pbf', 'geojson': 'geojson', 'json': 'geojson',
+            'geojsonl': 'geojsonl', 'geojsons': 'geojsonl', 'ndjson': 'geojsonl',
+        }.get(extension)
+        if input_format is None:
+            raise MapImportError("Format of {} is unknown, use --input-format".format(path))
+    return {
+        'xml': read_osm_xml,
+        'pbf': read_osm_pbf,
+        'geojson': read_geojson,
+        'geojsonl': lambda file: read_geojson(file, line_delimited=True),
+    }[input_format]
+
+
+# ---- import ----
+
+def is_drivable(tags, highways):
+    if tags is None:
+        return True
+    return tags.get('highway') in highways and tags.get('area') != 'yes' and tags.get('access') != 'no'
+
+
+def _point_line_distance(point, start, end):
+    (x, y), (x0, y0), (x1, y1) = point, start, end
+    dx, dy = x1 - x0, y1 - y0
+    length_squared = dx * dx + dy * dy
+    if length_squared == 0:
+        return math.hypot(x - x0, y - y0)
+    t = max(0.0, min(1.0, ((x - x0) * dx + (y - y0) * dy) / length_squared))
+    return math.hypot(x - x0 - t * dx, y - y0 - t * dy)
+
+
+def simplify(points, tolerance):
+    """Indexes of points kept by Douglas-Peucker simplification, the first and the last are always kept"""
+    keep = {0, len(points) - 1}
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        distance, index = max((_point_line_distance(points[i], points[first], points[last]), i)
+                              for i in range(first + 1, last))
+        if distance > tolerance:
+            keep.add(index)
+            stack.append((first, index))
+            stack.append((index, last))
+    return sorted(keep)
+
+
+class RoadNetworkImporter:
+    def __init__(self, database_path, highways=DRIVABLE_HIGHWAYS, tolerance=DEFAULT_TOLERANCE,
+                 tile_size=DEFAULT_TILE_SIZE):
+        self.highways = highways
+        self.tolerance = tolerance
+        self.tile_size = tile_size
+        self.db = sqlite3.connect(database_path)
+        for pragma in ('journal_mode = OFF', 'synchronous = OFF', 'temp_store = FILE',
+                       'cache_size = {}'.format(SQLITE_CACHE_SIZE)):
+            self.db.execute('PRAGMA ' + pragma)
+        self.db.executescript('''
+            CREATE TABLE nodes (id INTEGER PRIMARY KEY, lat REAL, lon REAL);
+            CREATE TABLE way_nodes (way INTEGER, seq INTEGER, node INTEGER, PRIMARY KEY (way, seq)) WITHOUT ROWID;
+            CREATE TABLE ways (id INTEGER PRIMARY KEY, last_seq INTEGER);
+        ''')
+        self.min_lat = self.min_lon = None
+        self.stats = {}
+
+    def load(self, elements):
+        """Stores nodes and drivable ways of the input elements"""
+        nodes, way_nodes, ways = [], [], []
+        node_count = way_count = 0
+        for element in elements:
+            if element[0] == 'node':
+                nodes.append(element[1:])
+                if len(nodes) >= BATCH_SIZE:
+                    node_count += self._flush(nodes, way_nodes, ways)
+            else:
+                _, way_id, refs, tags = element
+                if len(refs) < 2 or not is_drivable(tags, self.highways):
+                    continue
+                way_nodes.extend((way_id, seq, node) for seq, node in enumerate(refs))
+                ways.append((way_id, len(refs) - 1))
+                way_count += 1
+                if len(way_nodes) >= BATCH_SIZE:
+                    node_count += self._flush(nodes, way_nodes, ways)
+        node_count += self._flush(nodes, way_nodes, ways)
+        self.db.commit()
+        self.stats.update(input_nodes=node_count, ways=way_count)
+
+    def _flush(self, nodes, way_nodes, ways):
+        count = len(nodes)
+        # the same coordinate of GeoJSON lines is the same node
+        self.db.executemany('INSERT OR IGNORE INTO nodes VALUES (?, ?, ?)', nodes)
+        self.db.executemany('INSERT OR IGNORE INTO way_nodes VALUES (?, ?, ?)', way_nodes)
+        self.db.executemany('INSERT OR REPLACE INTO ways VALUES (?, ?)', ways)
+        del nodes[:], way_nodes[:], ways[:]
+        return count
+
+    def build(self):
+        self._find_junctions()
+        self._simplify_chains()
+        self._keep_largest_component()
+        self._number_vertices()
+
+    def _find_junctions(self):
+        self.db.executescript('''
+            CREATE TABLE junctions (node INTEGER PRIMARY KEY);
+            INSERT INTO junctions SELECT node FROM way_nodes GROUP BY node HAVING COUNT(*) > 1;
+            INSERT OR IGNORE INTO junctions
+                SELECT way_nodes.node FROM way_nodes JOIN ways ON ways.id = way_nodes.way
+                WHERE way_nodes.seq = 0 OR way_nodes.seq = ways.last_seq;
+            CREATE TABLE kept (node INTEGER PRIMARY KEY);
+            CREATE TABLE edges (a INTEGER, b INTEGER, PRIMARY KEY (a, b)) WITHOUT ROWID;
+        ''')
+
+    def _simplify_chains(self):
+        """Splits ways to chains between junctions, keeps nodes of simplified chains and streets between them"""
+        rows = self.db.execute('''
+            SELECT way_nodes.way, way_nodes.node, nodes.lat, nodes.lon, junctions.node IS NOT NULL
+            FROM way_nodes
+            LEFT JOIN nodes ON nodes.id = way_nodes.node
+            LEFT JOIN junctions ON junctions.node = way_nodes.node
+            ORDER BY way_nodes.way, way_nodes.seq
+        ''')
+        kept, edges = [], []
+        writer = self.db.cursor()
+
+        def finish(chain):
+            if len(chain) < 2:
+                return
+            # any projection with the same scale is fine for distances
+            points = [(lon / VertexPool.RAD, lat / VertexPool.RAD) for _, lat, lon in chain]
+            indexes = simplify(points, self.tolerance)
+            nodes = [chain[i][0] for i in indexes]
+            for a, b in zip(nodes, nodes[1:]):
+                if a != b:
+                    edges.append((a, b))
+                    edges.append((b, a))
+                    kept.append((a,))
+                    kept.append((b,))
+            if len(edges) >= BATCH_SIZE:
+                flush()
+
+        def flush():
+            writer.executemany('INSERT OR IGNORE INTO kept VALUES (?)', kept)
+            writer.executemany('INSERT OR IGNORE INTO edges VALUES (?, ?)', edges)
+            del kept[:], edges[:]
+
+        for way, way_rows in groupby(rows, key=lambda row: row[0]):
+            chain = []
+            for _, node, lat, lon, is_junction in way_rows:
+                if lat is None:
+                    # the node is outside of the extract, the way is cut here
+                    finish(chain)
+                    chain = []
+                    continue
+                chain.append((node, lat, lon))
+                if is_junction and len(chain) > 1:
+                    finish(chain)
+                    chain = [chain[-1]]
+            finish(chain)
+        flush()
+        self.db.commit()
+
+    def _keep_largest_component(self):
+        self.db.executescript('''
+            CREATE TABLE dense (idx INTEGER PRIMARY KEY, node INTEGER UNIQUE);
+            INSERT INTO dense (node) SELECT node FROM kept ORDER BY node;
+        ''')
+        count = self.db.execute('SELECT COUNT(*) FROM dense').fetchone()[0]
+        if not count:
+            raise MapImportError("No drivable roads in the input")
+        # union-find over dense indexes, they start from 1
+        parents = array('i', range(count + 1))
+
+        def find(index):
+            root = index
+            while parents[root] != root:
+                root = parents[root]
+            while parents[index] != root:
+                parents[index], index = root, parents[index]
+            return root
+
+        for a, b in self.db.execute('''
+            SELECT da.idx, db.idx FROM edges
+            JOIN dense AS da ON da.node = edges.a JOIN dense AS db ON db.node = edges.b
+            WHERE edges.a < edges.b
+        '''):
+            root_a, root_b = find(a), find(b)
+            if root_a != root_b:
+                parents[max(root_a, root_b)] = min(root_a, root_b)
+
+        sizes = array('i', bytes(4 * (count + 1)))
+        for index in range(1, count + 1):
+            sizes[find(index)] += 1
+        largest = max(range(1, count + 1), key=sizes.__getitem__)
+        self.stats.update(components=sum(1 for index in range(1, count + 1) if parents[index] == index),
+                          dropped_vertices=count - sizes[largest])
+
+        self.db.execute('CREATE TABLE component (node INTEGER PRIMARY KEY)')
+        batch = []
+        for index, node in self.db.execute('SELECT idx, node FROM dense ORDER BY idx'):
+            if parents[index] == largest:
+                batch.append((node,))
+                if len(batch) >= BATCH_SIZE:
+                    self.db.executemany('INSERT INTO component VALUES (?)', batch)
+                    del batch[:]
+        self.db.executemany('INSERT INTO component VALUES (?)', batch)
+        self.db.commit()
+
+    def _number_vertices(self):
+        """Projects vertices and numbers them tile by tile, as tiles.build_tiles() does"""
+        self.min_lat, self.min_lon = self.db.execute(
+            'SELECT MIN(lat), MIN(lon) FROM component JOIN nodes ON nodes.id = component.node').fetchone()
+        self.db.executescript('''
+            CREATE TABLE vertices (id INTEGER PRIMARY KEY, node INTEGER UNIQUE, x REAL, y REAL, tx INTEGER,
+                                   ty INTEGER);
+            CREATE TABLE streets (a INTEGER, b INTEGER, PRIMARY KEY (a, b)) WITHOUT ROWID;
+        ''')
+        # coordinates are not negative, so truncation is floor
+        self.db.execute('''
+            INSERT INTO vertices (node, x, y, tx, ty)
+            SELECT node, x, y, CAST(x / :tile AS INTEGER), CAST(y / :tile AS INTEGER) FROM (
+                SELECT component.node AS node, (lon - :min_lon) / :rad AS x, (lat - :min_lat) / :rad AS y
+                FROM component JOIN nodes ON nodes.id = component.node
+            ) ORDER BY 5, 4, node
+        ''', {"tile": self.tile_size, "min_lat": self.min_lat, "min_lon": self.min_lon, "rad": VertexPool.RAD})
+        self.db.execute('''
+            INSERT INTO streets
+            SELECT va.id - 1, vb.id - 1 FROM edges
+            JOIN vertices AS va ON va.node = edges.a JOIN vertices AS vb ON vb.node = edges.b
+        ''')
+        self.db.commit()
+        self.stats["vertices"] = self.db.execute('SELECT COUNT(*) FROM vertices').fetchone()[0]
+        self.stats["streets"] = self.db.execute('SELECT COUNT(*) FROM streets').fetchone()[0] // 2
+
+    def vertices(self):
+        """Yields (tx, ty, id, x, y, neighbour ids) in order of ids"""
+        streets = self.db.cursor().execute('SELECT a, b FROM streets ORDER BY a, b')
+        street = streets.fetchone()
+        rows = self.db.cursor().execute('SELECT id - 1, x, y, tx, ty FROM vertices ORDER BY id')
+        for vertex_id, x, y, tx, ty in rows:
+            neighbours = []
+            while street is not None and street[0] == vertex_id:
+                neighbours.append(street[1])
+                street = streets.fetchone()
+            yield tx, ty, vertex_id, x, y, neighbours
+
+    def write_json(self, path):
+        with open(path, 'w', buffering=1024 * 1024) as file:
+            write_map(((vertex_id, x, y, neighbours) for _, _, vertex_id, x, y, neighbours in self.vertices()),
+                      file, self.min_lat, self.min_lon)
+
+    def write_tiles(self, path):
+        with TileFileWriter(path, self.min_lat, self.min_lon, self.tile_size) as writer:
+            for (tx, ty), tile_vertices in groupby(self.vertices(), key=lambda vertex: vertex[:2]):
+                writer.add_tile(tx, ty, ((x, y, neighbours) for _, _, _, x, y, neighbours in tile_vertices))
+
+    def close(self):
+        self.db.close()
+
+
+def import_roads(source, target, input_format=None, output_format=None, highways=DRIVABLE_HIGHWAYS,
+                 tolerance=DEFAULT_TOLERANCE, tile_size=DEFAULT_TILE_SIZE, work_dir=None):
+    """Imports road network of source extract to target map. Returns import statistics"""
+    reader = input_reader(source, input_format)
+    if output_format is None:
+        output_format = 'tiles' if target.endswith('.tiles') else 'json'
+    with tempfile.TemporaryDirectory(prefix='osm-import-', dir=work_dir) as directory:
+        importer = RoadNetworkImporter(os.path.join(directory, 'import.sqlite'), highways, tolerance, tile_size)
+        try:
+            started = time.perf_counter()
+            with open_input(source) as file:
+                importer.load(reader(file))
+            logger.info("Input is loaded in {:.1f}s".format(time.perf_counter() - started))
+            importer.build()
+            if output_format == 'tiles':
+                importer.write_tiles(target)
+            else:
+                importer.write_json(target)
+            importer.stats["seconds"] = round(time.perf_counter() - started, 1)
+            return importer.stats
+        finally:
+            importer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import OSM or GeoJSON road extract into emulator map")
+    parser.add_argument('source', help=".osm, .osm.pbf, .geojson or .geojsonl file, .osm can be .gz or .bz2")
+    parser.add_argument('target', help="map.json or tile file (.tiles)")
+    parser.add_argument('--input-format', choices=('xml', 'pbf', 'geojson', 'geojsonl'),
+                        help="format of the source, by default it is chosen by extension")
+    parser.add_argument('--output-format', choices=('json', 'tiles'),
+                        help="format of the target, tiles for .tiles files and json otherwise by default")
+    parser.add_argument('--highways', default=','.join(sorted(DRIVABLE_HIGHWAYS)),
+                        help="comma separated highway tags of imported ways")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="meters a simplified road can deviate from the original one, 0 keeps every node")
+    parser.add_argument('--tile-size', type=float, default=DEFAULT_TILE_SIZE, help="tile size in meters")
+    parser.add_argument('--work-dir', help="directory of the temporary database, it needs space for the input")
+    args = parser.parse_args()
+
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+    try:
+        stats = import_roads(args.source, args.target, args.input_format, args.output_format,
+                             frozenset(args.highways.split(',')), args.tolerance, args.tile_size, args.work_dir)
+    except (MapImportError, OSError, ValueError) as ex:
+        parser.exit(1, "Import failed: {}\n".format(ex))
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == '__main__':
+    main()
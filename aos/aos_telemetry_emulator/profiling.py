@@ -0,0 +1,223 @@
+"""
+Opt-in instrumentation of the simulation hot path.
+
+UpdateProfiler times phases of Emulator.update() into histograms. It wraps methods of the emulator instances it
+is attached to, so there is no overhead at all while it is disabled.
+
+ProfileCapture runs cProfile in the simulation loop thread for a requested number of seconds, request handlers
+only start it and fetch the report later.
+"""
+from bisect import bisect_left
+import cProfile
+import io
+import pstats
+import threading
+import time
+
+
+class Histogram:
+    """Histogram with fixed buckets, observe() may be called from several threads"""
+    # seconds
+    DEFAULT_BUCKETS = (
+        0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+        0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+    )
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+            self.count = 0
+            self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        """Consistent (counts, sum, count)"""
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q):
+        """Returns upper bound of the bucket where q-quantile is, None for empty histogram"""
+        counts, _, count = self.snapshot()
+        return self._quantile(counts, count, q)
+
+    def _quantile(self, counts, count, q):
+        if not count:
+            return None
+        rank = q * count
+        accumulated = 0
+        for i, bucket_count in enumerate(counts):
+            accumulated += bucket_count
+            if accumulated >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def to_dict(self):
+        counts, total, count = self.snapshot()
+        return {
+            "count": count,
+            "sum": total,
+            "mean": total / count if count else None,
+            "p50": self._quantile(counts, count, 0.5),
+            "p99": self._quantile(counts, count, 0.99),
+            "buckets": [[bound, n] for bound, n in zip(self.buckets + ('+Inf',), counts)],
+        }
+
+
+class UpdateProfiler:
+    """
+    Times phases of Emulator.update() and get_data().
+    Phase time is inclusive: planning done while moving is counted both in 'movement' and 'planning'.
+    Nested calls of the same phase are counted once.
+    """
+    PHASES = {
+        'update': ('update',),
+        'braking': ('_want_to_break', '_break_value'),
+        'planning': ('_add_point_to_plan',),
+        'planning.rectangle': ('_create_rectangle_movement_plan',),
+        'movement': ('_turn_and_move', '_change_line', '_move'),
+        'get_data': ('get_data',),
+        'serialization': (),  # is observed by REST handler
+    }
+
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {phase: Histogram() for phase in self.PHASES}
+        self._active = set()
+        self._emulators = []
+
+    def attach(self, emulator):
+        self._emulators.append(emulator)
+        if self.enabled:
+            self._instrument(emulator)
+
+    def enable(self):
+        if not self.enabled:
+            self.enabled = True
+            for emulator in self._emulators:
+                self._instrument(emulator)
+
+    def disable(self):
+        if self.enabled:
+            self.enabled = False
+            for emulator in self._emulators:
+                for method_names in self.PHASES.values():
+                    for method_name in method_names:
+                        emulator.__dict__.pop(method_name, None)
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+    def observe(self, phase, value):
+        self.histograms[phase].observe(value)
+
+    def to_dict(self):
+        return {
+            "enabled": self.enabled,
+            "phases": {phase: histogram.to_dict() for phase, histogram in self.histograms.items()},
+        }
+
+    def _instrument(self, emulator):
+        for phase, method_names in self.PHASES.items():
+            for method_name in method_names:
+                # instance attribute shadows the class method until disable() removes it
+                setattr(emulator, method_name, self._timed(phase, getattr(type(emulator), method_name), emulator))
+
+    def _timed(self, phase, function, emulator):
+        histogram = self.histograms[phase]
+        active = self._active
+        perf_counter = time.perf_counter
+
+        def timed(*args, **kwargs):
+            if phase in active:
+                return function(emulator, *args, **kwargs)
+            active.add(phase)
+            start = perf_counter()
+            try:
+                return function(emulator, *args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - start)
+                active.discard(phase)
+
+        return timed
+
+
+class _ProfileRequest:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.requested_at = time.monotonic()
+        self.profile = None
+        self.started_at = None
+
+
+class ProfileCapture:
+    """
+    Runs cProfile in the simulation loop thread. start() is called from a request handler and returns at once,
+    tick() calls of the loop collect the profile of the requested duration and result() formats the last one.
+    """
+    MAX_SECONDS = 60
+    # the loop must start collecting within this time after start(), otherwise the capture fails
+    START_TIMEOUT = 10
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._request = None
+        self._finished = None
+
+    def start(self, seconds):
+        if not 0 < seconds <= self.MAX_SECONDS:
+            raise ValueError("seconds must be in (0, {}]".format(self.MAX_SECONDS))
+        with self._lock:
+            if self._request is not None:
+                raise RuntimeError("Profiling is already in progress")
+            self._request = _ProfileRequest(seconds)
+            self._finished = None
+
+    def result(self, sort='cumulative', limit=50):
+        """
+        Returns report of the last capture or None while it is being collected.
+        Raises LookupError if nothing was captured, TimeoutError if the loop did not start collecting.
+        """
+        if sort not in pstats.Stats.sort_arg_dict_default:
+            raise ValueError("unknown sort key {}".format(sort))
+        with self._lock:
+            request = self._request
+            if request is not None:
+                if request.profile is None and time.monotonic() - request.requested_at > self.START_TIMEOUT:
+                    self._request = None
+                    raise TimeoutError("Simulation loop did not collect profile")
+                return None
+            request = self._finished
+        if request is None:
+            raise LookupError("No profile was captured")
+        stream = io.StringIO()
+        pstats.Stats(request.profile, stream=stream).sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def tick(self):
+        """Must be called by the simulation loop thread every tick. Cheap when there is no request"""
+        if self._request is None:
+            return
+        with self._lock:
+            request = self._request
+            if request is None:
+                return
+            if request.profile is None:
+                request.profile = cProfile.Profile()
+                request.started_at = time.monotonic()
+                request.profile.enable()
+            elif time.monotonic() - request.started_at >= request.seconds:
+                request.profile.disable()
+                self._request = None
+                self._finished = request
@@ -0,0 +1,192 @@
+"""
+Scenario scripts: timelines of emulator commands executed by the simulation loop.
+
+Scenario is a JSON document (or a plain list of events):
+    {"events": [
+        {"at": 30, "vehicle": "NoVIN", "command": "tire_break"},
+        {"tick": 100, "command": "madness", "args": [0.3]},
+        {"at": 60, "vehicles": ["NoVIN-0001", "NoVIN-0002"], "command": "rectangle",
+         "args": [30.49, 50.39, 30.51, 50.45]}
+    ]}
+
+`at` is simulated seconds and `tick` is fleet ticks since the scenario was loaded. Event without `vehicle` or
+`vehicles` is applied to every vehicle of the fleet. Events due at the same tick run in the order of their times
+(events by ticks are due at the time of their tick), then in the order of the file, before vehicles are updated.
+"""
+import heapq
+import inspect
+import itertools
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def _madness(emulator, value):
+    value = float(value)
+    if value == 0:
+        emulator.change_madness_periodically = True
+    elif 0 < value <= 1:
+        emulator.change_madness_periodically = False
+        emulator.madness = value
+    else:
+        raise ValueError('Madness must be between 0 and 1')
+
+
+COMMANDS = {
+    'stop': lambda emulator: emulator.command_stop(),
+    'go': lambda emulator: emulator.command_go(),
+    'tire_break': lambda emulator: emulator.tire_break(),
+    'madness': _madness,
+    'rectangle': lambda emulator, long0, lat0, long1, lat1: emulator.set_rectangle(
+        float(long0), float(lat0), float(long1), float(lat1)),
+    'del_rectangle': lambda emulator: emulator.del_rectangle(),
+    'rectangle_in': lambda emulator: emulator.set_rectangle_direction(True),
+    'rectangle_out': lambda emulator: emulator.set_rectangle_direction(False),
+}
+
+
+class ScenarioEvent:
+    def __init__(self, command, args=(), kwargs=None, at=None, tick=None, vehicles=None):
+        self.command = command
+        self.args = tuple(args)
+        self.kwargs = kwargs or {}
+        self.at = at
+        self.tick = tick
+        # None means every vehicle of the fleet
+        self.vehicles = vehicles
+
+    def apply(self, fleet):
+        function = COMMANDS[self.command]
+        vins = self.vehicles if self.vehicles is not None else list(fleet)
+        for vin in vins:
+            if vin in fleet:
+                function(fleet[vin], *self.args, **self.kwargs)
+
+    def to_dict(self):
+        result = {"command": self.command}
+        if self.at is not None:
+            result["at"] = self.at
+        else:
+            result["tick"] = self.tick
+        if self.args:
+            result["args"] = list(self.args)
+        elif self.kwargs:
+            result["args"] = dict(self.kwargs)
+        if self.vehicles is not None:
+            result["vehicles"] = list(self.vehicles)
+        return result
+
+
+def event_from_dict(data):
+    if not isinstance(data, dict):
+        raise ValueError("Event must be an object")
+    command = data.get("command")
+    if command not in COMMANDS:
+        raise ValueError("Unknown command {}".format(command))
+
+    at, tick = data.get("at"), data.get("tick")
+    if (at is None) == (tick is None):
+        raise ValueError("Event must have either 'at' or 'tick'")
+    if at is not None:
+        at = float(at)
+        if at < 0:
+            raise ValueError("'at' must not be negative")
+    else:
+        tick = int(tick)
+        if tick < 0:
+            raise ValueError("'tick' must not be negative")
+
+    args = data.get("args", [])
+    if isinstance(args, dict):
+        args, kwargs = (), args
+    elif isinstance(args, list):
+        kwargs = {}
+    else:
+        args, kwargs = (args,), {}
+    try:
+        inspect.signature(COMMANDS[command]).bind(None, *args, **kwargs)
+    except TypeError as ex:
+        raise ValueError("Invalid args of {}: {}".format(command, ex))
+
+    if "vehicle" in data:
+        vehicles = [str(data["vehicle"])]
+    elif "vehicles" in data:
+        vehicles = [str(vin) for vin in data["vehicles"]]
+    else:
+        vehicles = None
+    return ScenarioEvent(command, args, kwargs, at=at, tick=tick, vehicles=vehicles)
+
+
+def parse_scenario(data):
+    """Parses scenario document. Raises ValueError describing the first invalid event"""
+    events = data.get("events") if isinstance(data, dict) else data
+    if not isinstance(events, list):
+        raise ValueError("Scenario must be a list of events or an object with 'events' list")
+    result = []
+    for i, event in enumerate(events):
+        try:
+            result.append(event_from_dict(event))
+        except (ValueError, TypeError) as ex:
+            raise ValueError("Event {}: {}".format(i, ex))
+    return result
+
+
+def load_scenario(path):
+    with open(path, 'r') as file:
+        return parse_scenario(json.load(file))
+
+
+class ScenarioRunner:
+    """
+    Heap-based timer of scenario events. Events are scheduled from any thread and executed by run_due()
+    in the simulation loop thread.
+    """
+    TIME_EPSILON = 1e-9
+
+    def __init__(self):
+        self._time_heap = []  # (fleet time, seq, event)
+        self._tick_heap = []  # (fleet tick, seq, event)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.failed = 0
+
+    def schedule(self, events, time, tick):
+        """Schedules events relative to the current fleet time and tick"""
+        with self._lock:
+            for event in events:
+                if event.at is not None:
+                    heapq.heappush(self._time_heap, (time + event.at, next(self._seq), event))
+                else:
+                    heapq.heappush(self._tick_heap, (tick + event.tick, next(self._seq), event))
+
+    def clear(self):
+        with self._lock:
+            self._time_heap = []
+            self._tick_heap = []
+
+    def run_due(self, fleet):
+        if not self._time_heap and not self._tick_heap:
+            return
+        with self._lock:
+            due = []
+            time_heap, tick_heap = self._time_heap, self._tick_heap
+            time_limit = fleet.time + self.TIME_EPSILON
+            while time_heap and time_heap[0][0] <= time_limit:
+                due.append(heapq.heappop(time_heap))
+            # events by ticks are due at the current time
+            while tick_heap and tick_heap[0][0] <= fleet.tick:
+                due.append((fleet.time,) + heapq.heappop(tick_heap)[1:])
+        due.sort(key=lambda item: item[:2])
+        for _, _, event in due:
+            try:
+                event.apply(fleet)
+                self.executed += 1
+            except Exception as ex:
+                self.failed += 1
+                logger.warning("Scenario command {} failed: {}".format(event.command, ex))
+
+    def __len__(self):
+        return len(self._time_heap) + len(self._tick_heap)
@@ -0,0 +1,250 @@
+"""
+Shared-memory telemetry channel for consumers running on the same VM.
+
+The emulator publishes every tick's telemetry into a fixed-layout file under /dev/shm. The file is mmap-ed by
+readers, so getting a snapshot is a couple of memory copies without any syscalls or HTTP/JSON parsing.
+
+File layout (little endian):
+
+    offset 0   header: magic, version, reserved, layout crc32, layout size
+    offset 16  sequence counter (uint64), odd while the writer is updating the payload
+    offset 24  layout: JSON list of [field name, struct format code], padded to 8 bytes
+    ...        payload: tick (uint64), timestamp (double), then one value per layout field
+
+A writer never resizes an existing file, as readers which mapped a larger file would get SIGBUS. It writes a new file,
+renames it over the old one and then changes the layout crc of the old file, so readers of it reopen the path.
+
+Consistency is guaranteed by a sequence lock: the writer makes the counter odd, writes the payload and makes the
+counter even again. A reader copies the payload between two reads of the counter and retries if the counter was odd
+or has changed, so it never returns a torn snapshot.
+"""
+from collections import namedtuple
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+MAGIC = b'TLMS'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sHHII')
+_SEQ = struct.Struct('<Q')
+_SEQ_OFFSET = 16
+_LAYOUT_OFFSET = 24
+_PAYLOAD_PREFIX = '<Qd'
+
+# Fields which can be None. Bool ones are stored as signed byte with -1 for None, float ones as NaN.
+NULLABLE_FIELDS = {
+    'in_rectangle': 'b',
+    'rectangle_long0': 'd',
+    'rectangle_lat0': 'd',
+    'rectangle_long1': 'd',
+    'rectangle_lat1': 'd',
+}
+
+Snapshot = namedtuple('Snapshot', ['tick', 'timestamp', 'telemetry'])
+
+
+class LayoutChanged(Exception):
+    pass
+
+
+def build_layout(telemetry: dict):
+    """Returns list of (name, format code) for all scalar fields of telemetry dict"""
+    layout = []
+    for name, value in telemetry.items():
+        if name in NULLABLE_FIELDS:
+            layout.append((name, NULLABLE_FIELDS[name]))
+        elif isinstance(value, bool):
+            layout.append((name, '?'))
+        elif isinstance(value, int):
+            layout.append((name, 'q'))
+        elif isinstance(value, float):
+            layout.append((name, 'd'))
+    return layout
+
+
+def _encode(code, value):
+    if value is None:
+        return -1 if code == 'b' else math.nan
+    return value
+
+
+def _decode(code, value):
+    if code == 'b':
+        return None if value < 0 else bool(value)
+    if code == 'd' and math.isnan(value):
+        return None
+    return value
+
+
+def _payload_struct(layout):
+    return struct.Struct(_PAYLOAD_PREFIX + ''.join(code for _, code in layout))
+
+
+def _open_existing(path):
+    try:
+        return os.open(path, os.O_RDWR)
+    except FileNotFoundError:
+        return None
+
+
+def _retire(fd):
+    """Changes the layout crc of the replaced channel file, readers which still map it reopen the path"""
+    header = os.pread(fd, _HEADER.size, 0)
+    if len(header) == _HEADER.size and header[:4] == MAGIC:
+        layout_crc = _HEADER.unpack(header)[3]
+        os.pwrite(fd, struct.pack('<I', layout_crc ^ 0xFFFFFFFF), 8)
+
+
+class TelemetryWriter:
+    """Single writer side of the channel. The file is created on the first publish()"""
+
+    def __init__(self, path):
+        self.path = path
+        self._mm = None
+        self._layout = None
+        self._payload = None
+        self._payload_offset = 0
+        self._seq = 0
+
+    def publish(self, tick, telemetry: dict, timestamp=None):
+        if self._mm is None:
+            self._create(telemetry)
+
+        values = [tick, timestamp if timestamp is not None else time.time()]
+        values.extend(_encode(code, telemetry.get(name)) for name, code in self._layout)
+
+        mm = self._mm
+        self._seq += 1
+        _SEQ.pack_into(mm, _SEQ_OFFSET, self._seq)
+        self._payload.pack_into(mm, self._payload_offset, *values)
+        self._seq += 1
+        _SEQ.pack_into(mm, _SEQ_OFFSET, self._seq)
+
+    def _create(self, telemetry):
+        self._layout = build_layout(telemetry)
+        self._payload = _payload_struct(self._layout)
+        layout_data = json.dumps(self._layout).encode('utf-8')
+        layout_data += b' ' * (-len(layout_data) % 8)
+        self._payload_offset = _LAYOUT_OFFSET + len(layout_data)
+        size = self._payload_offset + self._payload.size
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.telemetry-', dir=directory)
+        try:
+            try:
+                os.fchmod(fd, 0o644)
+                os.ftruncate(fd, size)
+                self._mm = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+            self._mm[_LAYOUT_OFFSET:self._payload_offset] = layout_data
+            _HEADER.pack_into(self._mm, 0, MAGIC, VERSION, 0, zlib.crc32(layout_data), len(layout_data))
+            self._seq = 0
+            _SEQ.pack_into(self._mm, _SEQ_OFFSET, self._seq)
+            old_fd = _open_existing(self.path)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        if old_fd is not None:
+            try:
+                _retire(old_fd)
+            finally:
+                os.close(old_fd)
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+
+class TelemetryReader:
+    """
+    Reader side of the channel.
+    read() returns consistent Snapshot or None if the writer has not published anything yet
+    """
+    MAX_SPINS_BEFORE_YIELD = 100
+
+    def __init__(self, path):
+        self.path = path
+        self._mm = None
+        self._open()
+
+    def _open(self):
+        with open(self.path, 'rb') as file:
+            self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _, self._layout_crc, layout_size = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a telemetry channel of version {}".format(self.path, VERSION))
+
+        self._layout = [tuple(field) for field in json.loads(self._mm[_LAYOUT_OFFSET:_LAYOUT_OFFSET + layout_size])]
+        self._payload = _payload_struct(self._layout)
+        self._payload_offset = _LAYOUT_OFFSET + layout_size
+        self._fields = [name for name, _ in self._layout]
+        self._nullable = [(name, code) for name, code in self._layout if name in NULLABLE_FIELDS]
+        if len(self._mm) < self._payload_offset + self._payload.size:
+            raise LayoutChanged()
+
+    @property
+    def fields(self):
+        return list(self._fields)
+
+    def read_raw(self):
+        """Returns consistent tuple of payload values (tick, timestamp, *fields) or None"""
+        mm = self._mm
+        spins = 0
+        while True:
+            seq = _SEQ.unpack_from(mm, _SEQ_OFFSET)[0]
+            if not seq & 1:
+                if _HEADER.unpack_from(mm, 0)[3] != self._layout_crc:
+                    raise LayoutChanged()
+                values = self._payload.unpack_from(mm, self._payload_offset)
+                if _SEQ.unpack_from(mm, _SEQ_OFFSET)[0] == seq:
+                    return values if values[0] or values[1] else None
+            spins += 1
+            if spins % self.MAX_SPINS_BEFORE_YIELD == 0:
+                time.sleep(0)
+
+    def read(self):
+        try:
+            values = self.read_raw()
+        except LayoutChanged:
+            self.close()
+            self._open()
+            values = self.read_raw()
+
+        if values is None:
+            return None
+        telemetry = dict(zip(self._fields, values[2:]))
+        for name, code in self._nullable:
+            telemetry[name] = _decode(code, telemetry[name])
+        return Snapshot(values[0], values[1], telemetry)
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else '/dev/shm/telemetry_emulator'
+    reader = TelemetryReader(path)
+    snapshot = reader.read()
+    if snapshot is None:
+        print("Nothing was published yet", file=sys.stderr)
+        return
+    print(json.dumps({"tick": snapshot.tick, "timestamp": snapshot.timestamp, "telemetry": snapshot.telemetry},
+                     indent=2))
+
+
+if __name__ == '__main__':
+    main()
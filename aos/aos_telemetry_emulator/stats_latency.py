@@ -0,0 +1,85 @@
+"""
+Compares /stats round trip latency over TCP loopback and over unix domain socket.
+
+Usage:
+    python3 stats_latency.py --tcp 127.0.0.1:8088 --unix /run/telemetry-emulator.sock -n 2000
+"""
+import argparse
+import http.client
+import socket
+import time
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=5):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(connection_factory, path, count, warmup=50):
+    latencies = []
+    for i in range(warmup + count):
+        start = time.perf_counter()
+        # control API server speaks HTTP/1.0 and closes connection after each response
+        connection = connection_factory()
+        connection.request('GET', path)
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        if response.status != 200:
+            raise RuntimeError("{} returned {}".format(path, response.status))
+        if i >= warmup:
+            latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies
+
+
+def print_report(name, latencies):
+    print("{:<6} n={:<6} min={:8.1f}us p50={:8.1f}us p99={:8.1f}us max={:8.1f}us mean={:8.1f}us".format(
+        name, len(latencies),
+        latencies[0] * 1e6, percentile(latencies, 0.5) * 1e6, percentile(latencies, 0.99) * 1e6,
+        latencies[-1] * 1e6, sum(latencies) / len(latencies) * 1e6
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare /stats latency for TCP and unix socket transports")
+    parser.add_argument('--tcp', help="host:port of TCP listener, e.g. 127.0.0.1:8088")
+    parser.add_argument('--unix', help="path to unix socket of control API")
+    parser.add_argument('--path', default='/stats', help="request path")
+    parser.add_argument('-n', '--count', type=int, default=1000, help="number of measured requests")
+    args = parser.parse_args()
+
+    if not args.tcp and not args.unix:
+        parser.error("at least one of --tcp and --unix is required")
+
+    results = {}
+    if args.tcp:
+        host, port = args.tcp.rsplit(':', 1)
+        results['tcp'] = measure(lambda: http.client.HTTPConnection(host, int(port), timeout=5), args.path, args.count)
+    if args.unix:
+        results['unix'] = measure(lambda: UnixHTTPConnection(args.unix), args.path, args.count)
+
+    for name, latencies in results.items():
+        print_report(name, latencies)
+
+    if len(results) == 2:
+        tcp_p50 = percentile(results['tcp'], 0.5)
+        unix_p50 = percentile(results['unix'], 0.5)
+        print("unix socket p50 is {:.1f}% of TCP p50".format(unix_p50 / tcp_p50 * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""
+The package is deployed as telemetry_emulator (see telemetry-emulator.service), modules import each other by this
+name, so the source directory is registered under it before tests import anything.
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if 'telemetry_emulator' not in sys.modules:
+    _spec = importlib.util.spec_from_file_location('telemetry_emulator', os.path.join(PACKAGE_DIR, '__init__.py'),
+                                                   submodule_search_locations=[PACKAGE_DIR])
+    _package = importlib.util.module_from_spec(_spec)
+    sys.modules['telemetry_emulator'] = _package
+    _spec.loader.exec_module(_package)
+
+GRID_SIDE = 20
+GRID_STEP = 150  # meters
+
+
+@pytest.fixture(scope='session')
+def map_path(tmp_path_factory):
+    from telemetry_emulator.mapgen import grid, write_map
+    path = tmp_path_factory.mktemp('map') / 'grid.json'
+    with open(str(path), 'w') as file:
+        write_map(grid(GRID_SIDE, GRID_SIDE, GRID_STEP), file)
+    return str(path)
+
+
+@pytest.fixture(scope='session')
+def vertex_pool(map_path):
+    from telemetry_emulator.emulator import VertexPool
+    return VertexPool(map_path)
@@ -0,0 +1,44 @@
+from collections import OrderedDict
+
+import pytest
+
+from telemetry_emulator.emulator import Emulator
+from telemetry_emulator.fleet import Fleet
+from telemetry_emulator.geofence import RectangleFence
+
+
+def tire_break_run(vertex_pool, adaptive, time_delta, ticks):
+    fleet = Fleet(OrderedDict(('V{}'.format(seed), Emulator(vertex_pool, seed=seed)) for seed in (0, 1, 3)),
+                  adaptive=adaptive)
+    for vin in fleet:
+        fleet[vin].tire_break()
+    result = []
+    for _ in range(ticks):
+        fleet.update(time_delta)
+        result.append({vin: emulator.get_data() for vin, emulator in fleet.vehicles.items()})
+    return result
+
+
+@pytest.mark.parametrize('time_delta', [1.0, 0.1])
+def test_tire_break_sequence_is_not_changed_by_adaptive_ticking(vertex_pool, time_delta):
+    # the sequence stops the vehicle, keeps it steady with hazard lights and drives on after the replacement
+    ticks = int(300 / time_delta)
+    reference = tire_break_run(vertex_pool, False, time_delta, ticks)
+    adaptive = tire_break_run(vertex_pool, True, time_delta, ticks)
+    assert not reference[-1]['V0']['hazard_status']
+    for tick, (expected, actual) in enumerate(zip(reference, adaptive)):
+        assert actual == expected, 'tick {}'.format(tick)
+
+
+def test_fence_added_around_deferred_vehicle(vertex_pool):
+    fleet = Fleet(OrderedDict(V0=Emulator(vertex_pool, seed=0)), adaptive=True)
+    fleet['V0'].command_stop()
+    for _ in range(60):
+        fleet.update(1.0)
+    assert fleet.deferred == 1
+    lon, lat = fleet['V0'].lon, fleet['V0'].lat
+    fleet.geofences.add_fence(RectangleFence('parking', lon - 0.001, lat - 0.001, lon + 0.001, lat + 0.001))
+    fleet.update(1.0)
+    assert fleet.deferred == 1
+    events = fleet.geofences.events_since(0)[0]
+    assert [(event["vin"], event["fence"], event["event"]) for event in events] == [('V0', 'parking', 'enter')]
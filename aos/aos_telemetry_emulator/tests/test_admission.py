@@ -0,0 +1,87 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import http.client
+import threading
+
+import pytest
+
+from telemetry_emulator.admission import CONTROL, LONG, READ, AdmissionControlMixIn, TokenBucket, request_lane
+
+
+@pytest.mark.parametrize('request_line, lane', [
+    (b'GET /stats HTTP/1.1', READ),
+    (b'GET /metrics HTTP/1.0', READ),
+    (b'GET /start HTTP/1.1', CONTROL),
+    (b'GET /start/ HTTP/1.1', CONTROL),
+    (b'POST /scenario HTTP/1.1', CONTROL),
+    (b'GET /rectangle?long0=1&lat0=2 HTTP/1.1', CONTROL),
+    (b'GET /vehicles/V0/attributes HTTP/1.1', READ),
+    (b'GET /geofences/events?wait=30 HTTP/1.1', LONG),
+    (b'GET /debug/profile/result HTTP/1.1', LONG),
+    # prefixes match whole path segments only
+    (b'GET /startup HTTP/1.1', READ),
+    (b'GET /debugger HTTP/1.1', READ),
+    (b'', READ),
+    (b'GARBAGE', READ),
+])
+def test_request_lane(request_line, lane):
+    assert request_lane(request_line) == lane
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=2, burst=3, now=0.0)
+    assert [bucket.take(0.0) for _ in range(3)] == [0, 0, 0]
+    assert bucket.take(0.0) == pytest.approx(0.5)
+    # a token per half a second
+    assert bucket.take(0.5) == 0
+    assert bucket.take(0.5) == pytest.approx(0.5)
+    # refill is capped by the burst
+    assert [bucket.take(100.0) for _ in range(3)] == [0, 0, 0]
+    assert bucket.take(100.0) > 0
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Server(AdmissionControlMixIn, HTTPServer):
+    workers = 2
+    long_workers = 1
+    rate_limit = 1
+    rate_burst = 2
+
+
+@pytest.fixture
+def server():
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def get(server, path):
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=5)
+    try:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        response.read()
+        return response.status, response.getheader('Retry-After')
+    finally:
+        connection.close()
+
+
+def test_rate_limit_spares_control_routes(server):
+    assert [get(server, '/stats')[0] for _ in range(2)] == [200, 200]
+    status, retry_after = get(server, '/stats')
+    assert status == 503 and int(retry_after) >= 1
+    assert get(server, '/start')[0] == 200
@@ -0,0 +1,93 @@
+from collections import OrderedDict
+import json
+
+from telemetry_emulator.checkpoint import restore_checkpoint, save_checkpoint
+from telemetry_emulator.emulator import Emulator
+from telemetry_emulator.fleet import Fleet
+
+
+def make_fleet(vertex_pool):
+    return Fleet(OrderedDict((vin, Emulator(vertex_pool, seed=i)) for i, vin in enumerate(['V0', 'V1', 'V2'])))
+
+
+def drive(fleet, ticks):
+    for _ in range(ticks):
+        fleet.update(1.0)
+
+
+def snapshot(fleet):
+    return {vin: emulator.get_data() for vin, emulator in fleet.vehicles.items()}
+
+
+def test_round_trip(tmp_path, vertex_pool):
+    path = str(tmp_path / 'checkpoint.json')
+    fleet = make_fleet(vertex_pool)
+    drive(fleet, 50)
+    save_checkpoint(path, fleet)
+
+    restored = make_fleet(vertex_pool)
+    assert restore_checkpoint(path, restored) == ['V0', 'V1', 'V2']
+    assert snapshot(restored) == snapshot(fleet)
+    # the restored fleet continues exactly where the saved one was
+    drive(fleet, 50)
+    drive(restored, 50)
+    assert snapshot(restored) == snapshot(fleet)
+
+
+def test_missing_file(tmp_path, vertex_pool):
+    assert restore_checkpoint(str(tmp_path / 'missing.json'), make_fleet(vertex_pool)) == []
+
+
+def test_corrupt_file(tmp_path, vertex_pool):
+    path = tmp_path / 'checkpoint.json'
+    fresh = snapshot(make_fleet(vertex_pool))
+    for body in ('{"version": 2, "vehi', '[1, 2, 3]', '"state"', 'null'):
+        path.write_text(body)
+        fleet = make_fleet(vertex_pool)
+        assert restore_checkpoint(str(path), fleet) == []
+        assert snapshot(fleet) == fresh
+
+
+def test_malformed_vehicles_start_fresh(tmp_path, vertex_pool):
+    path = str(tmp_path / 'checkpoint.json')
+    fleet = make_fleet(vertex_pool)
+    drive(fleet, 50)
+    save_checkpoint(path, fleet)
+    with open(path) as file:
+        state = json.load(file)
+    fresh = snapshot(make_fleet(vertex_pool))
+
+    broken_states = []
+    without_vehicles = dict(state)
+    del without_vehicles["vehicles"]
+    broken_states.append(without_vehicles)
+    # the last vehicle is broken: the ones restored before it must be rolled back
+    missing_key = json.loads(json.dumps(state))
+    del missing_key["vehicles"]["V2"]["speed"]
+    broken_states.append(missing_key)
+    unknown_vertex = json.loads(json.dumps(state))
+    unknown_vertex["vehicles"]["V2"]["plan"][0][0] = 10 ** 9
+    broken_states.append(unknown_vertex)
+    wrong_type = json.loads(json.dumps(state))
+    wrong_type["vehicles"]["V2"]["timeline"] = 5
+    broken_states.append(wrong_type)
+
+    for broken in broken_states:
+        with open(path, 'w') as file:
+            json.dump(broken, file)
+        fleet = make_fleet(vertex_pool)
+        assert restore_checkpoint(path, fleet) == []
+        assert snapshot(fleet) == fresh
+
+
+def test_another_map(tmp_path, vertex_pool):
+    path = str(tmp_path / 'checkpoint.json')
+    fleet = make_fleet(vertex_pool)
+    drive(fleet, 10)
+    save_checkpoint(path, fleet)
+    with open(path) as file:
+        state = json.load(file)
+    state["map"]["checksum"] += 1
+    with open(path, 'w') as file:
+        json.dump(state, file)
+    assert restore_checkpoint(path, make_fleet(vertex_pool)) == []
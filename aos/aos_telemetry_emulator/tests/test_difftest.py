@@ -0,0 +1,58 @@
+from argparse import Namespace
+from collections import OrderedDict
+
+import pytest
+
+from telemetry_emulator.difftest import DEFAULT_TOLERANCES, Harness, engine_factory, make_cases
+from telemetry_emulator.emulator import Emulator
+from telemetry_emulator.fleet import Fleet
+
+
+def cases(vertex_pool, **kwargs):
+    args = dict(cases=2, seed=0, vehicles=5, ticks=300, time_delta=1.0, traffic=False, event_rate=0.1)
+    args.update(kwargs)
+    return make_cases(Namespace(**args), vertex_pool, None)
+
+
+@pytest.mark.parametrize('candidate, options', [
+    ('adaptive', {}),
+    ('adaptive', {"time_delta": 0.1, "traffic": True}),
+    ('checkpoint', {}),
+])
+def test_candidates_agree_with_reference(vertex_pool, candidate, options):
+    harness = Harness(vertex_pool, engine_factory('reference'), engine_factory(candidate, 50), DEFAULT_TOLERANCES,
+                      check_every=10)
+    for case in cases(vertex_pool, **options):
+        assert harness.run(case) is None
+
+
+class ReadHealedEmulator(Emulator):
+    """Differs from Emulator from tick 25 unless its telemetry was read after tick 20 and before the current tick"""
+
+    def __init__(self, vertex_pool, seed=None):
+        super().__init__(vertex_pool, seed=seed)
+        self.read_ticks = []
+
+    def get_data(self):
+        self.read_ticks.append(self.tick)
+        return super().get_data()
+
+    @property
+    def speed(self):
+        if self.tick >= 25 and not any(20 < tick < self.tick for tick in self.read_ticks):
+            return self._speed + 1
+        return self._speed
+
+
+def test_divergence_depending_on_reads_is_located(vertex_pool):
+    def candidate(vertex_pool, seeds, traffic):
+        return Fleet(OrderedDict(('V{:05d}'.format(i), ReadHealedEmulator(vertex_pool, seed=seed))
+                                 for i, seed in enumerate(seeds)), traffic=traffic)
+
+    harness = Harness(vertex_pool, engine_factory('reference'), candidate, DEFAULT_TOLERANCES, check_every=10)
+    report = harness.run(cases(vertex_pool, cases=1, ticks=100)[0])
+    assert report["tick"] == 25
+    assert report["vehicle"] == 'V00000'
+    assert {"field": "speed", "reference": report["state_after"]["reference"]["speed"],
+            "candidate": report["state_after"]["reference"]["speed"] + 1} in report["differences"]
+    assert report["state_before"]["reference"]["tick"] == 24
@@ -0,0 +1,112 @@
+import pytest
+
+from telemetry_emulator.geofence import GeofenceEngine, PolygonFence, RectangleFence, fence_from_dict
+
+# concave "U": the notch between the arms is outside
+U_SHAPE = [(0, 0), (3, 0), (3, 3), (2, 3), (2, 1), (1, 1), (1, 3), (0, 3)]
+
+
+def test_polygon_contains():
+    fence = PolygonFence('u', U_SHAPE)
+    assert fence.contains(0.5, 0.5)
+    assert fence.contains(0.5, 2.5)
+    assert fence.contains(2.5, 2.5)
+    assert not fence.contains(1.5, 2)
+    assert not fence.contains(-0.5, 0.5)
+    assert not fence.contains(4, 4)
+
+
+def test_polygon_contains_triangle():
+    fence = PolygonFence('triangle', [(0, 0), (4, 0), (0, 4)])
+    assert fence.contains(1, 1)
+    assert fence.contains(1.9, 1.9)
+    assert not fence.contains(2.1, 2.1)
+
+
+def test_rectangle_borders_are_outside():
+    fence = RectangleFence('r', 1, 1, 0, 0)
+    assert fence.contains(0.5, 0.5)
+    assert not fence.contains(0, 0.5)
+    assert not fence.contains(0.5, 1)
+
+
+def test_fence_from_dict():
+    fence = fence_from_dict({"name": "p", "type": "polygon", "points": U_SHAPE, "vehicles": ["V0"]})
+    assert isinstance(fence, PolygonFence)
+    assert fence.applies_to('V0') and not fence.applies_to('V1')
+    assert fence_from_dict(fence.to_dict()).to_dict() == fence.to_dict()
+    for data in ({"type": "polygon", "points": U_SHAPE}, {"name": "p", "type": "polygon", "points": U_SHAPE[:2]},
+                 {"name": "r", "rectangle": [0, 0, 1]}, {"name": "c", "type": "circle"},
+                 {"name": "r", "rectangle": [0, 0, 1, 1], "vehicles": "V0"}):
+        with pytest.raises(ValueError):
+            fence_from_dict(data)
+
+
+def events(engine, seq=0):
+    return [(event["vin"], event["fence"], event["event"]) for event in engine.events_since(seq)[0]]
+
+
+def test_enter_and_exit_events():
+    engine = GeofenceEngine()
+    engine.add_fence(PolygonFence('u', U_SHAPE))
+    engine.add_fence(RectangleFence('left', 0, 0, 1.5, 3))
+    engine.update('V0', -1, 0.5, tick=1)
+    assert events(engine) == []
+
+    engine.update('V0', 0.5, 0.5, tick=2)
+    assert events(engine) == [('V0', 'left', 'enter'), ('V0', 'u', 'enter')]
+    assert engine.inside('V0') == ['left', 'u']
+
+    # moves inside both fences: no events
+    engine.update('V0', 0.5, 2.5, tick=3)
+    assert len(events(engine)) == 2
+
+    # the notch of the U
+    engine.update('V0', 1.4, 2, tick=4)
+    assert events(engine)[2:] == [('V0', 'u', 'exit')]
+    engine.update('V0', 2.5, 2, tick=5)
+    assert events(engine)[3:] == [('V0', 'left', 'exit'), ('V0', 'u', 'enter')]
+    assert engine.events_since(0)[0][-1]["tick"] == 5
+
+
+def test_fence_of_other_vehicles():
+    engine = GeofenceEngine()
+    engine.add_fence(RectangleFence('r', 0, 0, 1, 1, vehicles=['V1']))
+    engine.update('V0', 0.5, 0.5)
+    engine.update('V1', 0.5, 0.5)
+    assert events(engine) == [('V1', 'r', 'enter')]
+
+
+def test_added_fence_is_checked_without_movement():
+    engine = GeofenceEngine()
+    engine.update('V0', 0.5, 0.5, tick=1)
+    engine.add_fence(RectangleFence('r', 0, 0, 1, 1))
+    engine.update('V0', 0.5, 0.5, tick=1)
+    assert events(engine) == [('V0', 'r', 'enter')]
+
+
+def test_remove_fence_emits_exit():
+    engine = GeofenceEngine()
+    engine.add_fence(RectangleFence('r', 0, 0, 1, 1))
+    engine.update('V0', 0.5, 0.5, tick=7)
+    assert engine.remove_fence('r')
+    assert not engine.remove_fence('r')
+    assert events(engine) == [('V0', 'r', 'enter'), ('V0', 'r', 'exit')]
+    exit_event = engine.events_since(1)[0][0]
+    assert (exit_event["lon"], exit_event["lat"], exit_event["tick"]) == (0.5, 0.5, 7)
+    assert engine.inside('V0') == []
+
+
+def test_events_since():
+    engine = GeofenceEngine()
+    engine.add_fence(RectangleFence('r', 0, 0, 1, 1))
+    for tick in range(5):
+        engine.update('V{}'.format(tick), 0.5, 0.5, tick=tick)
+    page, next_seq = engine.events_since(0, limit=2)
+    assert [event["seq"] for event in page] == [1, 2] and next_seq == 2
+    page, next_seq = engine.events_since(next_seq)
+    assert [event["seq"] for event in page] == [3, 4, 5] and next_seq == 5
+    assert engine.events_since(next_seq, wait=0.01) == ([], 5)
+    assert [event["vin"] for event in engine.events_since(0, vin='V3')[0]] == ['V3']
+    with pytest.raises(ValueError):
+        engine.events_since(0, limit=0)
@@ -0,0 +1,79 @@
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+
+from telemetry_emulator.history import FIELDS, FleetHistory, VehicleHistory, downsample
+
+
+def sample(value):
+    # integer values are exact in every array type of the fields
+    return SimpleNamespace(**{attribute: value for _, attribute, _ in FIELDS})
+
+
+class StubFleet:
+    def __init__(self, vins):
+        self.vehicles = OrderedDict((vin, sample(0)) for vin in vins)
+
+    def __iter__(self):
+        return iter(self.vehicles)
+
+
+def test_range_before_wraparound():
+    history = VehicleHistory(10)
+    for i in range(4):
+        history.append(100.0 + i, sample(i))
+    timestamps, values = history.range()
+    assert timestamps == [100.0, 101.0, 102.0, 103.0]
+    assert values["speed"] == [0, 1, 2, 3]
+
+
+def test_wraparound_keeps_the_newest_samples():
+    history = VehicleHistory(5)
+    for i in range(13):
+        history.append(100.0 + i, sample(i))
+    assert history.count == 5
+    timestamps, values = history.range()
+    assert timestamps == [108.0, 109.0, 110.0, 111.0, 112.0]
+    assert values["rpm"] == [8, 9, 10, 11, 12]
+    # bounds are inclusive and work across the end of the arrays
+    timestamps, values = history.range(109.0, 111.0, fields=("gear",))
+    assert timestamps == [109.0, 110.0, 111.0]
+    assert values == {"gear": [9, 10, 11]}
+    assert history.range(100.0, 107.0) == ([], {name: [] for name, _, _ in FIELDS})
+    assert history.range(111.5)[0] == [112.0]
+
+
+def test_downsample():
+    timestamps = [0.0, 1.0, 2.0, 3.0, 4.0, 7.0]
+    buckets = downsample(timestamps, {"speed": [1, 3, 5, 7, 9, 11]}, 0.0, 2.0)
+    assert buckets == [
+        {"timestamp": 0.0, "count": 2, "speed": {"min": 1, "max": 3, "mean": 2.0}},
+        {"timestamp": 2.0, "count": 2, "speed": {"min": 5, "max": 7, "mean": 6.0}},
+        {"timestamp": 4.0, "count": 1, "speed": {"min": 9, "max": 9, "mean": 9.0}},
+        # empty buckets are skipped
+        {"timestamp": 6.0, "count": 1, "speed": {"min": 11, "max": 11, "mean": 11.0}},
+    ]
+
+
+def test_query_downsampled_after_wraparound():
+    fleet = StubFleet(['V0', 'V1'])
+    history = FleetHistory(fleet, 6)
+    for i in range(10):
+        fleet.vehicles['V0'] = sample(i)
+        fleet.vehicles['V1'] = sample(-i)
+        history.record(1000.0 + i)
+
+    samples = history.query('V0', fields=("speed",))
+    assert [(s["timestamp"], s["speed"]) for s in samples] == [(1000.0 + i, i) for i in range(4, 10)]
+    assert history.query('V1', start=1009.0)[0]["rpm"] == -9
+
+    buckets = history.query('V0', start=1003.0, step=3, fields=("speed",))
+    assert [(b["timestamp"], b["count"], b["speed"]["mean"]) for b in buckets] == [
+        (1003.0, 2, 4.5), (1006.0, 3, 7.0), (1009.0, 1, 9.0)]
+    # aligned to the first sample without start
+    assert [b["timestamp"] for b in history.query('V0', step=4)] == [1004.0, 1008.0]
+    assert history.query('V0', start=2000.0, step=3) == []
+    assert 'V1' in history and 'V2' not in history
+    with pytest.raises(KeyError):
+        history.query('V2')
@@ -0,0 +1,29 @@
+from collections import OrderedDict
+
+from telemetry_emulator.emulator import Emulator
+from telemetry_emulator.fleet import Fleet
+from telemetry_emulator.scenario import parse_scenario
+
+
+def test_due_events_run_in_time_order(vertex_pool):
+    fleet = Fleet(OrderedDict(V0=Emulator(vertex_pool, seed=0)))
+    # a long tick: both events become due on the same update, the later one must win
+    fleet.load_scenario(parse_scenario([
+        {"at": 2.5, "command": "madness", "args": [0.3]},
+        {"at": 2.0, "command": "madness", "args": [0.7]},
+    ]))
+    fleet.update(3.0)
+    fleet.update(3.0)
+    assert fleet.scenario.executed == 2
+    assert fleet['V0'].madness == 0.3
+
+
+def test_same_time_events_run_in_file_order(vertex_pool):
+    fleet = Fleet(OrderedDict(V0=Emulator(vertex_pool, seed=0)))
+    fleet.load_scenario(parse_scenario([
+        {"tick": 1, "command": "madness", "args": [0.3]},
+        {"tick": 1, "command": "madness", "args": [0.7]},
+    ]))
+    fleet.update(1.0)
+    fleet.update(1.0)
+    assert fleet['V0'].madness == 0.7
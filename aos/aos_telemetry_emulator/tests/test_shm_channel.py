@@ -0,0 +1,85 @@
+import threading
+
+from telemetry_emulator.shm_channel import TelemetryReader, TelemetryWriter, _SEQ, _SEQ_OFFSET
+
+
+def telemetry(value):
+    # every field has the same value, a torn snapshot would mix values of two ticks
+    return {"speed": float(value), "odometer": value, "in_rectangle": None, "rectangle_long0": None, "moving": True}
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'channel')
+    writer = TelemetryWriter(path)
+    writer.publish(1, telemetry(1), timestamp=10.0)
+    reader = TelemetryReader(path)
+    assert reader.read() == (1, 10.0, telemetry(1))
+    writer.publish(2, telemetry(2), timestamp=11.0)
+    assert reader.read() == (2, 11.0, telemetry(2))
+    reader.close()
+    writer.close()
+
+
+def test_reader_retries_while_writer_updates(tmp_path):
+    path = str(tmp_path / 'channel')
+    writer = TelemetryWriter(path)
+    writer.publish(1, telemetry(1), timestamp=10.0)
+    reader = TelemetryReader(path)
+
+    # the writer is in the middle of an update: the counter is odd
+    _SEQ.pack_into(writer._mm, _SEQ_OFFSET, writer._seq + 1)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(reader.read()))
+    thread.start()
+    thread.join(0.2)
+    assert thread.is_alive()
+
+    writer.publish(2, telemetry(2), timestamp=11.0)
+    thread.join(5)
+    assert result == [(2, 11.0, telemetry(2))]
+    reader.close()
+    writer.close()
+
+
+def test_no_torn_snapshots(tmp_path):
+    path = str(tmp_path / 'channel')
+    writer = TelemetryWriter(path)
+    writer.publish(1, telemetry(1))
+    reader = TelemetryReader(path)
+    stop = threading.Event()
+
+    def write():
+        tick = 1
+        while not stop.is_set():
+            tick += 1
+            writer.publish(tick, telemetry(tick))
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    try:
+        for _ in range(20000):
+            tick, _, data = reader.read()
+            assert data["odometer"] == tick and data["speed"] == tick
+    finally:
+        stop.set()
+        thread.join()
+    reader.close()
+    writer.close()
+
+
+def test_new_writer_with_smaller_layout(tmp_path):
+    path = str(tmp_path / 'channel')
+    writer = TelemetryWriter(path)
+    # layout of several pages
+    writer.publish(1, dict(telemetry(1), **{"extra_field_{}".format(i): i for i in range(1000)}))
+    reader = TelemetryReader(path)
+    writer.close()
+
+    # restart with fewer fields: the file of the old layout is replaced, not shrunk under the mapping of the reader
+    writer = TelemetryWriter(path)
+    writer.publish(7, telemetry(7), timestamp=20.0)
+    # the last page of the old mapping is still backed by the file, a shrunk file would raise SIGBUS here
+    assert reader._mm[len(reader._mm) - 1] is not None
+    assert reader.read() == (7, 20.0, telemetry(7))
+    reader.close()
+    writer.close()
@@ -0,0 +1,39 @@
+import random
+import sys
+import threading
+
+from telemetry_emulator.tiles import TiledVertexPool, build_tiles
+
+
+def test_tiles_are_shared_by_threads(tmp_path, vertex_pool):
+    path = str(tmp_path / 'grid.tiles')
+    build_tiles(vertex_pool, path, tile_size=300)
+    # a budget of a couple of tiles: most reads load a tile and evict another one
+    pool = TiledVertexPool(path, memory_budget=1)
+    errors = []
+
+    def read(seed):
+        rng = random.Random(seed)
+        try:
+            for _ in range(5000):
+                item = rng.randrange(len(pool))
+                assert pool[item].id == item
+        except Exception as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=read, args=(seed,)) for seed in range(8)]
+    # switch threads as often as possible, so they interleave inside tile loads
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert errors == []
+    assert set(pool._tiles) == set(pool._tile_sizes)
+    assert pool.memory_used == sum(pool._tile_sizes.values())
+    assert pool.tile_loads - pool.tile_evictions == len(pool._tiles)
+    pool.close()
@@ -0,0 +1,67 @@
+import math
+import random
+
+import pytest
+
+from telemetry_emulator.trip import RunningStats, TripStats
+
+
+def two_pass(values):
+    mean = sum(values) / len(values)
+    return mean, sum((value - mean) ** 2 for value in values) / len(values)
+
+
+def running_stats(values):
+    stats = RunningStats()
+    for value in values:
+        stats.add(value)
+    return stats
+
+
+def assert_matches(stats, values):
+    mean, variance = two_pass(values)
+    assert stats.count == len(values)
+    assert stats.mean == pytest.approx(mean, rel=1e-12, abs=1e-12)
+    assert stats.variance == pytest.approx(variance, rel=1e-9)
+    assert (stats.min, stats.max) == (min(values), max(values))
+
+
+def test_welford_matches_two_pass():
+    rng = random.Random(1)
+    # large offset and small spread: the naive sum of squares loses most digits here
+    values = [1e6 + rng.gauss(0, 0.5) for _ in range(10000)]
+    assert_matches(running_stats(values), values)
+
+
+def test_merge_matches_two_pass():
+    rng = random.Random(2)
+    parts = [[rng.uniform(-20, 120) + offset for _ in range(rng.randrange(1, 500))] for offset in (0, 50, 1000, -7)]
+    merged = RunningStats()
+    for part in parts:
+        merged.merge(running_stats(part))
+    assert_matches(merged, [value for part in parts for value in part])
+
+
+def test_merge_with_empty():
+    stats = running_stats([1.0, 2.0, 4.0])
+    stats.merge(RunningStats())
+    assert_matches(stats, [1.0, 2.0, 4.0])
+    empty = RunningStats()
+    empty.merge(stats)
+    assert_matches(empty, [1.0, 2.0, 4.0])
+    assert RunningStats().to_dict() == {"count": 0, "mean": 0.0, "stddev": 0.0, "min": None, "max": None}
+
+
+def test_trip_merge():
+    first, second = TripStats(), TripStats()
+    first.distance, second.distance = 100.0, 300.0
+    first.duration, second.duration = 10.0, 30.0
+    first.speed, second.speed = running_stats([10.0, 20.0]), running_stats([30.0])
+    total = TripStats()
+    total.merge(first)
+    total.merge(second)
+    summary = total.to_dict()
+    assert summary["distance"] == 400.0
+    assert summary["average_speed"] == pytest.approx(36.0)
+    assert summary["speed"]["mean"] == pytest.approx(20.0)
+    assert summary["speed"]["stddev"] == pytest.approx(math.sqrt(200 / 3))
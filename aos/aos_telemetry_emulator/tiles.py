@@ -0,0 +1,277 @@
+"""
+Tiled map storage: the road graph is split into square tiles of metre coordinates which are loaded on demand.
+
+Vertices are renumbered so ids of every tile are contiguous, the tile of a vertex is found by bisect over the first
+ids of tiles. A tile is read when one of its vertices is needed, e.g. when a plan of a vehicle is extended to it, and
+least recently used tiles are dropped when the memory budget is exceeded. Neighbours refer to vertices by id, so
+crossing a tile border is transparent for the routing code.
+
+File layout (little endian):
+
+    offset 0   header: magic, version, reserved, tile size, min latitude, min longitude,
+               vertex count, tile count, directory offset
+    offset 56  tiles: every vertex is x, y (double), neighbour count (uint16), neighbour ids (uint32)
+    ...        directory: tx, ty, first vertex id, vertex count, offset and length of every tile, sorted by first id
+
+Usage:
+    python tiles.py build map.json map.tiles [--tile-size 1000]
+    python tiles.py info map.tiles
+"""
+import argparse
+from bisect import bisect_right
+from collections import OrderedDict
+import json
+import math
+import os
+import struct
+import sys
+import threading
+import zlib
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telemetry_emulator.emulator import Vertex, VertexPool
+
+MAGIC = b'TLMT'
+VERSION = 1
+DEFAULT_TILE_SIZE = 1000  # meters
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024  # bytes
+
+_HEADER = struct.Struct('<4sHHdddQQQ')
+_DIRECTORY_ENTRY = struct.Struct('<iiQIQI')
+_VERTEX = struct.Struct('<ddH')
+_NEIGHBOUR = struct.Struct('<I')
+
+# the file is read by chunks of this size to compute its checksum
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+# rough size of python objects of one vertex, is used to keep loaded tiles within memory budget
+VERTEX_SIZE_ESTIMATE = 260
+NEIGHBOUR_SIZE_ESTIMATE = 36
+
+
+class TileFormatError(Exception):
+    pass
+
+
+def tile_of(x, y, tile_size):
+    return int(math.floor(x / tile_size)), int(math.floor(y / tile_size))
+
+
+class TileFileWriter:
+    """
+    Writes tile file tile by tile. Ids of vertices are given by the order of writing: the first vertex of the first
+    tile has id 0, so neighbour ids must already be numbered this way.
+    """
+
+    def __init__(self, path, min_lat, min_lon, tile_size=DEFAULT_TILE_SIZE):
+        self.path = path
+        self.min_lat = min_lat
+        self.min_lon = min_lon
+        self.tile_size = tile_size
+        self._directory = []
+        self._next_id = 0
+        self._file = open(path, 'wb')
+        self._file.write(bytes(_HEADER.size))
+
+    def add_tile(self, tx, ty, vertices):
+        """vertices - iterable of (x, y, neighbour ids). Returns id of the first vertex of the tile"""
+        chunks = []
+        count = 0
+        for x, y, neighbours in vertices:
+            chunks.append(_VERTEX.pack(x, y, len(neighbours)))
+            chunks.append(struct.pack('<{}I'.format(len(neighbours)), *neighbours))
+            count += 1
+        data = b''.join(chunks)
+        first_id = self._next_id
+        self._directory.append((tx, ty, first_id, count, self._file.tell(), len(data)))
+        self._file.write(data)
+        self._next_id += count
+        return first_id
+
+    def close(self):
+        directory_offset = self._file.tell()
+        for entry in self._directory:
+            self._file.write(_DIRECTORY_ENTRY.pack(*entry))
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(MAGIC, VERSION, 0, self.tile_size, self.min_lat, self.min_lon,
+                                      self._next_id, len(self._directory), directory_offset))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+
+def build_tiles(vertex_pool: VertexPool, path, tile_size=DEFAULT_TILE_SIZE):
+    """Writes vertices of the pool to tile file. Returns dict of old vertex id -> new vertex id"""
+    tiles = {}
+    for vertex in vertex_pool.vertices:
+        tiles.setdefault(tile_of(vertex.x, vertex.y, tile_size), []).append(vertex)
+    # rows of tiles, so that neighbour tiles of a row are close in the file
+    order = sorted(tiles, key=lambda tile: (tile[1], tile[0]))
+
+    new_ids = {}
+    for tile in order:
+        for vertex in tiles[tile]:
+            new_ids[vertex.id] = len(new_ids)
+
+    with TileFileWriter(path, vertex_pool.min_lat, vertex_pool.min_lon, tile_size) as writer:
+        for tx, ty in order:
+            writer.add_tile(tx, ty, ((v.x, v.y, [new_ids[n] for n in v.neighbors]) for v in tiles[(tx, ty)]))
+    return new_ids
+
+
+class TiledVertexPool(VertexPool):
+    """VertexPool which keeps in memory only recently used tiles of the tile file"""
+
+    def __init__(self, filename, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.filename = filename
+        self.memory_budget = memory_budget
+        self._fd = os.open(filename, os.O_RDONLY)
+        self._tiles = OrderedDict()  # tile index -> list of vertices, in order of use
+        self._tile_sizes = {}
+        self.memory_used = 0
+        self.tile_loads = 0
+        self.tile_evictions = 0
+        self._last_tile = None  # (first id, end id, vertices) of the last used tile
+        self._lock = threading.Lock()
+        self._load_directory()
+
+    def _load_directory(self):
+        header = os.pread(self._fd, _HEADER.size, 0)
+        if len(header) != _HEADER.size:
+            raise TileFormatError("{} is too short".format(self.filename))
+        magic, version, _, self.tile_size, self.min_lat, self.min_lon, self._vertex_count, tile_count, \
+            directory_offset = _HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise TileFormatError("{} is not a tile file of version {}".format(self.filename, VERSION))
+        data = os.pread(self._fd, tile_count * _DIRECTORY_ENTRY.size, directory_offset)
+        self._directory = list(_DIRECTORY_ENTRY.iter_unpack(data))
+        self._first_ids = [entry[2] for entry in self._directory]
+        self.checksum = self._file_checksum(directory_offset + len(data))
+
+    def _file_checksum(self, end):
+        """CRC32 of tiles and directory, the file is read by chunks without loading tiles"""
+        checksum = 0
+        offset = _HEADER.size
+        while offset < end:
+            data = os.pread(self._fd, min(CHECKSUM_CHUNK_SIZE, end - offset), offset)
+            if not data:
+                raise TileFormatError("{} is truncated".format(self.filename))
+            checksum = zlib.crc32(data, checksum)
+            offset += len(data)
+        return checksum
+
+    def fingerprint(self):
+        return {
+            "format": "tiles",
+            "vertices": len(self),
+            "tile_size": self.tile_size,
+            "min_latitude": self.min_lat,
+            "min_longitude": self.min_lon,
+            "checksum": self.checksum,
+        }
+
+    @property
+    def vertices(self):
+        """All vertices of the map. Loads every tile, is meant for tools only"""
+        return [self[i] for i in range(len(self))]
+
+    def __len__(self):
+        return self._vertex_count
+
+    def __getitem__(self, item):
+        last_tile = self._last_tile
+        if last_tile is not None and last_tile[0] <= item < last_tile[1]:
+            return last_tile[2][item - last_tile[0]]
+        if not 0 <= item < self._vertex_count:
+            raise IndexError("vertex id {} is out of range".format(item))
+        index = bisect_right(self._first_ids, item) - 1
+        # vertices are read by request handlers too: the tile cache and its accounting are changed under the lock,
+        # the last tile is replaced as a whole tuple, so the check above needs no lock
+        with self._lock:
+            vertices = self._tiles.get(index)
+            if vertices is None:
+                vertices = self._load_tile(index)
+            else:
+                self._tiles.move_to_end(index)
+            first_id = self._first_ids[index]
+            self._last_tile = (first_id, first_id + len(vertices), vertices)
+        return vertices[item - first_id]
+
+    def _load_tile(self, index):
+        _, _, first_id, count, offset, length = self._directory[index]
+        data = os.pread(self._fd, length, offset)
+        vertices = []
+        position = 0
+        neighbours_size = 0
+        for vertex_id in range(first_id, first_id + count):
+            x, y, neighbours_count = _VERTEX.unpack_from(data, position)
+            position += _VERTEX.size
+            neighbours = list(struct.unpack_from('<{}I'.format(neighbours_count), data, position))
+            position += neighbours_count * _NEIGHBOUR.size
+            neighbours_size += neighbours_count
+            vertices.append(Vertex(vertex_id, x, y, neighbours))
+
+        size = count * VERTEX_SIZE_ESTIMATE + neighbours_size * NEIGHBOUR_SIZE_ESTIMATE
+        self._tiles[index] = vertices
+        self._tile_sizes[index] = size
+        self.memory_used += size
+        self.tile_loads += 1
+        self._evict(keep=index)
+        return vertices
+
+    def _evict(self, keep):
+        # vertices referred by plans of vehicles stay alive, only the tile cache drops them
+        while self.memory_used > self.memory_budget and len(self._tiles) > 1:
+            index = next(iter(self._tiles))
+            if index == keep:
+                self._tiles.move_to_end(index)
+                continue
+            del self._tiles[index]
+            self.memory_used -= self._tile_sizes.pop(index)
+            self.tile_evictions += 1
+        self._last_tile = None
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and inspect tiled maps")
+    subparsers = parser.add_subparsers(dest='command')
+    build_parser = subparsers.add_parser('build', help="convert map.json to tile file")
+    build_parser.add_argument('source', help="map in VertexPool JSON format")
+    build_parser.add_argument('target', help="tile file to write")
+    build_parser.add_argument('--tile-size', type=float, default=DEFAULT_TILE_SIZE, help="tile size in meters")
+    info_parser = subparsers.add_parser('info', help="print summary of tile file")
+    info_parser.add_argument('path')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        vertex_pool = VertexPool(args.source)
+        build_tiles(vertex_pool, args.target, args.tile_size)
+        print("{} vertices are written to {}".format(len(vertex_pool), args.target))
+    elif args.command == 'info':
+        pool = TiledVertexPool(args.path)
+        counts = [entry[3] for entry in pool._directory]
+        print(json.dumps({
+            "fingerprint": pool.fingerprint(),
+            "tiles": len(counts),
+            "max_vertices_per_tile": max(counts) if counts else 0,
+            "file_size": os.path.getsize(args.path),
+        }, indent=2))
+        pool.close()
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Occupancy of directed road graph edges by fleet vehicles.
+
+Vehicle is on the edge from the previous vertex of its plan to the current one. The index is updated after every
+vehicle update, a vehicle is moved between edges only when it turns, so the update is O(1). Vehicles look up the
+nearest vehicle ahead on their current and upcoming edges in Emulator._find_leader().
+"""
+
+
+class TrafficIndex:
+    def __init__(self):
+        self._edges = {}  # (from vertex id, to vertex id) -> {key: emulator}
+        self._vehicle_edges = {}  # key -> edge
+
+    def update(self, key, emulator):
+        edge = emulator.edge
+        old_edge = self._vehicle_edges.get(key)
+        if old_edge == edge:
+            return
+        if old_edge is not None:
+            self._remove_from_edge(key, old_edge)
+        self._vehicle_edges[key] = edge
+        self._edges.setdefault(edge, {})[key] = emulator
+
+    def remove(self, key):
+        edge = self._vehicle_edges.pop(key, None)
+        if edge is not None:
+            self._remove_from_edge(key, edge)
+
+    def _remove_from_edge(self, key, edge):
+        vehicles = self._edges[edge]
+        del vehicles[key]
+        if not vehicles:
+            del self._edges[edge]
+
+    def on_edge(self, edge):
+        """Emulators on the directed edge"""
+        vehicles = self._edges.get(edge)
+        return vehicles.values() if vehicles else ()
+
+    def __len__(self):
+        return len(self._vehicle_edges)
@@ -0,0 +1,176 @@
+"""
+Trip analytics maintained by the simulation loop.
+
+Every tick adds O(1) work per vehicle: counters of events, time-weighted sums and running mean/variance
+(Welford's algorithm). Fleet totals are merged from vehicle aggregates when they are requested
+(Chan et al. parallel variance), so no samples are stored.
+"""
+import math
+import threading
+
+from telemetry_emulator.emulator import TurnSignal
+
+
+class RunningStats:
+    """Running count, mean, variance, min and max of a value"""
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: 'RunningStats'):
+        if not other.count:
+            return
+        if not self.count:
+            self.count, self.mean, self.m2, self.min, self.max = other.count, other.mean, other.m2, other.min, \
+                other.max
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else 0.0
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "stddev": math.sqrt(self.variance),
+            "min": self.min,
+            "max": self.max,
+        }
+
+
+class TripStats:
+    HARSH_BRAKING = -3  # m/s^2
+
+    def __init__(self, emulator=None):
+        self.duration = 0.0
+        self.moving_time = 0.0
+        self.distance = 0.0  # meters
+        self.fuel_used = 0.0  # liters
+        self.harsh_braking = 0
+        self.stops = 0
+        self.time_in_rectangle = 0.0
+        self.turn_signals = 0
+        self.turn_signal_time = 0.0
+        self.speed = RunningStats()  # km/h, one sample per tick
+        self.acceleration = RunningStats()  # m/s^2
+        # values of the previous tick to detect events
+        self._odometer = emulator._odometer if emulator is not None else None
+        self._moving = emulator is not None and emulator.speed > 0
+        self._harsh_braking = False
+        self._turn_signal = emulator.turn_signal if emulator is not None else TurnSignal.DISABLED
+
+    def update(self, emulator, time_delta):
+        self.duration += time_delta
+        odometer = emulator._odometer
+        if self._odometer is not None:
+            path = odometer - self._odometer
+            self.distance += path
+            self.fuel_used += emulator.fuel_consumption * path / 100000  # l/100km
+        self._odometer = odometer
+
+        speed = emulator.speed
+        moving = speed > 0
+        if moving:
+            self.moving_time += time_delta
+        elif self._moving:
+            self.stops += 1
+        self._moving = moving
+        self.speed.add(emulator.speed_kmph)
+
+        acceleration = emulator.acceleration
+        self.acceleration.add(acceleration)
+        harsh_braking = acceleration < self.HARSH_BRAKING
+        if harsh_braking and not self._harsh_braking:
+            self.harsh_braking += 1
+        self._harsh_braking = harsh_braking
+
+        if emulator.in_rectangle:
+            self.time_in_rectangle += time_delta
+
+        turn_signal = emulator.turn_signal
+        if turn_signal in (TurnSignal.LEFT, TurnSignal.RIGHT):
+            self.turn_signal_time += time_delta
+            if turn_signal != self._turn_signal:
+                self.turn_signals += 1
+        self._turn_signal = turn_signal
+
+    def merge(self, other: 'TripStats'):
+        for name in ('duration', 'moving_time', 'distance', 'fuel_used', 'harsh_braking', 'stops',
+                     'time_in_rectangle', 'turn_signals', 'turn_signal_time'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.speed.merge(other.speed)
+        self.acceleration.merge(other.acceleration)
+
+    def to_dict(self):
+        return {
+            "duration": self.duration,
+            "moving_time": self.moving_time,
+            "distance": self.distance,
+            "average_speed": self.distance / self.duration * 3.6 if self.duration else 0.0,  # km/h, time-weighted
+            "fuel_used": self.fuel_used,
+            "fuel_consumption": self.fuel_used / self.distance * 100000 if self.distance else 0.0,  # l/100km
+            "harsh_braking": self.harsh_braking,
+            "stops": self.stops,
+            "time_in_rectangle": self.time_in_rectangle,
+            "turn_signals": self.turn_signals,
+            "turn_signal_time": self.turn_signal_time,
+            "speed": self.speed.to_dict(),
+            "acceleration": self.acceleration.to_dict(),
+        }
+
+
+class FleetTrips:
+    def __init__(self, fleet):
+        self.fleet = fleet
+        self._vehicles = {vin: TripStats(emulator) for vin, emulator in fleet.vehicles.items()}
+        self._lock = threading.Lock()
+
+    def update(self, vin, emulator, time_delta):
+        # readers and reset() see the trip either before or after the tick, never half-updated
+        with self._lock:
+            self._vehicles[vin].update(emulator, time_delta)
+
+    def vehicle(self, vin):
+        with self._lock:
+            return self._vehicles[vin].to_dict()
+
+    def total(self):
+        result = TripStats()
+        with self._lock:
+            for trip in list(self._vehicles.values()):
+                result.merge(trip)
+        summary = result.to_dict()
+        summary["vehicles"] = len(self._vehicles)
+        return summary
+
+    def reset(self, vin=None):
+        """Starts new trip of the vehicle or of all vehicles"""
+        with self._lock:
+            for reset_vin in ([vin] if vin is not None else list(self._vehicles)):
+                self._vehicles[reset_vin] = TripStats(self.fleet[reset_vin])
+
+    def __contains__(self, vin):
+        return vin in self._vehicles